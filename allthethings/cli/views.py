@@ -18,15 +18,28 @@ import hashlib
 import zstandard
 import datetime
 import io
+import contextlib
+import tempfile
+import glob
+import random
+import struct
+import copy
+import bisect
+import mmap
+import shutil
+import queue
+import threading
+import multiprocessing
+import multiprocessing.util
 
 import allthethings.utils
 
-from flask import Blueprint
-from allthethings.extensions import engine, mariadb_url_no_timeout, mail, mariapersist_url
+from flask import Blueprint, Flask
+from allthethings.extensions import engine, mariadb_url_no_timeout, mail, mariapersist_url, babel
 from sqlalchemy import create_engine
 from sqlalchemy.orm import Session
 from pymysql.constants import CLIENT
-from config.settings import SLOW_DATA_IMPORTS
+from config.settings import SLOW_DATA_IMPORTS, AAC_READAHEAD_FOR_BUILDS, AAC_BLOCK_CACHE_MAX_BYTES_FOR_BUILDS, AARECORDS_BUILD_TEMP_DIR
 
 from allthethings.page.views import get_aarecords_mysql, get_isbndb_dicts
 
@@ -131,21 +144,94 @@ def mysql_reset_aac_tables_internal():
         connection.connection.ping(reconnect=True)
         cursor = connection.connection.cursor(pymysql.cursors.SSDictCursor)
         cursor.execute('DROP TABLE IF EXISTS annas_archive_meta_aac_filenames')
+        cursor.execute('DROP TABLE IF EXISTS annas_archive_meta_aac_checkpoints')
     print("Done!")
 
 #################################################################################################
 # Rebuild "annas_archive_meta_*" tables, if they have changed.
 # ./run flask cli mysql_build_aac_tables
+#
+# AAC files are append-only, so when a new file still contains the last indexed line of the
+# previous one at the same byte offset (recorded in annas_archive_meta_aac_filenames), only
+# the new tail is added to the existing table. Run mysql_reset_aac_tables first to force a
+# full rebuild.
+#
+# After every chunk that is inserted, the byte offset and row count are saved in
+# annas_archive_meta_aac_checkpoints. If indexing gets interrupted, `--resume` continues each
+# unfinished collection from its checkpoint (as long as the file is the same), instead of
+# starting over. Rows past the checkpoint are deleted first, since they might be incomplete.
+# With `--bulk-load` nothing is inserted until the end, so no checkpoints are saved.
+# ./run flask cli mysql_build_aac_tables --resume
+#
+# With `--sidecar-index`, each finished table is also written to sorted, fixed-width
+# *.primary_id.idx files (and *.md5.idx for allthethings.utils.AAC_SIDECAR_MD5_COLLECTIONS) next to
+# the AAC file, which are memory-mapped and binary searched by allthethings.utils.aac_sidecar_lookup,
+# skipping a MySQL query per lookup. Old sidecar
+# files of a collection are always deleted when it gets reindexed, so they never get out of sync.
+# ./run flask cli mysql_build_aac_tables --sidecar-index
+#
+# Collections are independent, so with `--workers N` up to N of them are indexed at the
+# same time, each in its own process. The total time then approaches that of the largest
+# collection (typically worldcat or duxiu_records) instead of the sum of all of them.
+# ./run flask cli mysql_build_aac_tables --workers 4
+#
+# Within a single collection, `--decode-workers N` splits the file into ranges (aligned to the
+# zstd frames of .seekable.zst files) that are decompressed and parsed by N processes, while
+# the rows are still inserted in file order.
+# ./run flask cli mysql_build_aac_tables --decode-workers 8
+#
+# With `--bulk-load`, rows are spooled to a local TSV file and loaded with LOAD DATA LOCAL INFILE,
+# with non-unique indexes disabled during the load and rebuilt at the end (DISABLE/ENABLE KEYS).
+# This is much faster than executemany for the largest collections. Per-phase timings are printed,
+# so the wall time can be compared against a run without `--bulk-load`.
+# ./run flask cli mysql_build_aac_tables --bulk-load
 @cli.cli.command('mysql_build_aac_tables')
-def mysql_build_aac_tables():
-    mysql_build_aac_tables_internal()
+@click.option('--workers', default=1, show_default=True, help='Number of collections to index concurrently.')
+@click.option('--decode-workers', default=1, show_default=True, help='Number of processes decoding and parsing each collection.')
+@click.option('--bulk-load', is_flag=True, help='Use LOAD DATA LOCAL INFILE instead of INSERT statements.')
+@click.option('--resume', is_flag=True, help='Continue interrupted collections from their last checkpoint.')
+@click.option('--sidecar-index', is_flag=True, help='Also write memory-mappable primary_id (and for some collections md5) index files.')
+def mysql_build_aac_tables(workers, decode_workers, bulk_load, resume, sidecar_index):
+    mysql_build_aac_tables_internal(workers=workers, decode_workers=decode_workers, bulk_load=bulk_load, resume=resume, sidecar_index=sidecar_index)
+
+AAC_COLLECTIONS_WITH_MULTIPLE_MD5 = ['magzdb_records', 'nexusstc_records']
+
+# Extra indexed columns of annas_archive_meta__aacid__* tables, per collection:
+#   column name => (column type, JSON path of the value in the AAC line, function applied to non-null values).
+# Values are pulled out with allthethings.utils.aac_json_path_extract, so the rest of the line isn't parsed.
+AAC_EXTRA_INDEX_FIELDS = {
+    'duxiu_records': {
+        'filename_decoded_basename': ('VARCHAR(250) NULL', ('metadata', 'record', 'filename_decoded'), lambda filename_decoded: filename_decoded.rsplit('.', 1)[0]),
+    },
+}
 
-def mysql_build_aac_tables_internal():
+def aac_extract_extra_index_fields(collection, line):
+    extra_fields = {}
+    for index_name, (index_type, json_path, transform) in AAC_EXTRA_INDEX_FIELDS.get(collection, {}).items():
+        value = None
+        # Quick check before scanning the line, since most lines don't have most fields.
+        if orjson.dumps(json_path[-1]) + b':' in line:
+            try:
+                value = allthethings.utils.aac_json_path_extract(line, json_path)
+            except ValueError:
+                value = orjson.loads(line)
+                for key in json_path:
+                    value = value.get(key) if isinstance(value, dict) else None
+            if value is not None:
+                value = transform(value)
+        extra_fields[index_name] = value
+    return extra_fields
+
+# Forked workers inherit the parent's engine pool, including its open connections, which the parent (and the
+# other workers) might still use. Drop them from this process's pool without closing them, so that the
+# worker opens its own connections.
+def mysql_build_aac_tables_init_pool():
+    engine.dispose(close=False)
+
+def mysql_build_aac_tables_internal(workers=1, decode_workers=1, bulk_load=False, resume=False, sidecar_index=False):
     print("Building aac tables...")
     file_data_files_by_collection = collections.defaultdict(list)
 
-    COLLECTIONS_WITH_MULTIPLE_MD5 = ['magzdb_records', 'nexusstc_records']
-
     for filename in os.listdir(allthethings.utils.aac_path_prefix()):
         if not (filename.startswith('annas_archive_meta__aacid__') and filename.endswith('.jsonl.seekable.zst')):
             continue
@@ -157,9 +243,13 @@ def mysql_build_aac_tables_internal():
     with engine.connect() as connection:
         connection.connection.ping(reconnect=True)
         cursor = connection.connection.cursor(pymysql.cursors.SSDictCursor)
-        cursor.execute('CREATE TABLE IF NOT EXISTS annas_archive_meta_aac_filenames (`collection` VARCHAR(250) NOT NULL, `filename` VARCHAR(250) NOT NULL, PRIMARY KEY (`collection`)) ENGINE=MyISAM DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_bin')
+        cursor.execute('CREATE TABLE IF NOT EXISTS annas_archive_meta_aac_filenames (`collection` VARCHAR(250) NOT NULL, `filename` VARCHAR(250) NOT NULL, `indexed_bytes` BIGINT NULL, `last_aacid` VARCHAR(250) CHARACTER SET ascii NULL, `last_byte_offset` BIGINT NULL, PRIMARY KEY (`collection`)) ENGINE=MyISAM DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_bin')
+        # Tables created before incremental indexing existed.
+        cursor.execute('ALTER TABLE annas_archive_meta_aac_filenames ADD COLUMN IF NOT EXISTS `indexed_bytes` BIGINT NULL, ADD COLUMN IF NOT EXISTS `last_aacid` VARCHAR(250) CHARACTER SET ascii NULL, ADD COLUMN IF NOT EXISTS `last_byte_offset` BIGINT NULL')
+        cursor.execute('CREATE TABLE IF NOT EXISTS annas_archive_meta_aac_checkpoints (`collection` VARCHAR(250) NOT NULL, `filename` VARCHAR(250) NOT NULL, `byte_offset` BIGINT NOT NULL, `row_count` BIGINT NOT NULL, `last_aacid` VARCHAR(250) CHARACTER SET ascii NULL, `last_byte_offset` BIGINT NULL, PRIMARY KEY (`collection`)) ENGINE=MyISAM DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_bin')
         cursor.execute('SELECT * FROM annas_archive_meta_aac_filenames')
-        existing_filenames_by_collection = { row['collection']: row['filename'] for row in cursor.fetchall() }
+        existing_rows_by_collection = { row['collection']: row for row in cursor.fetchall() }
+        existing_filenames_by_collection = { collection: row['filename'] for collection, row in existing_rows_by_collection.items() }
 
         collections_need_indexing = {}
         for collection, filenames in file_data_files_by_collection.items():
@@ -170,155 +260,796 @@ def mysql_build_aac_tables_internal():
                 collections_need_indexing[collection] = filenames[-1]
             print(f"{collection:20}   files found: {len(filenames):02}    latest: {filenames[-1].split('__')[3].split('.')[0]}    {'previous filename: ' + previous_filename if collection_needs_indexing else '(no change)'}")
 
+    if len(collections_need_indexing) == 0:
+        print("No collections need indexing.")
+        return
+
+    elapsed_by_collection = {}
+    if workers <= 1:
         for collection, filename in collections_need_indexing.items():
-            print(f"[{collection}] Starting indexing...")
-
-            extra_index_fields = {}
-            if collection == 'duxiu_records':
-                extra_index_fields['filename_decoded_basename'] = 'VARCHAR(250) NULL'
-
-            def build_insert_data(line, byte_offset):
-                if SLOW_DATA_IMPORTS:
-                    try:
-                        orjson.loads(line)
-                    except Exception as err:
-                        raise Exception(f"Error parsing AAC JSON: {collection=} {filename=} {line=} {err=}")
-
-                # Parse "canonical AAC" more efficiently than parsing all the JSON
-                matches = re.match(rb'\{"aacid":"([^"]+)",("data_folder":"([^"]+)",)?"metadata":\{"[^"]+":([^,]+),("md5":"([^"]+)")?', line)
-                if matches is None:
-                    raise Exception(f"Line is not in canonical AAC format: '{line}'")
-                aacid = matches[1]
-                # data_folder = matches[3]
-                primary_id = matches[4].replace(b'"', b'')
-
-                if collection == 'worldcat':
-                    if (b'not_found_title_json' in line) or (b'redirect_title_json' in line):
-                        return None
-                elif collection == 'nexusstc_records':
-                    if b'"type":["wiki"]' in line:
-                        return None
-                    if line.startswith(b'{"aacid":"aacid__nexusstc_records__20240516T181305Z__78xFBbXdi1dSBZxyoVNAdn","metadata":{"nexus_id":"6etg0wq0q8nsoufh9gtj4n9s5","record":{"abstract":[],"authors":[{"family":"Fu","given":"Ke-Ang","sequence":"first"},{"family":"Wang","given":"Jiangfeng","sequence":"additional"}],"ctr":[0.1],"custom_score":[1.0],"embeddings":[],"id":[{"dois":["10.1080/03610926.2022.2027451"],"nexus_id":"6etg0wq0q8nsoufh9gtj4n9s5"}],"issued_at":[1642982400],"languages":["en"],"links":[],"metadata":[{"container_title":"Communications in Statistics - Theory and Methods","first_page":6266,"issns":["0361-0926","1532-415X"],"issue":"17","last_page":6274,"publisher":"Informa UK Limited","volume":"52"}],"navigational_facets":[],"page_rank":[0.15],"reference_texts":[],"referenced_by_count":[0],"references":[{"doi":"10.1080/03461230802700897","type":"reference"},{"doi":"10.1239/jap/1238592120","type":"reference"},{"doi":"10.1016/j.insmatheco.2012.06.010","type":"reference"},{"doi":"10.1016/j.insmatheco.2020.12.003","type":"reference"},{"doi":"10.1007/s11009-019-09722-8","type":"reference"},{"doi":"10.1016/0304-4149(94)90113-9","type":"reference"},{"doi":"10.1016/j.insmatheco.2008.08.009","type":"reference"},{"doi":"10.1080/03610926.2015.1060338","type":"reference"},{"doi":"10.3150/17-bej948","type":"reference"},{"doi":"10.1093/biomet/58.1.83"("type":"reference"},{"doi":"10.1239/aap/1293113154","type":"reference"},{"doi":"10.1016/j.spl.2020.108857","type":"reference"},{"doi":"10.1007/s11424-019-8159-3","type":"reference"},{"doi":"10.1007/s11425-010-4012-9","type":"reference"},{"doi":"10.1007/s10114-017-6433-7","type":"reference"},{"doi":"10.1016/j.spl.2011.08.024","type":"reference"},{"doi":"10.1007/s11009-008-9110-6","type":"reference"},{"doi":"10.1016/j.insmatheco.2020.12.005","type":"reference"},{"doi":"10.1016/j.spa.2003.07.001","type":"reference"},{"doi":"10.1016/j.insmatheco.2013.08.008","type":"reference"}],"signature":[],"tags":["Statistics and Probability"],"title":["Moderate deviations for a Hawkes-type risk model with arbitrary dependence between claim sizes and waiting times"],"type":["journal-article"],"updated_at":[1715883185]}}}'):
-                        # Bad record
-                        return None
-                elif collection == 'ebscohost_records':
-                    ebscohost_matches = re.search(rb'"plink":"https://search\.ebscohost\.com/login\.aspx\?direct=true\\u0026db=edsebk\\u0026AN=([0-9]+)\\u0026site=ehost-live"', line)
-                    if ebscohost_matches is None:
-                        raise Exception(f"Incorrect ebscohost line: '{line}'")
-                    primary_id = ebscohost_matches[1]
-                elif collection == 'goodreads_records':
-                    if line.endswith(b',"record":""}}\n'):
-                        # Bad record
-                        return None
-
-                md5 = matches[6]
-                if ('duxiu_files' in collection and b'"original_md5"' in line):
-                    # For duxiu_files, md5 is the primary id, so we stick original_md5 in the md5 column so we can query that as well.
-                    original_md5_matches = re.search(rb'"original_md5":"([^"]+)"', line)
-                    if original_md5_matches is None:
-                        raise Exception(f"'original_md5' found, but not in an expected format! '{line}'")
-                    md5 = original_md5_matches[1]
-                elif md5 is None:
-                    if b'"md5_reported"' in line:
-                        md5_reported_matches = re.search(rb'"md5_reported":"([^"]+)"', line)
-                        if md5_reported_matches is None:
-                            raise Exception(f"'md5_reported' found, but not in an expected format! '{line}'")
-                        md5 = md5_reported_matches[1]
-                if (md5 is not None) and (not bool(re.match(rb"^[a-f\d]{32}$", md5))):
-                    # Remove if it's not md5.
-                    md5 = None
-
-                multiple_md5s = []
-                if collection in COLLECTIONS_WITH_MULTIPLE_MD5:
-                    multiple_md5s = [md5 for md5 in set([md5.decode().lower() for md5 in re.findall(rb'"md5":"([^"]+)"', line)]) if allthethings.utils.validate_canonical_md5s([md5])]
-
-                return_data = {
-                    'aacid': aacid.decode(),
-                    'primary_id': primary_id.decode(),
-                    'md5': md5.decode().lower() if md5 is not None else None,
-                    'multiple_md5s': multiple_md5s,
-                    'byte_offset': byte_offset,
-                    'byte_length': len(line),
-                }
-
-                if collection == 'duxiu_records':
-                    return_data['filename_decoded_basename'] = None
-                    if b'"filename_decoded"' in line:
-                        json = orjson.loads(line)
-                        filename_decoded = json['metadata']['record']['filename_decoded']
-                        return_data['filename_decoded_basename'] = filename_decoded.rsplit('.', 1)[0]
-                return return_data
-
-            CHUNK_SIZE = 100000
-
-            filepath = f'{allthethings.utils.aac_path_prefix()}{filename}'
-            table_name = f'annas_archive_meta__aacid__{collection}'
-            print(f"[{collection}] Reading from {filepath} to {table_name}")
-
-            filepath_decompressed = filepath.replace('.seekable.zst', '')
-            file = None
-            uncompressed_size = None
-            if os.path.exists(filepath_decompressed):
-                print(f"[{collection}] Found decompressed version, using that for performance: {filepath_decompressed}")
-                print("Note that using the compressed version for linear operations is sometimes faster than running into drive read limits (even with NVMe), so be sure to performance-test this on your machine if the files are large, and commenting out these lines if necessary.")
-                file = open(filepath_decompressed, 'rb')
-                uncompressed_size = os.path.getsize(filepath_decompressed)
+            elapsed_by_collection[collection] = mysql_build_aac_table_internal(collection, filename, decode_workers=decode_workers, bulk_load=bulk_load, previous_row=existing_rows_by_collection.get(collection), resume=resume, sidecar_index=sidecar_index)
+    else:
+        # Start the largest files first, so the longest-running collection isn't scheduled last.
+        collections_sorted = sorted(collections_need_indexing.items(), key=lambda item: os.path.getsize(f'{allthethings.utils.aac_path_prefix()}{item[1]}'), reverse=True)
+        print(f"Indexing {len(collections_sorted)} collections with {workers=}")
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers, initializer=mysql_build_aac_tables_init_pool) as executor:
+            collection_by_future = {}
+            for pbar_position, (collection, filename) in enumerate(collections_sorted):
+                future = executor.submit(mysql_build_aac_table_internal, collection, filename, pbar_position, decode_workers, bulk_load, existing_rows_by_collection.get(collection), resume, sidecar_index)
+                collection_by_future[future] = collection
+            for future in concurrent.futures.as_completed(collection_by_future):
+                collection = collection_by_future[future]
+                err = future.exception()
+                if err:
+                    print(f"ERROR IN FUTURE RESOLUTION for [{collection}]!!!!! {repr(err)}")
+                    raise err
+                elapsed_by_collection[collection] = future.result()
+
+    print(f"Wall time per collection ({'LOAD DATA' if bulk_load else 'INSERT'}):")
+    for collection, elapsed in sorted(elapsed_by_collection.items(), key=lambda item: item[1], reverse=True):
+        print(f"{collection:30} {elapsed:10.1f}s")
+
+AAC_NEXUSSTC_BAD_RECORD = b'{"aacid":"aacid__nexusstc_records__20240516T181305Z__78xFBbXdi1dSBZxyoVNAdn","metadata":{"nexus_id":"6etg0wq0q8nsoufh9gtj4n9s5","record":{"abstract":[],"authors":[{"family":"Fu","given":"Ke-Ang","sequence":"first"},{"family":"Wang","given":"Jiangfeng","sequence":"additional"}],"ctr":[0.1],"custom_score":[1.0],"embeddings":[],"id":[{"dois":["10.1080/03610926.2022.2027451"],"nexus_id":"6etg0wq0q8nsoufh9gtj4n9s5"}],"issued_at":[1642982400],"languages":["en"],"links":[],"metadata":[{"container_title":"Communications in Statistics - Theory and Methods","first_page":6266,"issns":["0361-0926","1532-415X"],"issue":"17","last_page":6274,"publisher":"Informa UK Limited","volume":"52"}],"navigational_facets":[],"page_rank":[0.15],"reference_texts":[],"referenced_by_count":[0],"references":[{"doi":"10.1080/03461230802700897","type":"reference"},{"doi":"10.1239/jap/1238592120","type":"reference"},{"doi":"10.1016/j.insmatheco.2012.06.010","type":"reference"},{"doi":"10.1016/j.insmatheco.2020.12.003","type":"reference"},{"doi":"10.1007/s11009-019-09722-8","type":"reference"},{"doi":"10.1016/0304-4149(94)90113-9","type":"reference"},{"doi":"10.1016/j.insmatheco.2008.08.009","type":"reference"},{"doi":"10.1080/03610926.2015.1060338","type":"reference"},{"doi":"10.3150/17-bej948","type":"reference"},{"doi":"10.1093/biomet/58.1.83"("type":"reference"},{"doi":"10.1239/aap/1293113154","type":"reference"},{"doi":"10.1016/j.spl.2020.108857","type":"reference"},{"doi":"10.1007/s11424-019-8159-3","type":"reference"},{"doi":"10.1007/s11425-010-4012-9","type":"reference"},{"doi":"10.1007/s10114-017-6433-7","type":"reference"},{"doi":"10.1016/j.spl.2011.08.024","type":"reference"},{"doi":"10.1007/s11009-008-9110-6","type":"reference"},{"doi":"10.1016/j.insmatheco.2020.12.005","type":"reference"},{"doi":"10.1016/j.spa.2003.07.001","type":"reference"},{"doi":"10.1016/j.insmatheco.2013.08.008","type":"reference"}],"signature":[],"tags":["Statistics and Probability"],"title":["Moderate deviations for a Hawkes-type risk model with arbitrary dependence between claim sizes and waiting times"],"type":["journal-article"],"updated_at":[1715883185]}}}'
+
+AAC_HEADER_RE = re.compile(rb'\{"aacid":"([^"]+)",("data_folder":"([^"]+)",)?"metadata":\{"[^"]+":([^,]+),("md5":"([^"]+)")?')
+AAC_MD5_RE = re.compile(rb'"md5":"([^"]+)"')
+AAC_ORIGINAL_MD5_RE = re.compile(rb'"original_md5":"([^"]+)"')
+AAC_MD5_REPORTED_RE = re.compile(rb'"md5_reported":"([^"]+)"')
+AAC_EBSCOHOST_PLINK_RE = re.compile(rb'"plink":"https://search\.ebscohost\.com/login\.aspx\?direct=true\\u0026db=edsebk\\u0026AN=([0-9]+)\\u0026site=ehost-live"')
+AAC_CANONICAL_MD5_RE = re.compile(rb'[a-f\d]{32}')
+
+# Same as `(b'not_found_title_json' in line) or (b'redirect_title_json' in line)`, but scanning the (long) line once.
+def aac_worldcat_line_is_not_found_or_redirect(line):
+    position = line.find(b'_title_json')
+    while position != -1:
+        if line.endswith(b'not_found', 0, position) or line.endswith(b'redirect', 0, position):
+            return True
+        position = line.find(b'_title_json', position + len(b'_title_json'))
+    return False
+
+# Turn a chunk of consecutive lines (the first one starting at `byte_offset`) into rows for the
+# annas_archive_meta__aacid__* table and its __multiple_md5 companion table.
+# Returns (insert_data, insert_data_multiple_md5s, bytes_in_chunk, last_line), with last_line being
+# (byte_offset, aacid) of the last line in the chunk (also if it was skipped), or None for an empty chunk.
+#
+# Parses "canonical AAC" more efficiently than parsing all the JSON: the header of each line is matched with
+# AAC_HEADER_RE, with the collection-specific checks decided once per chunk, and all fields kept as bytes until
+# the row is built. (A single finditer over the joined chunk is slower, since a multiline `^` has to be tried at
+# every position.) With SLOW_DATA_IMPORTS, every line is also checked to be valid JSON.
+def aac_build_insert_data_for_lines(collection, filename, lines, byte_offset):
+    header_match = AAC_HEADER_RE.match
+    is_worldcat = (collection == 'worldcat')
+    is_nexusstc_records = (collection == 'nexusstc_records')
+    is_ebscohost_records = (collection == 'ebscohost_records')
+    is_goodreads_records = (collection == 'goodreads_records')
+    is_duxiu_files = ('duxiu_files' in collection)
+    has_extra_index_fields = (collection in AAC_EXTRA_INDEX_FIELDS)
+    has_multiple_md5s = (collection in AAC_COLLECTIONS_WITH_MULTIPLE_MD5)
+
+    bytes_in_chunk = 0
+    insert_data = []
+    insert_data_multiple_md5s = []
+    matches = None
+    for line in lines:
+        if line[0:1] != b'{' or line[-2:] != b'}\n':
+            allthethings.utils.aac_spot_check_line_bytes(line, {})
+        if SLOW_DATA_IMPORTS:
+            try:
+                orjson.loads(line)
+            except Exception as err:
+                raise Exception(f"Error parsing AAC JSON: {collection=} {filename=} {line=} {err=}")
+        line_byte_offset = byte_offset
+        line_len = len(line)
+        byte_offset += line_len
+        bytes_in_chunk += line_len
+
+        matches = header_match(line)
+        if matches is None:
+            raise Exception(f"Line is not in canonical AAC format: '{line}'")
+        primary_id = matches[4].replace(b'"', b'')
+
+        if is_worldcat:
+            if aac_worldcat_line_is_not_found_or_redirect(line):
+                continue
+        elif is_nexusstc_records:
+            if (b'"type":["wiki"]' in line) or line.startswith(AAC_NEXUSSTC_BAD_RECORD):
+                continue
+        elif is_ebscohost_records:
+            ebscohost_matches = AAC_EBSCOHOST_PLINK_RE.search(line)
+            if ebscohost_matches is None:
+                raise Exception(f"Incorrect ebscohost line: '{line}'")
+            primary_id = ebscohost_matches[1]
+        elif is_goodreads_records:
+            if line.endswith(b',"record":""}}\n'):
+                continue
+
+        md5 = matches[6]
+        if is_duxiu_files and (b'"original_md5"' in line):
+            original_md5_matches = AAC_ORIGINAL_MD5_RE.search(line)
+            if original_md5_matches is None:
+                raise Exception(f"'original_md5' found, but not in an expected format! '{line}'")
+            md5 = original_md5_matches[1]
+        elif (md5 is None) and (b'"md5_reported"' in line):
+            md5_reported_matches = AAC_MD5_REPORTED_RE.search(line)
+            if md5_reported_matches is None:
+                raise Exception(f"'md5_reported' found, but not in an expected format! '{line}'")
+            md5 = md5_reported_matches[1]
+        if (md5 is not None) and (AAC_CANONICAL_MD5_RE.fullmatch(md5) is None):
+            md5 = None
+
+        aacid = matches[1].decode()
+        row = {
+            'aacid': aacid,
+            'primary_id': primary_id.decode(),
+            'md5': md5.decode() if md5 is not None else None,
+            'byte_offset': line_byte_offset,
+            'byte_length': line_len,
+        }
+        if has_extra_index_fields:
+            row.update(aac_extract_extra_index_fields(collection, line))
+        insert_data.append(row)
+
+        if has_multiple_md5s:
+            multiple_md5s = [md5 for md5 in dict.fromkeys([md5.decode().lower() for md5 in AAC_MD5_RE.findall(line)]) if allthethings.utils.validate_canonical_md5s([md5])]
+            for multiple_md5 in multiple_md5s:
+                insert_data_multiple_md5s.append({ "md5": multiple_md5, "aacid": aacid })
+
+    last_line = None
+    if matches is not None:
+        last_line = (byte_offset - line_len, matches[1].decode())
+    return (insert_data, insert_data_multiple_md5s, bytes_in_chunk, last_line)
+
+# Prefers the decompressed .jsonl next to the .jsonl.seekable.zst, if present (unless aac_read_paths.json says
+# otherwise, see aac_benchmark_read_paths). Returns (file, uncompressed_size).
+def aac_open_file_for_indexing(filepath):
+    file = allthethings.utils.aac_open_file(filepath, 'sequential')
+    if isinstance(file, indexed_zstd.IndexedZstdFile):
+        return (file, file.size())
+    else:
+        return (file, os.fstat(file.fileno()).st_size)
+
+# Uncompressed size of the ranges that are handed out to separate processes in mysql_build_aac_tables --decode-workers.
+AAC_DECODE_RANGE_SIZE = 100000000
+
+# Split an AAC file into (range_start, range_end) uncompressed byte ranges of roughly `range_size`.
+# For .seekable.zst files the ranges are aligned to the zstd frames from the seek table, so that no
+# frame gets decompressed by two processes (apart from the tail of a line crossing a range boundary).
+def aac_decode_ranges(file, uncompressed_size, range_size=AAC_DECODE_RANGE_SIZE):
+    if isinstance(file, indexed_zstd.IndexedZstdFile):
+        split_candidates = sorted(file.block_offsets().values())
+    else:
+        split_candidates = range(0, uncompressed_size, range_size)
+    range_starts = [0]
+    for split_candidate in split_candidates:
+        if split_candidate - range_starts[-1] >= range_size and split_candidate < uncompressed_size:
+            range_starts.append(split_candidate)
+    return list(zip(range_starts, range_starts[1:] + [uncompressed_size]))
+
+# Decode and parse all lines that *start* within [range_start, range_end) of the uncompressed file.
+def aac_decode_range_job(collection, filename, filepath, range_start, range_end):
+    file = aac_open_file_for_indexing(filepath)[0]
+    with file:
+        if range_start > 0:
+            file.seek(range_start - 1)
+            if file.read(1) != b'\n':
+                # Skip the partial line, since it's handled by the job for the previous range.
+                file.readline()
+        first_byte_offset = file.tell()
+        lines = []
+        byte_offset = first_byte_offset
+        while byte_offset < range_end:
+            line = file.readline()
+            if len(line) == 0:
+                break
+            lines.append(line)
+            byte_offset += len(line)
+        return aac_build_insert_data_for_lines(collection, filename, lines, first_byte_offset)
+
+# Yields chunks from aac_build_insert_data_for_lines for the file from `start_byte_offset` (which must be
+# the start of a line) to the end, in file order. With decode_workers > 1, ranges of the file are
+# decompressed and parsed in separate processes.
+def aac_build_insert_data_chunks(collection, filename, filepath, file, uncompressed_size, decode_workers=1, range_size=AAC_DECODE_RANGE_SIZE, executor=None, start_byte_offset=0):
+    CHUNK_SIZE = 100000
+
+    if decode_workers <= 1:
+        file.seek(start_byte_offset)
+        byte_offset = start_byte_offset
+        for lines in more_itertools.ichunked(file, CHUNK_SIZE):
+            chunk = aac_build_insert_data_for_lines(collection, filename, lines, byte_offset)
+            byte_offset += chunk[2]
+            yield chunk
+    else:
+        decode_ranges = [(max(range_start, start_byte_offset), range_end) for range_start, range_end in aac_decode_ranges(file, uncompressed_size, range_size) if range_end > start_byte_offset]
+        print(f"[{collection}] Decoding {len(decode_ranges)} ranges with {decode_workers=}")
+        with contextlib.ExitStack() as stack:
+            if executor is None:
+                executor = stack.enter_context(concurrent.futures.ProcessPoolExecutor(max_workers=decode_workers))
+            # Bounded, so that parsed rows don't pile up in memory when inserting is slower than parsing.
+            futures = collections.deque()
+            for range_start, range_end in decode_ranges:
+                futures.append(executor.submit(aac_decode_range_job, collection, filename, filepath, range_start, range_end))
+                if len(futures) >= decode_workers*2:
+                    yield futures.popleft().result()
+            while len(futures) > 0:
+                yield futures.popleft().result()
+
+# Escape a value for LOAD DATA with the default FIELDS TERMINATED BY '\t' ESCAPED BY '\\'.
+def mysql_load_data_escape(value):
+    if value is None:
+        return b'\\N'
+    return str(value).encode().replace(b'\\', b'\\\\').replace(b'\t', b'\\t').replace(b'\n', b'\\n').replace(b'\r', b'\\r').replace(b'\0', b'\\0')
+
+def mysql_load_data_write_rows(spool_file, column_names, rows):
+    for row in rows:
+        spool_file.write(b'\t'.join([mysql_load_data_escape(row[column_name]) for column_name in column_names]) + b'\n')
+
+# LOAD DATA LOCAL skips rows with duplicate keys (and other bad rows) with just a warning, where INSERT fails.
+def mysql_load_data_check_row_count(cursor, table_name, loaded_rows, spooled_rows):
+    if loaded_rows != spooled_rows:
+        cursor.execute('SHOW WARNINGS LIMIT 10')
+        warnings = list(cursor.fetchall())
+        raise Exception(f"LOAD DATA into {table_name} loaded {loaded_rows} of {spooled_rows} rows: {warnings=}")
+
+# Write the sidecar index for `key_column` of the table (see allthethings.utils.aac_sidecar_lookup),
+# via a temporary file, so that readers never see a partial one.
+def aac_write_sidecar_index(connection, collection, table_name, filename, key_column, indexed_bytes):
+    sidecar_filepath = allthethings.utils.aac_sidecar_path(filename, key_column)
+    cursor = connection.connection.cursor(pymysql.cursors.SSCursor)
+    cursor.execute(f"SELECT COUNT(*), MAX(LENGTH({key_column})) FROM {table_name} WHERE {key_column} IS NOT NULL")
+    record_count, key_width = cursor.fetchone()
+    cursor.fetchall()
+    if record_count == 0:
+        print(f"[{collection}] No {key_column} values, not writing {sidecar_filepath}")
+        return
+    print(f"[{collection}] Writing {sidecar_filepath} ({record_count=} {key_width=})")
+
+    sidecar_filepath_tmp = f'{sidecar_filepath}.tmp'
+    with open(sidecar_filepath_tmp, 'wb') as sidecar_file:
+        sidecar_file.write(allthethings.utils.AAC_SIDECAR_HEADER.pack(allthethings.utils.AAC_SIDECAR_MAGIC, key_width, record_count, indexed_bytes))
+        previous_key = b''
+        records_written = 0
+        connection.connection.ping(reconnect=True)
+        cursor.execute(f"SELECT {key_column}, byte_offset, byte_length FROM {table_name} WHERE {key_column} IS NOT NULL ORDER BY {key_column}, byte_offset")
+        for key, byte_offset, byte_length in cursor.fetchall_unbuffered():
+            key = key.encode().ljust(key_width, b'\0')
+            # The binary search compares padded bytes, which should be the same order as the utf8mb4_bin collation.
+            if key < previous_key:
+                raise Exception(f"Unexpected {key_column} order in {table_name}: {key=} < {previous_key=}")
+            previous_key = key
+            sidecar_file.write(key + allthethings.utils.AAC_SIDECAR_VALUE.pack(byte_offset, byte_length))
+            records_written += 1
+        if records_written != record_count:
+            raise Exception(f"Unexpected number of rows in {table_name}: {records_written=} {record_count=}")
+    os.replace(sidecar_filepath_tmp, sidecar_filepath)
+
+# AAC files are append-only, so a new file for a collection usually starts with the full contents of the
+# previously indexed file. Returns (start_byte_offset, reason): the offset from which to index the new file
+# into the existing table, or (0, reason) if the table has to be rebuilt from scratch.
+def aac_incremental_start_byte_offset(file, uncompressed_size, previous_row):
+    if previous_row is None:
+        return (0, 'not indexed before')
+    if previous_row.get('indexed_bytes') is None or previous_row.get('last_aacid') is None:
+        return (0, 'no indexed_bytes/last_aacid recorded for previous file')
+    indexed_bytes = previous_row['indexed_bytes']
+    last_byte_offset = previous_row['last_byte_offset']
+    if uncompressed_size < indexed_bytes:
+        return (0, f'new file is smaller than previously indexed ({uncompressed_size=} {indexed_bytes=})')
+    file.seek(last_byte_offset)
+    last_line = file.read(indexed_bytes - last_byte_offset)
+    if not (last_line.startswith(b'{"aacid":"' + previous_row['last_aacid'].encode() + b'"') and last_line.endswith(b'}\n')):
+        return (0, f'new file does not contain {previous_row["last_aacid"]} at byte_offset {last_byte_offset}')
+    return (indexed_bytes, f'new file extends previous file {previous_row["filename"]}')
+
+# Index a single AAC collection into its annas_archive_meta__aacid__* table(s). Returns the wall time in seconds.
+# If the new file extends `previous_row` (the collection's previous row in annas_archive_meta_aac_filenames),
+# only the appended lines are added to the existing table(s). With `resume`, continues from the checkpoint
+# in annas_archive_meta_aac_checkpoints, if there is one for this file.
+def mysql_build_aac_table_internal(collection, filename, pbar_position=None, decode_workers=1, bulk_load=False, previous_row=None, resume=False, sidecar_index=False):
+    print(f"[{collection}] Starting indexing...")
+    start_time = time.time()
+    connection_engine = engine
+    if bulk_load:
+        connection_engine = create_engine(mariadb_url_no_timeout, connect_args={"local_infile": True})
+    with connection_engine.connect() as connection:
+        connection.connection.ping(reconnect=True)
+        cursor = connection.connection.cursor(pymysql.cursors.SSDictCursor)
+
+        extra_index_fields = { index_name: index_type for index_name, (index_type, json_path, transform) in AAC_EXTRA_INDEX_FIELDS.get(collection, {}).items() }
+
+        filepath = f'{allthethings.utils.aac_path_prefix()}{filename}'
+        table_name = f'annas_archive_meta__aacid__{collection}'
+        print(f"[{collection}] Reading from {filepath} to {table_name}")
+
+        for key_column in allthethings.utils.AAC_SIDECAR_KEY_COLUMNS:
+            for sidecar_filepath in glob.glob(f'{allthethings.utils.aac_path_prefix()}annas_archive_meta__aacid__{collection}__*.{key_column}.idx'):
+                print(f"[{collection}] Deleting {sidecar_filepath}")
+                os.remove(sidecar_filepath)
+
+        file, uncompressed_size = aac_open_file_for_indexing(filepath)
+        if not isinstance(file, indexed_zstd.IndexedZstdFile):
+            print(f"[{collection}] Found decompressed version, using that for performance: {filepath.replace('.seekable.zst', '')}")
+            print("Note that using the compressed version for linear operations is sometimes faster than running into drive read limits (even with NVMe), so be sure to run `flask cli aac_benchmark_read_paths` on your machine if the files are large.")
+        elif os.path.exists(filepath.replace('.seekable.zst', '')):
+            print(f"[{collection}] Found decompressed version, but using compressed version since it's faster according to {allthethings.utils.AAC_READ_PATHS_FILENAME}")
+        print(f"[{collection}] {uncompressed_size=}")
+
+        cursor.execute("SHOW TABLES LIKE %(table_name)s", { "table_name": table_name })
+        table_exists = len(cursor.fetchall()) > 0
+
+        checkpoint = None
+        if resume:
+            cursor.execute('SELECT * FROM annas_archive_meta_aac_checkpoints WHERE collection = %(collection)s', { "collection": collection })
+            checkpoint = (cursor.fetchall() or [None])[0]
+            if checkpoint is None:
+                print(f"[{collection}] No checkpoint to resume from")
+            elif checkpoint['filename'] != filename or not table_exists:
+                print(f"[{collection}] Ignoring checkpoint for {checkpoint['filename']}")
+                checkpoint = None
+
+        row_count = 0
+        last_line = None
+        if checkpoint is not None:
+            start_byte_offset = checkpoint['byte_offset']
+            row_count = checkpoint['row_count']
+            if checkpoint['last_aacid'] is not None:
+                last_line = (checkpoint['last_byte_offset'], checkpoint['last_aacid'])
+            print(f"[{collection}] Resuming from checkpoint at byte_offset {start_byte_offset} ({row_count} rows)")
+        else:
+            start_byte_offset, incremental_reason = aac_incremental_start_byte_offset(file, uncompressed_size, previous_row)
+            if start_byte_offset > 0 and not table_exists:
+                start_byte_offset, incremental_reason = (0, f'{table_name} does not exist')
+            if start_byte_offset > 0:
+                last_line = (previous_row['last_byte_offset'], previous_row['last_aacid'])
+                print(f"[{collection}] Indexing incrementally from byte_offset {start_byte_offset} ({uncompressed_size - start_byte_offset} new bytes): {incremental_reason}")
             else:
-                file = indexed_zstd.IndexedZstdFile(filepath)
-                uncompressed_size = file.size()
-            print(f"[{collection}] {uncompressed_size=}")
+                print(f"[{collection}] Indexing from scratch: {incremental_reason}")
 
-            table_extra_fields = ''.join([f', {index_name} {index_type}' for index_name, index_type in extra_index_fields.items()])
-            table_extra_index = ''.join([f', INDEX({index_name})' for index_name, index_type in extra_index_fields.items()])
-            insert_extra_names = ''.join([f', {index_name}' for index_name, index_type in extra_index_fields.items()])
-            insert_extra_values = ''.join([f', %({index_name})s' for index_name, index_type in extra_index_fields.items()])
+        table_extra_fields = ''.join([f', {index_name} {index_type}' for index_name, index_type in extra_index_fields.items()])
+        table_extra_index = ''.join([f', INDEX({index_name})' for index_name, index_type in extra_index_fields.items()])
+        insert_extra_names = ''.join([f', {index_name}' for index_name, index_type in extra_index_fields.items()])
+        insert_extra_values = ''.join([f', %({index_name})s' for index_name, index_type in extra_index_fields.items()])
 
-            tables = []
+        tables = [table_name]
+        if collection in AAC_COLLECTIONS_WITH_MULTIPLE_MD5:
+            tables.append(f"{table_name}__multiple_md5")
 
+        if start_byte_offset == 0:
             cursor.execute(f"DROP TABLE IF EXISTS {table_name}")
             cursor.execute(f"CREATE TABLE {table_name} (`aacid` VARCHAR(250) CHARACTER SET ascii NOT NULL, `primary_id` VARCHAR(250) NULL, `md5` CHAR(32) CHARACTER SET ascii NULL, `byte_offset` BIGINT NOT NULL, `byte_length` BIGINT NOT NULL {table_extra_fields}, PRIMARY KEY (`aacid`), INDEX `primary_id` (`primary_id`), INDEX `md5` (`md5`) {table_extra_index}) ENGINE=MyISAM DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_bin")
-            tables.append(table_name)
-
-            if collection in COLLECTIONS_WITH_MULTIPLE_MD5:
+            if collection in AAC_COLLECTIONS_WITH_MULTIPLE_MD5:
                 cursor.execute(f"DROP TABLE IF EXISTS {table_name}__multiple_md5")
                 cursor.execute(f"CREATE TABLE {table_name}__multiple_md5 (`md5` CHAR(32) CHARACTER SET ascii NOT NULL, `aacid` VARCHAR(250) CHARACTER SET ascii NOT NULL, PRIMARY KEY (`md5`, `aacid`), INDEX `aacid_md5` (`aacid`, `md5`)) ENGINE=MyISAM DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_bin")
-                tables.append(f"{table_name}__multiple_md5")
+        else:
+            # The process might have been killed after inserting a chunk but before saving its checkpoint. Also for
+            # incremental runs: an interrupted earlier run (without --resume now) might have inserted some of the tail.
+            if collection in AAC_COLLECTIONS_WITH_MULTIPLE_MD5:
+                cursor.execute(f"DELETE {table_name}__multiple_md5 FROM {table_name}__multiple_md5 JOIN {table_name} USING (aacid) WHERE {table_name}.byte_offset >= %(byte_offset)s", { "byte_offset": start_byte_offset })
+            cursor.execute(f"DELETE FROM {table_name} WHERE byte_offset >= %(byte_offset)s", { "byte_offset": start_byte_offset })
+            print(f"[{collection}] Deleted {cursor.rowcount} rows from byte_offset {start_byte_offset} onwards")
+
+        action = 'INSERT'
+        if collection == 'duxiu_records':
+            # This collection inadvertently has a bunch of exact duplicate lines.
+            action = 'REPLACE'
+
+        column_names = ['aacid', 'primary_id', 'md5', 'byte_offset', 'byte_length'] + list(extra_index_fields.keys())
+
+        cursor.execute(f"LOCK TABLES {' WRITE, '.join(tables)} WRITE")
+        # Rebuilding the keys of a table that is already populated costs more than it saves.
+        disable_keys = bulk_load and start_byte_offset == 0
+        indexed_bytes = start_byte_offset
+        with contextlib.ExitStack() as stack:
+            if not bulk_load:
+                # Separate connection, since LOCK TABLES only allows this connection to use the locked tables.
+                checkpoint_connection = stack.enter_context(engine.connect())
+                checkpoint_cursor = checkpoint_connection.connection.cursor(pymysql.cursors.SSDictCursor)
+            if bulk_load:
+                if disable_keys:
+                    for table in tables:
+                        cursor.execute(f"ALTER TABLE {table} DISABLE KEYS")
+                spool_file = stack.enter_context(tempfile.NamedTemporaryFile(prefix=f'{table_name}__', suffix='.tsv'))
+                spool_file_multiple_md5s = stack.enter_context(tempfile.NamedTemporaryFile(prefix=f'{table_name}__multiple_md5__', suffix='.tsv'))
+                spooled_rows = 0
+                spooled_rows_multiple_md5s = 0
 
-            cursor.execute(f"LOCK TABLES {' WRITE, '.join(tables)} WRITE")
             # From https://github.com/indygreg/python-zstandard/issues/13#issuecomment-1544313739
-            with tqdm.tqdm(total=uncompressed_size, bar_format='{l_bar}{bar}{r_bar} {eta}', unit='B', unit_scale=True) as pbar:
-                byte_offset = 0
-                for lines in more_itertools.ichunked(file, CHUNK_SIZE):
-                    bytes_in_batch = 0
-                    insert_data = []
-                    insert_data_multiple_md5s = []
-                    for line in lines:
-                        allthethings.utils.aac_spot_check_line_bytes(line, {})
-                        insert_data_line = build_insert_data(line, byte_offset)
-                        if insert_data_line is not None:
-                            for md5 in insert_data_line['multiple_md5s']:
-                                insert_data_multiple_md5s.append({ "md5": md5, "aacid": insert_data_line['aacid'] })
-                            del insert_data_line['multiple_md5s']
-                            insert_data.append(insert_data_line)
-                        line_len = len(line)
-                        byte_offset += line_len
-                        bytes_in_batch += line_len
-                    action = 'INSERT'
-                    if collection == 'duxiu_records':
-                        # This collection inadvertently has a bunch of exact duplicate lines.
-                        action = 'REPLACE'
-                    if len(insert_data) > 0:
-                        connection.connection.ping(reconnect=True)
-                        cursor.executemany(f'{action} INTO {table_name} (aacid, primary_id, md5, byte_offset, byte_length {insert_extra_names}) VALUES (%(aacid)s, %(primary_id)s, %(md5)s, %(byte_offset)s, %(byte_length)s {insert_extra_values})', insert_data)
-                    if len(insert_data_multiple_md5s) > 0:
-                        connection.connection.ping(reconnect=True)
-                        cursor.executemany(f'{action} INTO {table_name}__multiple_md5 (md5, aacid) VALUES (%(md5)s, %(aacid)s)', insert_data_multiple_md5s)
+            with tqdm.tqdm(total=uncompressed_size - start_byte_offset, bar_format='{l_bar}{bar}{r_bar} {eta}', unit='B', unit_scale=True, desc=collection, position=pbar_position) as pbar:
+                for insert_data, insert_data_multiple_md5s, bytes_in_batch, chunk_last_line in aac_build_insert_data_chunks(collection, filename, filepath, file, uncompressed_size, decode_workers=decode_workers, start_byte_offset=start_byte_offset):
+                    if bulk_load:
+                        mysql_load_data_write_rows(spool_file, column_names, insert_data)
+                        mysql_load_data_write_rows(spool_file_multiple_md5s, ['md5', 'aacid'], insert_data_multiple_md5s)
+                        spooled_rows += len(insert_data)
+                        spooled_rows_multiple_md5s += len(insert_data_multiple_md5s)
+                    else:
+                        if len(insert_data) > 0:
+                            connection.connection.ping(reconnect=True)
+                            cursor.executemany(f'{action} INTO {table_name} (aacid, primary_id, md5, byte_offset, byte_length {insert_extra_names}) VALUES (%(aacid)s, %(primary_id)s, %(md5)s, %(byte_offset)s, %(byte_length)s {insert_extra_values})', insert_data)
+                        if len(insert_data_multiple_md5s) > 0:
+                            connection.connection.ping(reconnect=True)
+                            cursor.executemany(f'{action} INTO {table_name}__multiple_md5 (md5, aacid) VALUES (%(md5)s, %(aacid)s)', insert_data_multiple_md5s)
+                    indexed_bytes += bytes_in_batch
+                    row_count += len(insert_data)
+                    if chunk_last_line is not None:
+                        last_line = chunk_last_line
+                    if not bulk_load:
+                        checkpoint_connection.connection.ping(reconnect=True)
+                        checkpoint_cursor.execute("REPLACE INTO annas_archive_meta_aac_checkpoints (collection, filename, byte_offset, row_count, last_aacid, last_byte_offset) VALUES (%(collection)s, %(filename)s, %(byte_offset)s, %(row_count)s, %(last_aacid)s, %(last_byte_offset)s)", { "collection": collection, "filename": filename, "byte_offset": indexed_bytes, "row_count": row_count, "last_aacid": last_line[1] if last_line else None, "last_byte_offset": last_line[0] if last_line else None })
+                        checkpoint_cursor.execute("COMMIT")
                     pbar.update(bytes_in_batch)
-            connection.connection.ping(reconnect=True)
-            cursor.execute("UNLOCK TABLES")
-            cursor.execute("REPLACE INTO annas_archive_meta_aac_filenames (collection, filename) VALUES (%(collection)s, %(filename)s)", { "collection": collection, "filename": filepath.rsplit('/', 1)[-1] })
-            cursor.execute("COMMIT")
-            print(f"[{collection}] Done!")
+            file.close()
+
+            if bulk_load:
+                print(f"[{collection}] Spooled rows in {time.time() - start_time:.1f}s")
+                # LOCAL implies IGNORE for duplicate keys (with a warning per row), so be explicit about REPLACE for
+                # duxiu_records, and otherwise check that every row got loaded, so that a duplicate key fails like
+                # it does with INSERT.
+                load_action = 'REPLACE' if action == 'REPLACE' else ''
+                load_data_start_time = time.time()
+                spool_file.flush()
+                connection.connection.ping(reconnect=True)
+                cursor.execute(f"LOAD DATA LOCAL INFILE %(spool_filename)s {load_action} INTO TABLE {table_name} CHARACTER SET utf8mb4 FIELDS TERMINATED BY '\\t' ESCAPED BY '\\\\' LINES TERMINATED BY '\\n' ({', '.join(column_names)})", { "spool_filename": spool_file.name })
+                if action != 'REPLACE':
+                    mysql_load_data_check_row_count(cursor, table_name, cursor.rowcount, spooled_rows)
+                if collection in AAC_COLLECTIONS_WITH_MULTIPLE_MD5:
+                    spool_file_multiple_md5s.flush()
+                    cursor.execute(f"LOAD DATA LOCAL INFILE %(spool_filename)s {load_action} INTO TABLE {table_name}__multiple_md5 CHARACTER SET utf8mb4 FIELDS TERMINATED BY '\\t' ESCAPED BY '\\\\' LINES TERMINATED BY '\\n' (md5, aacid)", { "spool_filename": spool_file_multiple_md5s.name })
+                    if action != 'REPLACE':
+                        mysql_load_data_check_row_count(cursor, f"{table_name}__multiple_md5", cursor.rowcount, spooled_rows_multiple_md5s)
+                print(f"[{collection}] LOAD DATA in {time.time() - load_data_start_time:.1f}s")
+                if disable_keys:
+                    enable_keys_start_time = time.time()
+                    for table in tables:
+                        cursor.execute(f"ALTER TABLE {table} ENABLE KEYS")
+                    print(f"[{collection}] ENABLE KEYS in {time.time() - enable_keys_start_time:.1f}s")
+
+        connection.connection.ping(reconnect=True)
+        cursor.execute("UNLOCK TABLES")
+        if sidecar_index:
+            # Written from the finished table (not the rows of this run), so incremental and resumed runs are covered too.
+            for key_column in allthethings.utils.aac_sidecar_key_columns(collection):
+                aac_write_sidecar_index(connection, collection, table_name, filename, key_column, indexed_bytes)
+        cursor.execute("REPLACE INTO annas_archive_meta_aac_filenames (collection, filename, indexed_bytes, last_aacid, last_byte_offset) VALUES (%(collection)s, %(filename)s, %(indexed_bytes)s, %(last_aacid)s, %(last_byte_offset)s)", { "collection": collection, "filename": filepath.rsplit('/', 1)[-1], "indexed_bytes": indexed_bytes, "last_aacid": last_line[1] if last_line else None, "last_byte_offset": last_line[0] if last_line else None })
+        cursor.execute("DELETE FROM annas_archive_meta_aac_checkpoints WHERE collection = %(collection)s", { "collection": collection })
+        cursor.execute("COMMIT")
+    elapsed = time.time() - start_time
+    print(f"[{collection}] Done in {elapsed:.1f}s ({row_count} rows)!")
+    return elapsed
+
+#################################################################################################
+# Benchmark serial vs. range-parallel decoding+parsing of AAC files, as done in
+# `mysql_build_aac_tables --decode-workers N`, and check that both produce identical rows.
+# Doesn't touch the database. By default runs against the aacid_small fixtures; use a small
+# --range-size there, since those files are tiny.
+# ./run flask cli mysql_build_aac_tables_benchmark_decode --decode-workers 4 --range-size 100000
+@cli.cli.command('mysql_build_aac_tables_benchmark_decode')
+@click.option('--path', default='/app/aacid_small/', show_default=True)
+@click.option('--decode-workers', default=4, show_default=True)
+@click.option('--range-size', default=AAC_DECODE_RANGE_SIZE, show_default=True)
+def mysql_build_aac_tables_benchmark_decode(path, decode_workers, range_size):
+    mysql_build_aac_tables_benchmark_decode_internal(path, decode_workers, range_size)
+
+def mysql_build_aac_tables_benchmark_decode_internal(path, decode_workers, range_size):
+    filenames = sorted([filename for filename in os.listdir(path) if filename.startswith('annas_archive_meta__aacid__') and filename.endswith('.jsonl.seekable.zst')])
+    executor = concurrent.futures.ProcessPoolExecutor(max_workers=decode_workers)
+    # Start all worker processes (and their imports) up front, so process startup isn't counted.
+    warmup_filepath = os.path.join(path, filenames[0])
+    list(executor.map(aac_decode_range_job, *zip(*[('warmup', filenames[0], warmup_filepath, 0, 0)]*(decode_workers*4))))
+    print(f"{'collection':30} {'size':>12} {'ranges':>6} {'serial':>9} {'parallel':>9} {'speedup':>7}  rows")
+    total_serial = 0.0
+    total_parallel = 0.0
+    for filename in filenames:
+        collection = filename.split('__')[2]
+        filepath = os.path.join(path, filename)
+        results = []
+        for workers in [1, decode_workers]:
+            file, uncompressed_size = aac_open_file_for_indexing(filepath)
+            with file:
+                start_time = time.time()
+                chunks = list(aac_build_insert_data_chunks(collection, filename, filepath, file, uncompressed_size, decode_workers=workers, range_size=range_size, executor=executor))
+                elapsed = time.time() - start_time
+                num_ranges = len(aac_decode_ranges(file, uncompressed_size, range_size))
+            rows = ([row for chunk in chunks for row in chunk[0]], [row for chunk in chunks for row in chunk[1]], sum([chunk[2] for chunk in chunks]))
+            results.append((elapsed, rows))
+        (serial_elapsed, serial_rows), (parallel_elapsed, parallel_rows) = results
+        if serial_rows != parallel_rows:
+            raise Exception(f"Rows differ between serial and parallel decoding for {filename=}")
+        total_serial += serial_elapsed
+        total_parallel += parallel_elapsed
+        print(f"{collection:30} {uncompressed_size:12} {num_ranges:6} {serial_elapsed:8.3f}s {parallel_elapsed:8.3f}s {serial_elapsed/parallel_elapsed:6.2f}x  {len(serial_rows[0])} (identical)")
+    executor.shutdown()
+    print(f"{'total':30} {'':12} {'':6} {total_serial:8.3f}s {total_parallel:8.3f}s {total_serial/total_parallel:6.2f}x")
+
+#################################################################################################
+# Benchmark reading each collection's .jsonl.seekable.zst vs. its decompressed .jsonl (from
+# decompress_aac_files.sh), both sequentially (as in mysql_build_aac_tables) and with random reads
+# of single lines (as in get_lines_from_aac_file). The faster path per collection and access pattern
+# is written to aac_read_paths.json next to the AAC files, which both of those honour. Collections
+# without a decompressed file are skipped. The page cache is dropped for both files before each
+# measurement (where supported), so that it's the disk that gets measured.
+# ./run flask cli aac_benchmark_read_paths
+@cli.cli.command('aac_benchmark_read_paths')
+@click.option('--path', default=None, help='Directory with the AAC files. Defaults to the one used by the app.')
+@click.option('--sample-bytes', default=1000000000, show_default=True, help='Bytes to read sequentially per collection and path.')
+@click.option('--random-reads', default=2000, show_default=True, help='Number of random line reads per collection and path.')
+@click.option('--dry-run', is_flag=True, help="Only print the results, don't write aac_read_paths.json.")
+def aac_benchmark_read_paths(path, sample_bytes, random_reads, dry_run):
+    aac_benchmark_read_paths_internal(path or allthethings.utils.aac_path_prefix(), sample_bytes, random_reads, dry_run=dry_run)
+
+# Typical AAC line length, for the random reads.
+AAC_BENCHMARK_RANDOM_READ_SIZE = 2000
+
+def aac_drop_page_cache(filepath):
+    if hasattr(os, 'posix_fadvise'):
+        with open(filepath, 'rb') as file:
+            os.posix_fadvise(file.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+
+def aac_benchmark_read_paths_internal(path, sample_bytes, random_reads, dry_run=False):
+    path = os.path.join(path, '')
+    filenames_by_collection = {}
+    for filename in sorted(os.listdir(path)):
+        if filename.startswith('annas_archive_meta__aacid__') and filename.endswith('.jsonl.seekable.zst'):
+            filenames_by_collection[filename.split('__')[2]] = filename
+
+    read_paths = allthethings.utils.aac_read_paths_config(path)
+    print(f"{'collection':30} {'path':12} {'sequential':>12} {'random':>12}")
+    for collection, filename in filenames_by_collection.items():
+        filepath = f'{path}{filename}'
+        filepath_decompressed = filepath.replace('.seekable.zst', '')
+        if not os.path.exists(filepath_decompressed):
+            print(f"{collection:30} (no decompressed file, skipping)")
+            continue
+
+        results = {}
+        for read_path, open_file in [('compressed', lambda: indexed_zstd.IndexedZstdFile(filepath)), ('decompressed', lambda: open(filepath_decompressed, 'rb'))]:
+            aac_drop_page_cache(filepath)
+            aac_drop_page_cache(filepath_decompressed)
+            with open_file() as file:
+                start_time = time.time()
+                bytes_read = 0
+                while bytes_read < sample_bytes:
+                    chunk = file.read(1000000)
+                    if len(chunk) == 0:
+                        break
+                    bytes_read += len(chunk)
+                sequential_bytes_per_second = bytes_read / max(time.time() - start_time, 1e-9)
+
+            aac_drop_page_cache(filepath)
+            aac_drop_page_cache(filepath_decompressed)
+            with open_file() as file:
+                uncompressed_size = os.path.getsize(filepath_decompressed)
+                # Same positions for both paths.
+                rng = random.Random(collection)
+                byte_offsets = [rng.randrange(max(1, uncompressed_size - AAC_BENCHMARK_RANDOM_READ_SIZE)) for _ in range(random_reads)]
+                start_time = time.time()
+                for byte_offset in byte_offsets:
+                    file.seek(byte_offset)
+                    file.read(AAC_BENCHMARK_RANDOM_READ_SIZE)
+                random_reads_per_second = random_reads / max(time.time() - start_time, 1e-9)
+
+            results[read_path] = (sequential_bytes_per_second, random_reads_per_second)
+            print(f"{collection:30} {read_path:12} {sequential_bytes_per_second/1000000:8.1f}MB/s {random_reads_per_second:8.0f}/s")
+
+        read_paths[collection] = {
+            "sequential": max(results, key=lambda read_path: results[read_path][0]),
+            "random": max(results, key=lambda read_path: results[read_path][1]),
+        }
+        print(f"{collection:30} => {read_paths[collection]}")
+
+    if dry_run:
+        return
+    config_filepath = f'{path}{allthethings.utils.AAC_READ_PATHS_FILENAME}'
+    with open(f'{config_filepath}.tmp', 'wb') as config_file:
+        config_file.write(orjson.dumps(read_paths, option=orjson.OPT_INDENT_2 | orjson.OPT_SORT_KEYS))
+    os.replace(f'{config_filepath}.tmp', config_filepath)
+    print(f"Written to {config_filepath}")
+
+#################################################################################################
+# Compare reads per batch and time per batch of get_lines_from_aac_file with and without
+# coalescing of nearby ranges (see allthethings.utils.AAC_COALESCE_MAX_GAP), for "dense" batches
+# (consecutive lines, like records of the same edition), "clustered" batches (random lines from a
+# small window) and "random" batches (random lines from the whole file).
+# ./run flask cli aac_benchmark_coalesced_reads
+@cli.cli.command('aac_benchmark_coalesced_reads')
+@click.option('--path', default=None, help='Directory with the AAC files. Defaults to the one used by the app.')
+@click.option('--batches', default=200, show_default=True, help='Number of batches per collection and batch kind.')
+@click.option('--batch-size', default=100, show_default=True, help='Number of lines per batch.')
+@click.option('--max-lines', default=1000000, show_default=True, help='Only use the first this many lines of each file.')
+@click.option('--max-gap', default=allthethings.utils.AAC_COALESCE_MAX_GAP, show_default=True)
+def aac_benchmark_coalesced_reads(path, batches, batch_size, max_lines, max_gap):
+    aac_benchmark_coalesced_reads_internal(path or allthethings.utils.aac_path_prefix(), batches, batch_size, max_lines, max_gap)
+
+def aac_benchmark_coalesced_reads_internal(path, batches, batch_size, max_lines, max_gap):
+    path = os.path.join(path, '')
+    print(f"{'collection':30} {'file':12} {'batch':10} {'reads/batch':>24} {'ms/batch':>20}")
+    for filename in sorted(os.listdir(path)):
+        if not (filename.startswith('annas_archive_meta__aacid__') and filename.endswith('.jsonl.seekable.zst')):
+            continue
+        collection = filename.split('__')[2]
+        filepath = f'{path}{filename}'
+        filepath_decompressed = filepath.replace('.seekable.zst', '')
+        file_kinds = [('compressed', lambda: indexed_zstd.IndexedZstdFile(filepath))]
+        if os.path.exists(filepath_decompressed):
+            file_kinds.append(('decompressed', lambda: open(filepath_decompressed, 'rb')))
+        for file_kind, open_file in file_kinds:
+            offsets_and_lengths = []
+            with open_file() as file:
+                byte_offset = 0
+                for line in file:
+                    if len(offsets_and_lengths) >= max_lines:
+                        break
+                    offsets_and_lengths.append((byte_offset, len(line)))
+                    byte_offset += len(line)
+            if len(offsets_and_lengths) == 0:
+                continue
+            current_batch_size = min(batch_size, len(offsets_and_lengths))
+
+            rng = random.Random(collection)
+            batches_by_kind = { 'dense': [], 'clustered': [], 'random': [] }
+            for _ in range(batches):
+                start_index = rng.randrange(len(offsets_and_lengths) - current_batch_size + 1)
+                batches_by_kind['dense'].append(offsets_and_lengths[start_index:start_index+current_batch_size])
+                window_start_index = rng.randrange(max(1, len(offsets_and_lengths) - current_batch_size*20))
+                window = offsets_and_lengths[window_start_index:window_start_index+current_batch_size*20]
+                batches_by_kind['clustered'].append(rng.sample(window, min(current_batch_size, len(window))))
+                batches_by_kind['random'].append(rng.sample(offsets_and_lengths, current_batch_size))
+
+            for batch_kind, kind_batches in batches_by_kind.items():
+                results = {}
+                for current_max_gap in [None, max_gap]:
+                    allthethings.utils.aac_block_cache.clear()
+                    with open_file() as file:
+                        start_time = time.time()
+                        for batch in kind_batches:
+                            lines = allthethings.utils.aac_read_lines(file, collection, filename, batch, max_gap=current_max_gap)
+                        elapsed = time.time() - start_time
+                    reads = sum(len(allthethings.utils.aac_coalesce_ranges(sorted([(row[0], row[1], index) for index, row in enumerate(batch)]), max_gap=current_max_gap)) for batch in kind_batches)
+                    results[current_max_gap] = (reads / len(kind_batches), elapsed * 1000 / len(kind_batches), lines)
+                if results[None][2] != results[max_gap][2]:
+                    raise Exception(f"Coalesced reads returned different lines for {collection=} {file_kind=} {batch_kind=}")
+                print(f"{collection:30} {file_kind:12} {batch_kind:10} {results[None][0]:10.1f} -> {results[max_gap][0]:10.1f} {results[None][1]:8.2f} -> {results[max_gap][1]:8.2f}")
+
+#################################################################################################
+# Rewrite the .seekable.zst file of a collection with a different frame size. A random read of a single line
+# has to decompress its frame up to that line, so with the frame sizes we use for distribution (10MB-50MB,
+# see AAC.md) a single line can take a long time when it's not in aac_block_cache; smaller frames make this
+# faster at the cost of a worse compression ratio. The decompressed contents stay exactly the same, so the
+# byte offsets in MySQL (and any cached blocks) remain valid, and the filename stays the same too.
+# Running web workers pick up the new file with their next check of annas_archive_meta_aac_filenames.
+#
+# To compare read latency vs. disk footprint first, without replacing anything:
+# ./run flask cli aac_reframe --collection worldcat --benchmark-frame-sizes 65536,262144,1048576,10485760 --dry-run
+# ./run flask cli aac_reframe --collection worldcat --frame-size 262144
+#
+# Trained dictionaries are not supported, since indexed_zstd can't decompress frames that use one.
+@cli.cli.command('aac_reframe')
+@click.option('--collection', required=True)
+@click.option('--frame-size', default=256*1024, show_default=True, help='Target decompressed size per frame (frames end on line boundaries).')
+@click.option('--level', default=2, show_default=True, help='zstd compression level.')
+@click.option('--threads', default=32, show_default=True)
+@click.option('--benchmark-frame-sizes', default='', help='Comma-separated frame sizes to benchmark before rewriting.')
+@click.option('--random-reads', default=1000, show_default=True, help='Number of random line reads per benchmarked file.')
+@click.option('--dry-run', is_flag=True, help="Only benchmark, don't replace the file.")
+def aac_reframe(collection, frame_size, level, threads, benchmark_frame_sizes, random_reads, dry_run):
+    frame_sizes = [int(size) for size in benchmark_frame_sizes.split(',') if size.strip() != '']
+    aac_reframe_internal(collection, frame_size, level, threads, frame_sizes, random_reads, dry_run=dry_run)
+
+AAC_SEEK_TABLE_SKIPPABLE_MAGIC = 0x184D2A5E
+AAC_SEEK_TABLE_FOOTER_MAGIC = 0x8F92EAB1
+
+def aac_reframe_split_frames(file, frame_size, sample, rng, sample_count):
+    frame_lines = []
+    frame_bytes = 0
+    byte_offset = 0
+    line_count = 0
+    for line in file:
+        # Reservoir sample of lines to use for benchmarking random reads.
+        if len(sample) < sample_count:
+            sample.append((byte_offset, len(line)))
+        elif (sample_index := rng.randrange(line_count + 1)) < sample_count:
+            sample[sample_index] = (byte_offset, len(line))
+        line_count += 1
+        byte_offset += len(line)
+        frame_lines.append(line)
+        frame_bytes += len(line)
+        if frame_bytes >= frame_size:
+            yield b''.join(frame_lines)
+            frame_lines = []
+            frame_bytes = 0
+    if len(frame_lines) > 0:
+        yield b''.join(frame_lines)
+
+def aac_reframe_compress_frame(level, frame):
+    # Compressors aren't thread-safe, and cheap to create compared to compressing a frame.
+    return zstandard.ZstdCompressor(level=level, write_content_size=True).compress(frame)
+
+# Write `source_filepath` (as read by aac_open_file_for_indexing) to `output_filepath` in the seekable zstd format.
+# Returns (md5 of the decompressed contents, decompressed size, [(byte_offset, byte_length), ...] of sampled lines).
+def aac_reframe_write(source_filepath, output_filepath, frame_size, level, threads, sample_count):
+    sample = []
+    rng = random.Random(source_filepath)
+    md5 = hashlib.md5()
+    decompressed_size = 0
+    seek_table_entries = []
+    file, _uncompressed_size = aac_open_file_for_indexing(source_filepath)
+    with file, open(output_filepath, 'wb') as output_file, concurrent.futures.ThreadPoolExecutor(max_workers=threads) as executor:
+        # zstandard releases the GIL while compressing, so threads are enough; a window of frames keeps memory bounded.
+        for frames in more_itertools.chunked(aac_reframe_split_frames(file, frame_size, sample, rng, sample_count), threads*2):
+            for frame, compressed_frame in zip(frames, executor.map(aac_reframe_compress_frame, [level]*len(frames), frames)):
+                md5.update(frame)
+                decompressed_size += len(frame)
+                output_file.write(compressed_frame)
+                seek_table_entries.append((len(compressed_frame), len(frame)))
+        seek_table = b''.join([struct.pack('<II', compressed_size, frame_decompressed_size) for compressed_size, frame_decompressed_size in seek_table_entries])
+        seek_table += struct.pack('<IBI', len(seek_table_entries), 0, AAC_SEEK_TABLE_FOOTER_MAGIC)
+        output_file.write(struct.pack('<II', AAC_SEEK_TABLE_SKIPPABLE_MAGIC, len(seek_table)) + seek_table)
+    return (md5.hexdigest(), decompressed_size, sample)
+
+def aac_reframe_verify(filepath, expected_md5, expected_size):
+    md5 = hashlib.md5()
+    size = 0
+    with indexed_zstd.IndexedZstdFile(filepath) as file:
+        while len(chunk := file.read(10000000)) > 0:
+            md5.update(chunk)
+            size += len(chunk)
+    if (md5.hexdigest(), size) != (expected_md5, expected_size):
+        raise Exception(f"Verification of {filepath} failed: {md5.hexdigest()=} {size=} {expected_md5=} {expected_size=}")
+
+# Returns (seconds to open, [seconds per random line read, sorted]).
+def aac_reframe_benchmark(filepath, sample):
+    aac_drop_page_cache(filepath)
+    start_time = time.time()
+    with indexed_zstd.IndexedZstdFile(filepath) as file:
+        open_seconds = time.time() - start_time
+        read_seconds = []
+        for byte_offset, byte_length in sample:
+            start_time = time.time()
+            file.seek(byte_offset)
+            if len(file.read(byte_length)) != byte_length:
+                raise Exception(f"Short read in {filepath=} at {byte_offset=}")
+            read_seconds.append(time.time() - start_time)
+    return (open_seconds, sorted(read_seconds))
+
+def aac_reframe_internal(collection, frame_size, level, threads, benchmark_frame_sizes, random_reads, dry_run=False):
+    with engine.connect() as connection:
+        cursor = allthethings.utils.get_cursor_ping_conn(connection)
+        cursor.execute('SELECT filename FROM annas_archive_meta_aac_filenames WHERE collection = %(collection)s', { "collection": collection })
+        filename = allthethings.utils.fetch_one_field(cursor)
+    if filename is None:
+        raise Exception(f"No file for {collection=} in annas_archive_meta_aac_filenames, run mysql_build_aac_tables first")
+    filepath = f'{allthethings.utils.aac_path_prefix()}{filename}'
+    if os.path.exists(filepath.replace('.seekable.zst', '')):
+        print(f"Note: {filepath.replace('.seekable.zst', '')} exists, and is used instead of the .seekable.zst for reads unless aac_read_paths.json says otherwise.")
+
+    frame_sizes = list(dict.fromkeys(benchmark_frame_sizes + ([] if dry_run else [frame_size])))
+    tmp_filepaths = { size: f'{filepath}.reframe_{size}.tmp' for size in frame_sizes }
+    try:
+        sample = None
+        results = {}
+        for size in frame_sizes:
+            print(f"Writing {collection} with {size=} {level=}..")
+            start_time = time.time()
+            md5, decompressed_size, sample = aac_reframe_write(filepath, tmp_filepaths[size], size, level, threads, random_reads)
+            write_seconds = time.time() - start_time
+            aac_reframe_verify(tmp_filepaths[size], md5, decompressed_size)
+            results[size] = (os.path.getsize(tmp_filepaths[size]), write_seconds, *aac_reframe_benchmark(tmp_filepaths[size], sample))
+        if sample is not None:
+            results['current'] = (os.path.getsize(filepath), 0.0, *aac_reframe_benchmark(filepath, sample))
+
+        if len(results) > 0:
+            print(f"{'frame size':>12} {'on disk':>12} {'ratio':>7} {'write':>8} {'open':>9} {'read p50':>10} {'read p99':>10} {'read mean':>10}")
+            for size, (disk_bytes, write_seconds, open_seconds, read_seconds) in results.items():
+                print(f"{size:>12} {disk_bytes/1000000:10.1f}MB {decompressed_size/max(disk_bytes, 1):7.2f} {write_seconds:7.1f}s {open_seconds*1000:7.2f}ms {read_seconds[len(read_seconds)//2]*1000:8.3f}ms {read_seconds[len(read_seconds)*99//100]*1000:8.3f}ms {sum(read_seconds)*1000/len(read_seconds):8.3f}ms")
+
+        if dry_run:
+            return
+        os.replace(tmp_filepaths[frame_size], filepath)
+        print(f"Replaced {filepath} (frame size {frame_size}, level {level}); byte offsets in annas_archive_meta__aacid__{collection} are unchanged.")
+    finally:
+        for tmp_filepath in tmp_filepaths.values():
+            if os.path.exists(tmp_filepath):
+                os.remove(tmp_filepath)
+
+
 
 
 #################################################################################################
@@ -495,6 +1226,20 @@ es_create_index_body = {
     },
 }
 
+# Set by elastic_build_aarecords_blue_green_internal to build into the "{index_name}__{virtshard}__{version}" shadow
+# indices instead of the live ones. Passed on to the pool workers through elastic_build_aarecords_job_init_pool.
+elastic_build_aarecords_index_version = None
+
+def elastic_build_aarecords_index_name(index_name, virtshard, index_version):
+    if index_version is None:
+        return f'{index_name}__{virtshard}'
+    return f'{index_name}__{virtshard}__{index_version}'
+
+# The "{index_name}__{virtshard}" indices themselves, or after a blue-green build, the versioned indices that they
+# are aliases of (and any shadow indices of unfinished builds).
+def elastic_virtshard_concrete_indices(es_handle, index_name):
+    return sorted(es_handle.indices.get(index=f'{index_name}__*').keys())
+
 #################################################################################################
 # Recreate "aarecords" index in ElasticSearch, without filling it with data yet.
 # (That is done with `./run flask cli elastic_build_aarecords_*`)
@@ -512,8 +1257,8 @@ def elastic_reset_aarecords_internal():
     print("Deleting ES indices")
     for index_name, es_handle in allthethings.utils.SEARCH_INDEX_TO_ES_MAPPING.items():
         es_handle.options(ignore_status=[400,404]).indices.delete(index=index_name) # Old
-        for virtshard in range(0, 100): # Out of abundance, delete up to a large number
-            es_handle.options(ignore_status=[400,404]).indices.delete(index=f'{index_name}__{virtshard}')
+        for full_index_name in elastic_virtshard_concrete_indices(es_handle, index_name):
+            es_handle.options(ignore_status=[400,404]).indices.delete(index=full_index_name)
     print("Creating ES indices")
     for index_name, es_handle in allthethings.utils.SEARCH_INDEX_TO_ES_MAPPING.items():
         for full_index_name in allthethings.utils.all_virtshards_for_index(index_name):
@@ -539,12 +1284,13 @@ def new_tables_internal(codes_table_name, codes_for_lookup_table_name=None):
         cursor = session.connection().connection.cursor(pymysql.cursors.DictCursor)
         print(f"Creating fresh table {codes_table_name}")
         cursor.execute(f'DROP TABLE IF EXISTS {codes_table_name}')
-        cursor.execute(f'CREATE TABLE {codes_table_name} (id BIGINT NOT NULL AUTO_INCREMENT, code VARBINARY({allthethings.utils.AARECORDS_CODES_CODE_LENGTH}) NOT NULL, aarecord_id VARBINARY({allthethings.utils.AARECORDS_CODES_AARECORD_ID_LENGTH}) NOT NULL, PRIMARY KEY (id)) ENGINE=MyISAM DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_bin')
+        cursor.execute(f'CREATE TABLE {codes_table_name} (id BIGINT NOT NULL AUTO_INCREMENT, code VARBINARY({allthethings.utils.AARECORDS_CODES_CODE_LENGTH}) NOT NULL, aarecord_id VARBINARY({allthethings.utils.AARECORDS_CODES_AARECORD_ID_LENGTH}) NOT NULL, PRIMARY KEY (id), INDEX aarecord_id (aarecord_id)) ENGINE=MyISAM DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_bin')
         cursor.execute('COMMIT')
         if codes_for_lookup_table_name is not None:
+            codes_for_lookup_table_name = allthethings.utils.aarecords_codes_for_lookup_table_name(codes_for_lookup_table_name)
             print(f"Creating fresh table {codes_for_lookup_table_name}")
             cursor.execute(f'DROP TABLE IF EXISTS {codes_for_lookup_table_name}')
-            cursor.execute(f'CREATE TABLE {codes_for_lookup_table_name} (code VARBINARY({allthethings.utils.AARECORDS_CODES_CODE_LENGTH}) NOT NULL, aarecord_id VARBINARY({allthethings.utils.AARECORDS_CODES_AARECORD_ID_LENGTH}) NOT NULL, PRIMARY KEY (code, aarecord_id)) ENGINE=MyISAM DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_bin')
+            cursor.execute(f'CREATE TABLE {codes_for_lookup_table_name} (code VARBINARY({allthethings.utils.AARECORDS_CODES_CODE_LENGTH}) NOT NULL, aarecord_id VARBINARY({allthethings.utils.AARECORDS_CODES_AARECORD_ID_LENGTH}) NOT NULL, PRIMARY KEY (code, aarecord_id), INDEX aarecord_id (aarecord_id)) ENGINE=MyISAM DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_bin')
             cursor.execute('COMMIT')
 
 #################################################################################################
@@ -557,17 +1303,107 @@ def update_aarecords_index_mappings():
             es_handle.indices.put_mapping(body=es_create_index_body['mappings'], index=full_index_name)
     print("Done!")
 
-def elastic_build_aarecords_job_init_pool():
+# Writing to ES and MariaDB happens on a background thread in each pool worker, so the worker can already
+# compute the next chunk while the previous one is being written. The queue is bounded: when ES or MariaDB
+# falls behind, the worker blocks in put() instead of piling up aarecords in memory. Set to 0 to write
+# inline in elastic_build_aarecords_job, like before.
+AARECORDS_WRITE_QUEUE_SIZE = 2
+
+elastic_build_aarecords_writer_queue = None
+elastic_build_aarecords_writer_thread = None
+elastic_build_aarecords_writer_error_event = None
+elastic_build_aarecords_write_ack_queue = None
+
+def elastic_build_aarecords_writer_start(writer_error_event, write_ack_queue=None):
+    global elastic_build_aarecords_writer_queue
+    global elastic_build_aarecords_writer_thread
+    global elastic_build_aarecords_writer_error_event
+    global elastic_build_aarecords_write_ack_queue
+    elastic_build_aarecords_writer_error_event = writer_error_event
+    elastic_build_aarecords_write_ack_queue = write_ack_queue
+    if AARECORDS_WRITE_QUEUE_SIZE <= 0:
+        return
+    # Times two, since every job puts both its write_data and an ack (see elastic_build_aarecords_writer_ack).
+    elastic_build_aarecords_writer_queue = queue.Queue(maxsize=AARECORDS_WRITE_QUEUE_SIZE*2)
+    # Daemon, because threading._shutdown() would otherwise wait on it before the finalizer below gets to send
+    # the sentinel. The finalizer runs when the ProcessPoolExecutor shuts the worker down, and waits for all
+    # queued writes to finish. It needs to run before the finalizers of multiprocessing.Queue (exitpriority 10),
+    # which stop flushing the write acks.
+    elastic_build_aarecords_writer_thread = threading.Thread(target=elastic_build_aarecords_writer_loop, daemon=True)
+    elastic_build_aarecords_writer_thread.start()
+    multiprocessing.util.Finalize(None, elastic_build_aarecords_writer_drain, exitpriority=100)
+
+def elastic_build_aarecords_writer_loop():
+    while True:
+        item = elastic_build_aarecords_writer_queue.get()
+        if item is None:
+            return
+        if elastic_build_aarecords_writer_failed():
+            # Keep consuming so that workers blocked in put() can get to their error check.
+            continue
+        (write_data, ack_job_id) = item
+        try:
+            if write_data is not None:
+                elastic_build_aarecords_write(write_data)
+            if ack_job_id is not None:
+                elastic_build_aarecords_write_ack_queue.put(ack_job_id)
+        except Exception as err:
+            print(repr(err))
+            traceback.print_tb(err.__traceback__)
+            elastic_build_aarecords_writer_error_event.set()
+
+def elastic_build_aarecords_writer_drain():
+    if elastic_build_aarecords_writer_thread is not None:
+        elastic_build_aarecords_writer_queue.put(None)
+        elastic_build_aarecords_writer_thread.join()
+
+def elastic_build_aarecords_writer_failed():
+    return (elastic_build_aarecords_writer_error_event is not None) and elastic_build_aarecords_writer_error_event.is_set()
+
+def elastic_build_aarecords_write_enqueue(write_data):
+    if elastic_build_aarecords_writer_queue is None:
+        elastic_build_aarecords_write(write_data)
+    else:
+        elastic_build_aarecords_writer_queue.put((write_data, None))
+
+# Tells build_common that everything of job_id has been written. Goes through the writer queue, which is
+# first-in-first-out, so the ack is only sent after the writes that the job queued before it.
+def elastic_build_aarecords_writer_ack(job_id):
+    if elastic_build_aarecords_write_ack_queue is None:
+        return
+    if elastic_build_aarecords_writer_queue is None:
+        elastic_build_aarecords_write_ack_queue.put(job_id)
+    else:
+        elastic_build_aarecords_writer_queue.put((None, job_id))
+
+def elastic_build_aarecords_job_init_pool(writer_error_event=None, write_ack_queue=None, index_version=None):
     global elastic_build_aarecords_job_app
     global elastic_build_aarecords_compressor
+    global elastic_build_aarecords_index_version
+    elastic_build_aarecords_index_version = index_version
+    allthethings.utils.aarecords_codes_for_lookup_version = index_version
     print("Initializing pool worker (elastic_build_aarecords_job_init_pool)")
-    from allthethings.app import create_app
-    elastic_build_aarecords_job_app = create_app()
+    # Not the full create_app(), which also registers all blueprints, sets up middleware, mail and the debug
+    # toolbar, and checks mariapersist, in each of the THREADS workers. The job only needs an app context for
+    # flask_babel (force_locale/gettext in get_aarecords_mysql); the database engine and ES clients are
+    # module-level in allthethings.extensions.
+    elastic_build_aarecords_job_app = Flask('allthethings', root_path=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    elastic_build_aarecords_job_app.config.from_object("config.settings")
+    babel.init_app(elastic_build_aarecords_job_app, locale_selector=lambda: 'en')
+    # Builds read AAC lines in roughly ascending order, so let the kernel read ahead.
+    allthethings.utils.aac_readahead = AAC_READAHEAD_FOR_BUILDS
+    # There are many of these processes, and they hardly ever read a block again once they've moved past it,
+    # so only keep enough blocks for lines that span a few of them.
+    allthethings.utils.aac_block_cache_set_max_bytes(AAC_BLOCK_CACHE_MAX_BYTES_FOR_BUILDS)
+    # Read collections one after the other, instead of starting fetch threads in every one of these processes.
+    allthethings.utils.aac_fetch_in_parallel = False
 
     # Per https://stackoverflow.com/a/4060259
     __location__ = os.path.realpath(os.path.join(os.getcwd(), os.path.dirname(__file__)))
     elastic_build_aarecords_compressor = zstandard.ZstdCompressor(level=3, dict_data=zstandard.ZstdCompressionDict(pathlib.Path(os.path.join(__location__, 'aarecords_dump_for_dictionary.bin')).read_bytes()))
 
+    elastic_build_aarecords_writer_start(writer_error_event, write_ack_queue)
+
 AARECORD_ID_PREFIX_TO_CODES_TABLE_NAME = {
     'edsebk': 'aarecords_codes_edsebk',
     'ia': 'aarecords_codes_ia',
@@ -607,10 +1443,81 @@ AARECORD_ID_PREFIX_TO_CODES_FOR_LOOKUP = {
     'isbngrp': { 'table_name': 'aarecords_codes_isbngrp_for_lookup', 'code_names': ['isbn13', 'isbn13_prefix'] },
 }
 
-def elastic_build_aarecords_job(aarecord_ids):
+def elastic_build_aarecords_write(write_data):
+    operations_by_es_handle = write_data['operations_by_es_handle']
+    aarecords_all_md5_insert_data = write_data['aarecords_all_md5_insert_data']
+    nexusstc_cid_only_insert_data = write_data['nexusstc_cid_only_insert_data']
+    md5_doi_digests = write_data['md5_doi_digests']
+    aarecords_codes_insert_data_by_codes_table_name = write_data['aarecords_codes_insert_data_by_codes_table_name']
+
+    with Session(engine) as session:
+        session.connection().connection.ping(reconnect=True)
+        cursor = session.connection().connection.cursor(pymysql.cursors.DictCursor)
+
+        try:
+            for es_handle, operations in operations_by_es_handle.items():
+                elasticsearch.helpers.bulk(es_handle, operations, request_timeout=30)
+        except Exception as err:
+            if hasattr(err, 'errors'):
+                print(err.errors)
+            print(repr(err))
+            print("Got the above error; retrying..")
+            try:
+                for es_handle, operations in operations_by_es_handle.items():
+                    elasticsearch.helpers.bulk(es_handle, operations, request_timeout=30)
+            except Exception as err:
+                if hasattr(err, 'errors'):
+                    print(err.errors)
+                print(repr(err))
+                print("Got the above error; retrying one more time..")
+                for es_handle, operations in operations_by_es_handle.items():
+                    elasticsearch.helpers.bulk(es_handle, operations, request_timeout=30)
+
+        # print(f"[{os.getpid()}] elastic_build_aarecords_write inserted into ES")
+
+        if len(aarecords_all_md5_insert_data) > 0:
+            session.connection().connection.ping(reconnect=True)
+            # Avoiding IGNORE / ON DUPLICATE KEY here because of locking.
+            # WARNING: when trying to optimize this (e.g. if you see this in SHOW PROCESSLIST) know that this is a bit of a bottleneck, but
+            # not a huge one. Commenting out all these inserts doesn't speed up the job by that much.
+            cursor.executemany('INSERT DELAYED INTO aarecords_all_md5 (md5, json_compressed) VALUES (%(md5)s, %(json_compressed)s)', aarecords_all_md5_insert_data)
+            cursor.execute('COMMIT')
+
+        if len(nexusstc_cid_only_insert_data) > 0:
+            session.connection().connection.ping(reconnect=True)
+            # Avoiding IGNORE / ON DUPLICATE KEY here because of locking.
+            # WARNING: when trying to optimize this (e.g. if you see this in SHOW PROCESSLIST) know that this is a bit of a bottleneck, but
+            # not a huge one. Commenting out all these inserts doesn't speed up the job by that much.
+            cursor.executemany('INSERT DELAYED INTO nexusstc_cid_only (nexusstc_id) VALUES (%(nexusstc_id)s)', nexusstc_cid_only_insert_data)
+            cursor.execute('COMMIT')
+
+        if len(md5_doi_digests) > 0:
+            aarecords_dois_seen_append(md5_doi_digests)
+
+        for codes_table_name, aarecords_codes_insert_data in aarecords_codes_insert_data_by_codes_table_name.items():
+            if len(aarecords_codes_insert_data) > 0:
+                for insert_item in aarecords_codes_insert_data:
+                    if len(insert_item['code']) > allthethings.utils.AARECORDS_CODES_CODE_LENGTH:
+                        raise Exception(f"Code length exceeds allthethings.utils.AARECORDS_CODES_CODE_LENGTH for {insert_item=}")
+                    if len(insert_item['aarecord_id']) > allthethings.utils.AARECORDS_CODES_AARECORD_ID_LENGTH:
+                        raise Exception(f"Code length exceeds allthethings.utils.AARECORDS_CODES_AARECORD_ID_LENGTH for {insert_item=}")
+
+                session.connection().connection.ping(reconnect=True)
+                # Avoiding IGNORE / ON DUPLICATE KEY here because of locking.
+                # WARNING: when trying to optimize this (e.g. if you see this in SHOW PROCESSLIST) know that this is a bit of a bottleneck, but
+                # not a huge one. Commenting out all these inserts doesn't speed up the job by that much.
+                cursor.executemany(f"INSERT DELAYED INTO {codes_table_name} (code, aarecord_id) VALUES (%(code)s, %(aarecord_id)s)", aarecords_codes_insert_data)
+                cursor.execute('COMMIT')
+
+# With lookup_codes set to a list, the codes that are written to the *_for_lookup tables are appended to it.
+def elastic_build_aarecords_job(aarecord_ids, lookup_codes=None):
     global elastic_build_aarecords_job_app
     global elastic_build_aarecords_compressor
 
+    if elastic_build_aarecords_writer_failed():
+        print("Writer thread failed earlier; not processing more aarecords")
+        return True
+
     with elastic_build_aarecords_job_app.app_context():
         try:
             aarecord_ids = list(aarecord_ids)
@@ -630,7 +1537,7 @@ def elastic_build_aarecords_job(aarecord_ids):
                     bad_isbn13_aarecord_ids += set([aarecord_id for aarecord_id in aarecord_ids if aarecord_id.startswith('isbndb:') and aarecord_id not in valid_isbndb_aarecord_ids])
                     # Also filter out existing isbndb: aarecord_ids, which we can get since we do two passes (isbn13 and isbn10).
                     cursor = allthethings.utils.get_cursor_ping(session)
-                    cursor.execute('SELECT aarecord_id FROM aarecords_codes_isbndb_for_lookup WHERE code="collection:isbndb" AND aarecord_id IN %(aarecord_ids)s', { "aarecord_ids": [aarecord_id for aarecord_id in aarecord_ids if aarecord_id.startswith('isbndb:')]})
+                    cursor.execute(f'SELECT aarecord_id FROM {allthethings.utils.aarecords_codes_for_lookup_table_name("aarecords_codes_isbndb_for_lookup")} WHERE code="collection:isbndb" AND aarecord_id IN %(aarecord_ids)s', { "aarecord_ids": [aarecord_id for aarecord_id in aarecord_ids if aarecord_id.startswith('isbndb:')]})
                     bad_isbn13_aarecord_ids += set([aarecord_id.decode() for aarecord_id in allthethings.utils.fetch_scalars(cursor)])
                 bad_isbn13_aarecord_ids = set(bad_isbn13_aarecord_ids)
 
@@ -638,9 +1545,7 @@ def elastic_build_aarecords_job(aarecord_ids):
                 dois_from_ids = [aarecord_id[4:].encode() for aarecord_id in aarecord_ids if aarecord_id.startswith('doi:')]
                 doi_codes_with_md5 = set()
                 if len(dois_from_ids) > 0:
-                    cursor = allthethings.utils.get_cursor_ping(session)
-                    cursor.execute('SELECT doi FROM temp_md5_with_doi_seen WHERE doi IN %(dois_from_ids)s', { "dois_from_ids": dois_from_ids })
-                    doi_codes_with_md5 = set([f"doi:{row['doi'].decode(errors='replace')}" for row in cursor.fetchall()])
+                    doi_codes_with_md5 = set([f"doi:{doi.decode()}" for doi in aarecords_dois_seen_filter(dois_from_ids)])
 
                 aarecord_ids = [aarecord_id for aarecord_id in aarecord_ids if (aarecord_id not in bad_isbn13_aarecord_ids) and (aarecord_id not in doi_codes_with_md5) and (aarecord_id not in allthethings.utils.SEARCH_FILTERED_BAD_AARECORD_IDS)]
                 if len(aarecord_ids) == 0:
@@ -651,7 +1556,7 @@ def elastic_build_aarecords_job(aarecord_ids):
                 # print(f"[{os.getpid()}] elastic_build_aarecords_job got aarecords {len(aarecords)}")
                 aarecords_all_md5_insert_data = []
                 nexusstc_cid_only_insert_data = []
-                temp_md5_with_doi_seen_insert_data = []
+                md5_doi_digests = []
                 aarecords_codes_insert_data_by_codes_table_name = collections.defaultdict(list)
                 for aarecord in aarecords:
                     aarecord_id_split = aarecord['id'].split(':', 1)
@@ -673,7 +1578,7 @@ def elastic_build_aarecords_job(aarecord_ids):
                             })),
                         })
                         for doi in aarecord['file_unified_data']['identifiers_unified'].get('doi') or []:
-                            temp_md5_with_doi_seen_insert_data.append({ "doi": doi.encode() })
+                            md5_doi_digests.append(hashlib.md5(doi.encode()).digest())
                     elif aarecord_id_split[0] == 'nexusstc':
                         source_records_by_type = allthethings.utils.groupby(aarecord['source_records'], 'source_type', 'source_record')
                         for source_record in source_records_by_type['aac_nexusstc']:
@@ -682,7 +1587,7 @@ def elastic_build_aarecords_job(aarecord_ids):
 
                     for index in aarecord['indexes']:
                         virtshard = allthethings.utils.virtshard_for_hashed_aarecord_id(hashed_aarecord_id)
-                        operations_by_es_handle[allthethings.utils.SEARCH_INDEX_TO_ES_MAPPING[index]].append({ **aarecord, '_op_type': 'index', '_index': f'{index}__{virtshard}', '_id': aarecord['id'] })
+                        operations_by_es_handle[allthethings.utils.SEARCH_INDEX_TO_ES_MAPPING[index]].append({ **aarecord, '_op_type': 'index', '_index': elastic_build_aarecords_index_name(index, virtshard, elastic_build_aarecords_index_version), '_id': aarecord['id'] })
 
                     codes = []
                     for code_name in aarecord['file_unified_data']['identifiers_unified'].keys():
@@ -697,72 +1602,22 @@ def elastic_build_aarecords_job(aarecord_ids):
                         aarecords_codes_insert_data_by_codes_table_name[codes_table_name].append({ 'code': code_text, 'aarecord_id': aarecord['id'].encode() })
                         if aarecord_id_split[0] in AARECORD_ID_PREFIX_TO_CODES_FOR_LOOKUP:
                             if code[0] in AARECORD_ID_PREFIX_TO_CODES_FOR_LOOKUP[aarecord_id_split[0]]['code_names']:
-                                codes_for_lookup_table_name = AARECORD_ID_PREFIX_TO_CODES_FOR_LOOKUP[aarecord_id_split[0]]['table_name']
+                                codes_for_lookup_table_name = allthethings.utils.aarecords_codes_for_lookup_table_name(AARECORD_ID_PREFIX_TO_CODES_FOR_LOOKUP[aarecord_id_split[0]]['table_name'])
                                 aarecords_codes_insert_data_by_codes_table_name[codes_for_lookup_table_name].append({ 'code': code_text, 'aarecord_id': aarecord['id'].encode() })
+                                if lookup_codes is not None:
+                                    lookup_codes.append(code_text)
 
                 # print(f"[{os.getpid()}] elastic_build_aarecords_job finished for loop")
 
-                try:
-                    for es_handle, operations in operations_by_es_handle.items():
-                        elasticsearch.helpers.bulk(es_handle, operations, request_timeout=30)
-                except Exception as err:
-                    if hasattr(err, 'errors'):
-                        print(err.errors)
-                    print(repr(err))
-                    print("Got the above error; retrying..")
-                    try:
-                        for es_handle, operations in operations_by_es_handle.items():
-                            elasticsearch.helpers.bulk(es_handle, operations, request_timeout=30)
-                    except Exception as err:
-                        if hasattr(err, 'errors'):
-                            print(err.errors)
-                        print(repr(err))
-                        print("Got the above error; retrying one more time..")
-                        for es_handle, operations in operations_by_es_handle.items():
-                            elasticsearch.helpers.bulk(es_handle, operations, request_timeout=30)
-
-                # print(f"[{os.getpid()}] elastic_build_aarecords_job inserted into ES")
-
-                if len(aarecords_all_md5_insert_data) > 0:
-                    session.connection().connection.ping(reconnect=True)
-                    # Avoiding IGNORE / ON DUPLICATE KEY here because of locking.
-                    # WARNING: when trying to optimize this (e.g. if you see this in SHOW PROCESSLIST) know that this is a bit of a bottleneck, but
-                    # not a huge one. Commenting out all these inserts doesn't speed up the job by that much.
-                    cursor.executemany('INSERT DELAYED INTO aarecords_all_md5 (md5, json_compressed) VALUES (%(md5)s, %(json_compressed)s)', aarecords_all_md5_insert_data)
-                    cursor.execute('COMMIT')
-
-                if len(nexusstc_cid_only_insert_data) > 0:
-                    session.connection().connection.ping(reconnect=True)
-                    # Avoiding IGNORE / ON DUPLICATE KEY here because of locking.
-                    # WARNING: when trying to optimize this (e.g. if you see this in SHOW PROCESSLIST) know that this is a bit of a bottleneck, but
-                    # not a huge one. Commenting out all these inserts doesn't speed up the job by that much.
-                    cursor.executemany('INSERT DELAYED INTO nexusstc_cid_only (nexusstc_id) VALUES (%(nexusstc_id)s)', nexusstc_cid_only_insert_data)
-                    cursor.execute('COMMIT')
-
-                if len(temp_md5_with_doi_seen_insert_data) > 0:
-                    session.connection().connection.ping(reconnect=True)
-                    # Avoiding IGNORE / ON DUPLICATE KEY here because of locking.
-                    # WARNING: when trying to optimize this (e.g. if you see this in SHOW PROCESSLIST) know that this is a bit of a bottleneck, but
-                    # not a huge one. Commenting out all these inserts doesn't speed up the job by that much.
-                    cursor.executemany('INSERT DELAYED INTO temp_md5_with_doi_seen (doi) VALUES (%(doi)s)', temp_md5_with_doi_seen_insert_data)
-                    cursor.execute('COMMIT')
-
-                for codes_table_name, aarecords_codes_insert_data in aarecords_codes_insert_data_by_codes_table_name.items():
-                    if len(aarecords_codes_insert_data) > 0:
-                        for insert_item in aarecords_codes_insert_data:
-                            if len(insert_item['code']) > allthethings.utils.AARECORDS_CODES_CODE_LENGTH:
-                                raise Exception(f"Code length exceeds allthethings.utils.AARECORDS_CODES_CODE_LENGTH for {insert_item=}")
-                            if len(insert_item['aarecord_id']) > allthethings.utils.AARECORDS_CODES_AARECORD_ID_LENGTH:
-                                raise Exception(f"Code length exceeds allthethings.utils.AARECORDS_CODES_AARECORD_ID_LENGTH for {insert_item=}")
-
-                        session.connection().connection.ping(reconnect=True)
-                        # Avoiding IGNORE / ON DUPLICATE KEY here because of locking.
-                        # WARNING: when trying to optimize this (e.g. if you see this in SHOW PROCESSLIST) know that this is a bit of a bottleneck, but
-                        # not a huge one. Commenting out all these inserts doesn't speed up the job by that much.
-                        cursor.executemany(f"INSERT DELAYED INTO {codes_table_name} (code, aarecord_id) VALUES (%(code)s, %(aarecord_id)s)", aarecords_codes_insert_data)
-                        cursor.execute('COMMIT')
-
-                # print(f"[{os.getpid()}] elastic_build_aarecords_job inserted into aarecords_all")
+                elastic_build_aarecords_write_enqueue({
+                    'operations_by_es_handle': operations_by_es_handle,
+                    'aarecords_all_md5_insert_data': aarecords_all_md5_insert_data,
+                    'nexusstc_cid_only_insert_data': nexusstc_cid_only_insert_data,
+                    'md5_doi_digests': md5_doi_digests,
+                    'aarecords_codes_insert_data_by_codes_table_name': aarecords_codes_insert_data_by_codes_table_name,
+                })
+
+                # print(f"[{os.getpid()}] elastic_build_aarecords_job queued writes")
                 # print(f"[{os.getpid()}] Processed {len(aarecords)} md5s")
 
                 return False
@@ -775,12 +1630,36 @@ def elastic_build_aarecords_job(aarecord_ids):
 THREADS = 200
 CHUNK_SIZE = 50
 BATCH_SIZE = 100000
+# CHUNK_SIZE is only the starting point: build_common resizes chunks so that each job takes about
+# CHUNK_TARGET_SECONDS, based on the observed time per row. A chunk of duxiu or oclc records costs a lot
+# more than one of isbndb ids.
+CHUNK_TARGET_SECONDS = 3.0
+CHUNK_SIZE_MIN = 1
+CHUNK_SIZE_MAX = 1000
 
 # Locally
 if SLOW_DATA_IMPORTS:
     THREADS = 1
     CHUNK_SIZE = 10
     BATCH_SIZE = 1000
+    CHUNK_SIZE_MAX = 10
+
+def elastic_build_aarecords_job_timed(aarecord_ids, job_id=None):
+    start_time = time.monotonic()
+    result = elastic_build_aarecords_job(aarecord_ids)
+    if (not result) and (job_id is not None):
+        elastic_build_aarecords_writer_ack(job_id)
+    return (result, time.monotonic() - start_time)
+
+def build_common_chunk_size(seconds_per_row, rows_left_in_batch):
+    if seconds_per_row is None:
+        chunk_size = CHUNK_SIZE
+    else:
+        chunk_size = int(CHUNK_TARGET_SECONDS / max(seconds_per_row, 1e-6))
+    # Towards the end of a batch, spread the remaining rows over all workers, so they all finish around
+    # the same time instead of waiting on a few large chunks.
+    chunk_size = min(chunk_size, (rows_left_in_batch + THREADS - 1) // THREADS)
+    return max(CHUNK_SIZE_MIN, min(CHUNK_SIZE_MAX, chunk_size))
 
 # Uncomment to do them one by one
 # THREADS = 1
@@ -789,46 +1668,206 @@ if SLOW_DATA_IMPORTS:
 
 #################################################################################################
 # ./run flask cli elastic_build_aarecords_all
+#
+# Every source saves checkpoints in aarecords_build_checkpoints: the last primary id of which all batches
+# before it have been completely written to ES and MariaDB, and the last primary id that has been handed
+# to the workers. If a build fails, `--resume` (here or on any elastic_build_aarecords_* command) skips the
+# sources that are done, and continues the others from their checkpoint, without recreating their tables.
+# Rows of the batches that were in flight are deleted first, since they might be partially written.
+# Without `--resume`, the checkpoints of the source (or of all sources here) are cleared at the start.
+# ./run flask cli elastic_build_aarecords_all --resume
 @cli.cli.command('elastic_build_aarecords_all')
-def elastic_build_aarecords_all():
-    elastic_build_aarecords_all_internal()
+@click.option('--resume', is_flag=True, help='Continue an interrupted build from its last checkpoints.')
+def elastic_build_aarecords_all(resume):
+    elastic_build_aarecords_all_internal(resume=resume)
+
+def elastic_build_aarecords_all_internal(resume=False):
+    if not resume:
+        # Otherwise a later --resume would skip sources that were only done in an earlier build.
+        build_common_checkpoints_clear()
+    # Taken before building, so that AAC rows indexed in the meantime are picked up by the next delta build.
+    aac_snapshot = aarecords_delta_aac_snapshot()
+    elastic_build_aarecords_oclc_internal(resume=resume)
+    elastic_build_aarecords_edsebk_internal(resume=resume)
+    elastic_build_aarecords_cerlalc_internal(resume=resume)
+    elastic_build_aarecords_czech_oo42hcks_internal(resume=resume)
+    elastic_build_aarecords_gbooks_internal(resume=resume)
+    elastic_build_aarecords_goodreads_internal(resume=resume)
+    elastic_build_aarecords_isbngrp_internal(resume=resume)
+    elastic_build_aarecords_libby_internal(resume=resume)
+    elastic_build_aarecords_rgb_internal(resume=resume)
+    elastic_build_aarecords_trantor_internal(resume=resume)
+    elastic_build_aarecords_magzdb_internal(resume=resume)
+    elastic_build_aarecords_nexusstc_internal(resume=resume)
+    elastic_build_aarecords_isbndb_internal(resume=resume)
+    elastic_build_aarecords_ol_internal(resume=resume)
+    elastic_build_aarecords_duxiu_internal(resume=resume)
+    elastic_build_aarecords_ia_internal(resume=resume) # IA depends on tables generated above, so we do it last.
+    elastic_build_aarecords_main_internal(resume=resume) # Main depends on tables generated above, so we do it last.
+    aarecords_delta_watermarks_save(aac_snapshot)
+    if elastic_build_aarecords_index_version is not None:
+        # Also force-merges, before the replicas are added back.
+        elastic_build_aarecords_shadow_indices_finish(elastic_build_aarecords_index_version)
+    else:
+        elastic_build_aarecords_forcemerge_internal()
+
+def build_common_checkpoints_start(source, resume):
+    with engine.connect() as connection:
+        cursor = allthethings.utils.get_cursor_ping_conn(connection)
+        cursor.execute('CREATE TABLE IF NOT EXISTS aarecords_build_checkpoints (`source` VARCHAR(250) NOT NULL, `table_name` VARCHAR(250) NOT NULL, `primary_id_column` VARCHAR(250) NOT NULL, `committed_primary_id` VARBINARY(1000) NULL, `submitted_primary_id` VARBINARY(1000) NULL, `primary_id_is_binary` TINYINT NOT NULL, `done` TINYINT NOT NULL, PRIMARY KEY (`source`, `table_name`, `primary_id_column`)) ENGINE=MyISAM DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_bin')
+        if resume:
+            cursor.execute('SELECT COUNT(*) AS count FROM aarecords_build_checkpoints WHERE source = %(source)s', { "source": source })
+            if list(cursor.fetchall())[0]['count'] > 0:
+                print(f"[{source}] Resuming from checkpoints")
+                return True
+            print(f"[{source}] No checkpoints to resume from")
+        cursor.execute('DELETE FROM aarecords_build_checkpoints WHERE source = %(source)s', { "source": source })
+        cursor.execute('COMMIT')
+        return False
 
-def elastic_build_aarecords_all_internal():
-    elastic_build_aarecords_oclc_internal()
-    elastic_build_aarecords_edsebk_internal()
-    elastic_build_aarecords_cerlalc_internal()
-    elastic_build_aarecords_czech_oo42hcks_internal()
-    elastic_build_aarecords_gbooks_internal()
-    elastic_build_aarecords_goodreads_internal()
-    elastic_build_aarecords_isbngrp_internal()
-    elastic_build_aarecords_libby_internal()
-    elastic_build_aarecords_rgb_internal()
-    elastic_build_aarecords_trantor_internal()
-    elastic_build_aarecords_magzdb_internal()
-    elastic_build_aarecords_nexusstc_internal()
-    elastic_build_aarecords_isbndb_internal()
-    elastic_build_aarecords_ol_internal()
-    elastic_build_aarecords_duxiu_internal()
-    elastic_build_aarecords_ia_internal() # IA depends on tables generated above, so we do it last.
-    elastic_build_aarecords_main_internal() # Main depends on tables generated above, so we do it last.
-    elastic_build_aarecords_forcemerge_internal()
+def build_common_checkpoints_clear():
+    with engine.connect() as connection:
+        cursor = allthethings.utils.get_cursor_ping_conn(connection)
+        cursor.execute('DROP TABLE IF EXISTS aarecords_build_checkpoints')
+
+def build_common_checkpoint_load(source, table_name, primary_id_column):
+    with engine.connect() as connection:
+        cursor = allthethings.utils.get_cursor_ping_conn(connection)
+        cursor.execute('SELECT * FROM aarecords_build_checkpoints WHERE source = %(source)s AND table_name = %(table_name)s AND primary_id_column = %(primary_id_column)s', { "source": source, "table_name": table_name, "primary_id_column": primary_id_column })
+        checkpoint = (cursor.fetchall() or [None])[0]
+    if checkpoint is not None and not checkpoint['primary_id_is_binary']:
+        for key in ['committed_primary_id', 'submitted_primary_id']:
+            if checkpoint[key] is not None:
+                checkpoint[key] = checkpoint[key].decode()
+    return checkpoint
+
+def build_common_checkpoint_save(connection, source, table_name, primary_id_column, committed_primary_id, submitted_primary_id, done=False):
+    primary_id_is_binary = isinstance(submitted_primary_id, bytes)
+    def encode(primary_id):
+        return primary_id.encode() if isinstance(primary_id, str) else primary_id
+    cursor = allthethings.utils.get_cursor_ping_conn(connection)
+    cursor.execute('REPLACE INTO aarecords_build_checkpoints (source, table_name, primary_id_column, committed_primary_id, submitted_primary_id, primary_id_is_binary, done) VALUES (%(source)s, %(table_name)s, %(primary_id_column)s, %(committed_primary_id)s, %(submitted_primary_id)s, %(primary_id_is_binary)s, %(done)s)', { "source": source, "table_name": table_name, "primary_id_column": primary_id_column, "committed_primary_id": encode(committed_primary_id), "submitted_primary_id": encode(submitted_primary_id), "primary_id_is_binary": primary_id_is_binary, "done": done })
+    cursor.execute('COMMIT')
+
+# Deletes the MariaDB rows that elastic_build_aarecords_write wrote for aarecord_ids, so that the jobs can be run
+# again: codes tables have no unique keys, and aarecords_all_md5 and nexusstc_cid_only have ones that INSERT DELAYED
+# would trip on. ES documents simply get overwritten. Duplicates in the DOI set are harmless, since it's
+# deduplicated when it's built. Deletes from the codes tables go through their aarecord_id index, so the cost
+# depends on the number of aarecord_ids, not on the size of the tables.
+def aarecords_delete_written_rows(aarecord_ids):
+    aarecord_id_prefixes = set(aarecord_id.split(':', 1)[0] for aarecord_id in aarecord_ids)
+    with engine.connect() as connection:
+        cursor = allthethings.utils.get_cursor_ping_conn(connection)
+        cursor.execute('DROP TABLE IF EXISTS temp_aarecords_delete_ids')
+        cursor.execute(f'CREATE TABLE temp_aarecords_delete_ids (aarecord_id VARBINARY({allthethings.utils.AARECORDS_CODES_AARECORD_ID_LENGTH}) NOT NULL, PRIMARY KEY (aarecord_id)) ENGINE=MyISAM DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_bin')
+        for aarecord_ids_chunk in more_itertools.chunked(aarecord_ids, 10000):
+            cursor = allthethings.utils.get_cursor_ping_conn(connection)
+            cursor.executemany('INSERT IGNORE INTO temp_aarecords_delete_ids (aarecord_id) VALUES (%(aarecord_id)s)', [{ "aarecord_id": aarecord_id.encode() } for aarecord_id in aarecord_ids_chunk])
+            cursor.execute('COMMIT')
+
+        tables = set()
+        for aarecord_id_prefix in aarecord_id_prefixes:
+            tables.add(AARECORD_ID_PREFIX_TO_CODES_TABLE_NAME[aarecord_id_prefix])
+            if aarecord_id_prefix in AARECORD_ID_PREFIX_TO_CODES_FOR_LOOKUP:
+                tables.add(AARECORD_ID_PREFIX_TO_CODES_FOR_LOOKUP[aarecord_id_prefix]['table_name'])
+        for table in sorted(tables):
+            cursor = allthethings.utils.get_cursor_ping_conn(connection)
+            cursor.execute(f'SHOW INDEX FROM {table} WHERE Key_name = "aarecord_id"')
+            if len(list(cursor.fetchall())) == 0:
+                # Tables from before new_tables_internal created this index.
+                print(f"Adding INDEX aarecord_id to {table} (once; this takes a while for large tables)")
+                cursor.execute(f'ALTER TABLE {table} ADD INDEX aarecord_id (aarecord_id)')
+            cursor.execute(f'DELETE {table} FROM {table} JOIN temp_aarecords_delete_ids USING (aarecord_id)')
+            print(f"Deleted {cursor.rowcount} rows from {table}")
+        if 'md5' in aarecord_id_prefixes:
+            cursor = allthethings.utils.get_cursor_ping_conn(connection)
+            cursor.execute('DELETE aarecords_all_md5 FROM aarecords_all_md5 JOIN temp_aarecords_delete_ids ON (aarecords_all_md5.md5 = UNHEX(SUBSTRING(temp_aarecords_delete_ids.aarecord_id, 5))) WHERE temp_aarecords_delete_ids.aarecord_id LIKE "md5:%%"')
+            print(f"Deleted {cursor.rowcount} rows from aarecords_all_md5")
+        if 'nexusstc' in aarecord_id_prefixes:
+            cursor = allthethings.utils.get_cursor_ping_conn(connection)
+            cursor.execute('DELETE nexusstc_cid_only FROM nexusstc_cid_only JOIN temp_aarecords_delete_ids ON (nexusstc_cid_only.nexusstc_id = SUBSTRING(temp_aarecords_delete_ids.aarecord_id, 10)) WHERE temp_aarecords_delete_ids.aarecord_id LIKE "nexusstc:%%"')
+            print(f"Deleted {cursor.rowcount} rows from nexusstc_cid_only")
+        cursor = allthethings.utils.get_cursor_ping_conn(connection)
+        cursor.execute('DROP TABLE IF EXISTS temp_aarecords_delete_ids')
 
-def build_common(table_name, batch_to_aarecord_ids, primary_id_column='primary_id', additional_where='', additional_select_AGGREGATES='', before_first_primary_id_WARNING_WARNING=''):
+# Jobs for primary ids between the committed and the submitted one might have been partially written when the
+# build stopped, so their rows are deleted before they are run again.
+def build_common_delete_partial_writes(table_name, batch_to_aarecord_ids, primary_id_column, additional_where, additional_select_AGGREGATES, committed_primary_id, submitted_primary_id):
+    aarecord_ids = []
+    with engine.connect() as connection:
+        current_primary_id = committed_primary_id
+        while True:
+            cursor = allthethings.utils.get_cursor_ping_conn(connection)
+            cursor.execute(f'SELECT {primary_id_column} AS primary_id, COUNT(*) AS count {additional_select_AGGREGATES} FROM {table_name} WHERE {additional_where} {"AND" if additional_where else ""} {primary_id_column} > %(from)s AND {primary_id_column} <= %(to)s GROUP BY {primary_id_column} ORDER BY {primary_id_column} LIMIT %(limit)s', { "from": current_primary_id, "to": submitted_primary_id, "limit": BATCH_SIZE })
+            batch = list(cursor.fetchall())
+            if len(batch) == 0:
+                break
+            for subbatch in more_itertools.chunked(batch, CHUNK_SIZE):
+                aarecord_ids += batch_to_aarecord_ids(subbatch)
+            current_primary_id = batch[-1]['primary_id']
+    aarecords_delete_written_rows(aarecord_ids)
+
+# With checkpoint_source set, the last primary id of the last batch that has been completely written is saved in
+# aarecords_build_checkpoints (see elastic_build_aarecords_all). With resume, we continue from there.
+def build_common(table_name, batch_to_aarecord_ids, primary_id_column='primary_id', additional_where='', additional_select_AGGREGATES='', before_first_primary_id_WARNING_WARNING='', checkpoint_source=None, resume=False):
     before_first_primary_id=before_first_primary_id_WARNING_WARNING
     if before_first_primary_id != '':
         for i in range(5):
             print(f"WARNING! before_first_primary_id set in {table_name} to {before_first_primary_id} (total will be off)!!!!!!!!!!!!")
 
+    if (checkpoint_source is not None) and resume:
+        checkpoint = build_common_checkpoint_load(checkpoint_source, table_name, primary_id_column)
+        if checkpoint is None:
+            print(f"[{checkpoint_source}] No checkpoint for {table_name} ({primary_id_column}), starting from the beginning")
+        elif checkpoint['done']:
+            print(f"[{checkpoint_source}] Skipping {table_name} ({primary_id_column}), already done")
+            return
+        else:
+            if checkpoint['committed_primary_id'] is not None:
+                before_first_primary_id = checkpoint['committed_primary_id']
+            if checkpoint['submitted_primary_id'] != checkpoint['committed_primary_id']:
+                print(f"[{checkpoint_source}] Deleting partial writes of {table_name} ({primary_id_column}) between {before_first_primary_id!r} and {checkpoint['submitted_primary_id']!r}")
+                build_common_delete_partial_writes(table_name, batch_to_aarecord_ids, primary_id_column, additional_where, additional_select_AGGREGATES, before_first_primary_id, checkpoint['submitted_primary_id'])
+            print(f"[{checkpoint_source}] Resuming {table_name} ({primary_id_column}) after primary_id {before_first_primary_id!r} (total will be off)")
+
     with engine.connect() as connection:
         print(f"Processing from {table_name}")
         cursor = allthethings.utils.get_cursor_ping_conn(connection)
         cursor.execute(f'SELECT COUNT(*) AS count FROM {table_name} {"WHERE" if additional_where else ""} {additional_where} LIMIT 1', { "from": before_first_primary_id })
         total = list(cursor.fetchall())[0]['count']
         with tqdm.tqdm(total=total, bar_format='{l_bar}{bar}{r_bar} {eta}') as pbar:
-            with concurrent.futures.ProcessPoolExecutor(max_workers=THREADS, initializer=elastic_build_aarecords_job_init_pool) as executor:
+            # Set by a pool worker when its writer thread fails. Since writes lag behind the jobs, we check it again
+            # after the executor has shut down (which waits for the writer threads to drain).
+            writer_error_event = multiprocessing.Event()
+            # Job ids whose writes are done, see elastic_build_aarecords_writer_ack.
+            write_ack_queue = multiprocessing.Queue()
+            with concurrent.futures.ProcessPoolExecutor(max_workers=THREADS, initializer=elastic_build_aarecords_job_init_pool, initargs=(writer_error_event, write_ack_queue, elastic_build_aarecords_index_version)) as executor:
                 futures = set()
                 count_by_future = {}
+                rows_by_future = {}
+                # Exponentially weighted moving average of job seconds per row.
+                seconds_per_row = None
+                # Batches in order, each with the job ids that haven't been written yet.
+                pending_batches = collections.deque()
+                pending_batch_by_job_id = {}
+                committed_primary_id = before_first_primary_id
+                submitted_primary_id = before_first_primary_id
+                def process_write_acks(wait=False):
+                    nonlocal committed_primary_id
+                    while len(pending_batch_by_job_id) > 0:
+                        try:
+                            job_id = write_ack_queue.get(timeout=60) if wait else write_ack_queue.get_nowait()
+                        except queue.Empty:
+                            break
+                        pending_batch_by_job_id.pop(job_id)['job_ids'].remove(job_id)
+                    previous_committed_primary_id = committed_primary_id
+                    while len(pending_batches) > 0 and pending_batches[0]['submitted'] and len(pending_batches[0]['job_ids']) == 0:
+                        committed_primary_id = pending_batches.popleft()['last_primary_id']
+                    if (checkpoint_source is not None) and committed_primary_id != previous_committed_primary_id:
+                        build_common_checkpoint_save(connection, checkpoint_source, table_name, primary_id_column, committed_primary_id, submitted_primary_id)
+
                 def process_future():
+                    nonlocal seconds_per_row
                     # print(f"Futures waiting: {len(futures)}")
                     (done, not_done) = concurrent.futures.wait(futures, return_when=concurrent.futures.FIRST_COMPLETED)
                     # print(f"Done!")
@@ -836,41 +1875,77 @@ def build_common(table_name, batch_to_aarecord_ids, primary_id_column='primary_i
                         futures.remove(future_done)
                         pbar.update(count_by_future[future_done])
                         del count_by_future[future_done]
+                        rows = rows_by_future.pop(future_done)
                         err = future_done.exception()
                         if err:
                             print(f"ERROR IN FUTURE RESOLUTION!!!!! {repr(err)}\n\n/////\n\n{traceback.format_exc()}")
                             raise err
-                        result = future_done.result()
+                        (result, seconds) = future_done.result()
                         if result:
                             print("Error detected; exiting")
                             os._exit(1)
+                        if seconds_per_row is None:
+                            seconds_per_row = seconds / rows
+                        else:
+                            seconds_per_row = 0.9 * seconds_per_row + 0.1 * (seconds / rows)
+                    process_write_acks()
 
                 current_primary_id = before_first_primary_id
+                job_id = 0
                 while True:
                     cursor = allthethings.utils.get_cursor_ping_conn(connection)
                     cursor.execute(f'SELECT {primary_id_column} AS primary_id, COUNT(*) AS count {additional_select_AGGREGATES} FROM {table_name} WHERE {additional_where} {"AND" if additional_where else ""} {primary_id_column} > %(from)s GROUP BY {primary_id_column} ORDER BY {primary_id_column} LIMIT %(limit)s', { "from": current_primary_id, "limit": BATCH_SIZE })
                     batch = list(cursor.fetchall())
                     if len(batch) == 0:
                         break
-                    print(f"Processing (ahead!) with {THREADS=} {len(batch)=} aarecords from {table_name} ( starting primary_id: {batch[0]['primary_id']} , ending primary_id: {batch[-1]['primary_id']} )...")
-                    for subbatch in more_itertools.chunked(batch, CHUNK_SIZE):
-                        future = executor.submit(elastic_build_aarecords_job, batch_to_aarecord_ids(subbatch))
+                    # Saved before any job of this batch can write, so a resume knows which rows to clean up.
+                    submitted_primary_id = batch[-1]['primary_id']
+                    if checkpoint_source is not None:
+                        build_common_checkpoint_save(connection, checkpoint_source, table_name, primary_id_column, committed_primary_id, submitted_primary_id)
+                    pending_batch = { 'last_primary_id': batch[-1]['primary_id'], 'job_ids': set(), 'submitted': False }
+                    pending_batches.append(pending_batch)
+                    chunk_size = build_common_chunk_size(seconds_per_row, len(batch))
+                    print(f"Processing (ahead!) with {THREADS=} {len(batch)=} {chunk_size=} aarecords from {table_name} ( starting primary_id: {batch[0]['primary_id']} , ending primary_id: {batch[-1]['primary_id']} )...")
+                    batch_index = 0
+                    while batch_index < len(batch):
+                        chunk_size = build_common_chunk_size(seconds_per_row, len(batch) - batch_index)
+                        pbar.set_postfix_str(f"{chunk_size=}", refresh=False)
+                        subbatch = batch[batch_index:batch_index+chunk_size]
+                        batch_index += chunk_size
+                        job_id += 1
+                        pending_batch['job_ids'].add(job_id)
+                        pending_batch_by_job_id[job_id] = pending_batch
+                        future = executor.submit(elastic_build_aarecords_job_timed, batch_to_aarecord_ids(subbatch), job_id)
                         count_by_future[future] = sum([row['count'] for row in subbatch])
+                        rows_by_future[future] = len(subbatch)
                         futures.add(future)
                         if len(futures) > THREADS*2:
                             process_future()
+                    pending_batch['submitted'] = True
                     current_primary_id = batch[-1]['primary_id']
                 while len(futures) > 0:
                     process_future()
+            if writer_error_event.is_set():
+                print("Error detected in writer thread; exiting")
+                os._exit(1)
+            # The executor has shut down, so all the acks have been sent.
+            process_write_acks(wait=True)
+            if len(pending_batch_by_job_id) > 0:
+                raise Exception(f"Missing write acks for {len(pending_batch_by_job_id)} jobs in {table_name}")
+            if checkpoint_source is not None:
+                build_common_checkpoint_save(connection, checkpoint_source, table_name, primary_id_column, committed_primary_id, submitted_primary_id, done=True)
         print(f"Done with {table_name}!")
 
 #################################################################################################
 # ./run flask cli elastic_build_aarecords_ia
 @cli.cli.command('elastic_build_aarecords_ia')
-def elastic_build_aarecords_ia():
-    elastic_build_aarecords_ia_internal()
-def elastic_build_aarecords_ia_internal():
-    new_tables_internal('aarecords_codes_ia') # WARNING! Update the upload excludes, and dump_mariadb_omit_tables.txt.
+@click.option('--resume', is_flag=True, help='Continue an interrupted build from its last checkpoint.')
+def elastic_build_aarecords_ia(resume):
+    elastic_build_aarecords_ia_internal(resume=resume)
+def elastic_build_aarecords_ia_internal(resume=False):
+    resume = build_common_checkpoints_start('ia', resume)
+    if not resume:
+        new_tables_internal('aarecords_codes_ia') # WARNING! Update the upload excludes, and dump_mariadb_omit_tables.txt.
 
     with engine.connect() as connection:
         print("Processing from aa_ia_2023_06_metadata+annas_archive_meta__aacid__ia2_records")
@@ -887,7 +1962,7 @@ def elastic_build_aarecords_ia_internal():
         cursor.execute('DROP TABLE IF EXISTS temp_ia_ids')
         cursor.execute('CREATE TABLE temp_ia_ids (ia_id VARCHAR(250) NOT NULL, PRIMARY KEY(ia_id)) ENGINE=MyISAM DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_bin SELECT ia_id FROM (SELECT ia_id, libgen_md5 FROM aa_ia_2023_06_metadata UNION SELECT primary_id AS ia_id, NULL AS libgen_md5 FROM annas_archive_meta__aacid__ia2_records) combined LEFT JOIN aa_ia_2023_06_files USING (ia_id) LEFT JOIN annas_archive_meta__aacid__ia2_acsmpdf_files ON (combined.ia_id = annas_archive_meta__aacid__ia2_acsmpdf_files.primary_id) WHERE aa_ia_2023_06_files.md5 IS NULL AND annas_archive_meta__aacid__ia2_acsmpdf_files.md5 IS NULL AND combined.libgen_md5 IS NULL')
 
-    build_common('temp_ia_ids', lambda batch: [f"ia:{row['primary_id']}" for row in batch], primary_id_column='ia_id')
+    build_common('temp_ia_ids', lambda batch: [f"ia:{row['primary_id']}" for row in batch], primary_id_column='ia_id', checkpoint_source='ia', resume=resume)
 
     with engine.connect() as connection:
         print("Removing table temp_ia_ids")
@@ -899,216 +1974,563 @@ def elastic_build_aarecords_ia_internal():
 #################################################################################################
 # ./run flask cli elastic_build_aarecords_isbndb
 @cli.cli.command('elastic_build_aarecords_isbndb')
-def elastic_build_aarecords_isbndb():
-    elastic_build_aarecords_isbndb_internal()
-def elastic_build_aarecords_isbndb_internal():
-    new_tables_internal('aarecords_codes_isbndb', 'aarecords_codes_isbndb_for_lookup') # WARNING! Update the upload excludes, and dump_mariadb_omit_tables.txt.
-    build_common('isbndb_isbns', lambda batch: [f"isbndb:{row['primary_id']}" for row in batch], primary_id_column='isbn13')
-    build_common('isbndb_isbns', lambda batch: [f"isbndb:{isbnlib.ean13(row['primary_id'])}" for row in batch], primary_id_column='isbn10')
+@click.option('--resume', is_flag=True, help='Continue an interrupted build from its last checkpoint.')
+def elastic_build_aarecords_isbndb(resume):
+    elastic_build_aarecords_isbndb_internal(resume=resume)
+def elastic_build_aarecords_isbndb_internal(resume=False):
+    resume = build_common_checkpoints_start('isbndb', resume)
+    if not resume:
+        new_tables_internal('aarecords_codes_isbndb', 'aarecords_codes_isbndb_for_lookup') # WARNING! Update the upload excludes, and dump_mariadb_omit_tables.txt.
+    build_common('isbndb_isbns', lambda batch: [f"isbndb:{row['primary_id']}" for row in batch], primary_id_column='isbn13', checkpoint_source='isbndb', resume=resume)
+    build_common('isbndb_isbns', lambda batch: [f"isbndb:{isbnlib.ean13(row['primary_id'])}" for row in batch], primary_id_column='isbn10', checkpoint_source='isbndb', resume=resume)
 
 #################################################################################################
 # ./run flask cli elastic_build_aarecords_ol
 @cli.cli.command('elastic_build_aarecords_ol')
-def elastic_build_aarecords_ol():
-    elastic_build_aarecords_ol_internal()
-def elastic_build_aarecords_ol_internal():
-    new_tables_internal('aarecords_codes_ol', 'aarecords_codes_ol_for_lookup') # WARNING! Update the upload excludes, and dump_mariadb_omit_tables.txt.
+@click.option('--resume', is_flag=True, help='Continue an interrupted build from its last checkpoint.')
+def elastic_build_aarecords_ol(resume):
+    elastic_build_aarecords_ol_internal(resume=resume)
+def elastic_build_aarecords_ol_internal(resume=False):
+    resume = build_common_checkpoints_start('ol', resume)
+    if not resume:
+        new_tables_internal('aarecords_codes_ol', 'aarecords_codes_ol_for_lookup') # WARNING! Update the upload excludes, and dump_mariadb_omit_tables.txt.
     build_common('ol_base', lambda batch: [f"ol:{row['primary_id'].replace('/books/','')}" for row in batch],
-        primary_id_column='ol_key', additional_where='ol_key LIKE "/books/OL%%" AND ol_key LIKE "%%M"')
+        primary_id_column='ol_key', additional_where='ol_key LIKE "/books/OL%%" AND ol_key LIKE "%%M"', checkpoint_source='ol', resume=resume)
 
 #################################################################################################
 # ./run flask cli elastic_build_aarecords_duxiu
 @cli.cli.command('elastic_build_aarecords_duxiu')
-def elastic_build_aarecords_duxiu():
-    elastic_build_aarecords_duxiu_internal()
-def elastic_build_aarecords_duxiu_internal():
-    new_tables_internal('aarecords_codes_duxiu') # WARNING! Update the upload excludes, and dump_mariadb_omit_tables.txt.
-    def duxiu_batch_to_aarecord_ids(batch):
-        with engine.connect() as connection:
-            cursor = allthethings.utils.get_cursor_ping_conn(connection)
-            unrolled_rows = [{"primary_id": row['primary_id'], "byte_offset": int(byte_offset), "byte_length": int(byte_length)} for row in batch for byte_offset, byte_length in zip(row['byte_offsets'].split(','), row['byte_lengths'].split(',')) ]
-            lines_bytes = allthethings.utils.get_lines_from_aac_file(cursor, 'duxiu_records', [(row['byte_offset'], row['byte_length']) for row in unrolled_rows])
-            ids = []
-            for item_index, item in enumerate(unrolled_rows):
-                line_bytes = lines_bytes[item_index]
-                if item['primary_id'] == 'duxiu_ssid_-1':
-                    continue
-                if item['primary_id'].startswith('cadal_ssno_hj'):
-                    # These are collections.
-                    continue
-                # TODO: pull these things out into the table?
-                if b'dx_20240122__books' in line_bytes:
-                    # Skip, because 512w_final_csv is the authority on these records, and has a bunch of records from dx_20240122__books deleted.
-                    continue
-                if (b'dx_toc_db__dx_toc' in line_bytes) and (b'"toc_xml":null' in line_bytes):
-                    # Skip empty TOC records.
-                    continue
-                if b'dx_20240122__remote_files' in line_bytes:
-                    # Skip for now because a lot of the DuXiu SSIDs are actual CADAL SSNOs, and stand-alone records from
-                    # remote_files are not useful anyway since they lack metadata like title, author, etc.
-                    continue
-                ids.append(item['primary_id'].replace('duxiu_ssid_','duxiu_ssid:').replace('cadal_ssno_','cadal_ssno:'))
-            return list(set(ids))
-    build_common('annas_archive_meta__aacid__duxiu_records', duxiu_batch_to_aarecord_ids,
+@click.option('--resume', is_flag=True, help='Continue an interrupted build from its last checkpoint.')
+def elastic_build_aarecords_duxiu(resume):
+    elastic_build_aarecords_duxiu_internal(resume=resume)
+def elastic_build_aarecords_duxiu_internal(resume=False):
+    resume = build_common_checkpoints_start('duxiu', resume)
+    if not resume:
+        new_tables_internal('aarecords_codes_duxiu') # WARNING! Update the upload excludes, and dump_mariadb_omit_tables.txt.
+    build_common('annas_archive_meta__aacid__duxiu_records', elastic_build_aarecords_duxiu_batch_to_aarecord_ids,
         additional_where='(primary_id LIKE "duxiu_ssid_%%" OR primary_id LIKE "cadal_ssno_%%")',
-        additional_select_AGGREGATES=', GROUP_CONCAT(byte_offset) AS byte_offsets, GROUP_CONCAT(byte_length) AS byte_lengths')
+        additional_select_AGGREGATES=', GROUP_CONCAT(byte_offset) AS byte_offsets, GROUP_CONCAT(byte_length) AS byte_lengths', checkpoint_source='duxiu', resume=resume)
+
+def elastic_build_aarecords_duxiu_batch_to_aarecord_ids(batch):
+    with engine.connect() as connection:
+        cursor = allthethings.utils.get_cursor_ping_conn(connection)
+        unrolled_rows = [{"primary_id": row['primary_id'], "byte_offset": int(byte_offset), "byte_length": int(byte_length)} for row in batch for byte_offset, byte_length in zip(row['byte_offsets'].split(','), row['byte_lengths'].split(',')) ]
+        lines_bytes = allthethings.utils.get_lines_from_aac_file(cursor, 'duxiu_records', [(row['byte_offset'], row['byte_length']) for row in unrolled_rows])
+        ids = []
+        for item_index, item in enumerate(unrolled_rows):
+            line_bytes = lines_bytes[item_index]
+            if item['primary_id'] == 'duxiu_ssid_-1':
+                continue
+            if item['primary_id'].startswith('cadal_ssno_hj'):
+                # These are collections.
+                continue
+            # TODO: pull these things out into the table?
+            if b'dx_20240122__books' in line_bytes:
+                # Skip, because 512w_final_csv is the authority on these records, and has a bunch of records from dx_20240122__books deleted.
+                continue
+            if (b'dx_toc_db__dx_toc' in line_bytes) and (b'"toc_xml":null' in line_bytes):
+                # Skip empty TOC records.
+                continue
+            if b'dx_20240122__remote_files' in line_bytes:
+                # Skip for now because a lot of the DuXiu SSIDs are actual CADAL SSNOs, and stand-alone records from
+                # remote_files are not useful anyway since they lack metadata like title, author, etc.
+                continue
+            ids.append(item['primary_id'].replace('duxiu_ssid_','duxiu_ssid:').replace('cadal_ssno_','cadal_ssno:'))
+        return list(set(ids))
 
 #################################################################################################
 # ./run flask cli elastic_build_aarecords_oclc
 @cli.cli.command('elastic_build_aarecords_oclc')
-def elastic_build_aarecords_oclc():
-    elastic_build_aarecords_oclc_internal()
-def elastic_build_aarecords_oclc_internal():
-    new_tables_internal('aarecords_codes_oclc', 'aarecords_codes_oclc_for_lookup') # WARNING! Update the upload excludes, and dump_mariadb_omit_tables.txt.
-    build_common('annas_archive_meta__aacid__worldcat', lambda batch: [f"oclc:{row['primary_id']}" for row in batch])
+@click.option('--resume', is_flag=True, help='Continue an interrupted build from its last checkpoint.')
+def elastic_build_aarecords_oclc(resume):
+    elastic_build_aarecords_oclc_internal(resume=resume)
+def elastic_build_aarecords_oclc_internal(resume=False):
+    resume = build_common_checkpoints_start('oclc', resume)
+    if not resume:
+        new_tables_internal('aarecords_codes_oclc', 'aarecords_codes_oclc_for_lookup') # WARNING! Update the upload excludes, and dump_mariadb_omit_tables.txt.
+    build_common('annas_archive_meta__aacid__worldcat', lambda batch: [f"oclc:{row['primary_id']}" for row in batch], checkpoint_source='oclc', resume=resume)
 
 #################################################################################################
 # ./run flask cli elastic_build_aarecords_edsebk
 @cli.cli.command('elastic_build_aarecords_edsebk')
-def elastic_build_aarecords_edsebk():
-    elastic_build_aarecords_edsebk_internal()
-def elastic_build_aarecords_edsebk_internal():
-    new_tables_internal('aarecords_codes_edsebk', 'aarecords_codes_edsebk_for_lookup') # WARNING! Update the upload excludes, and dump_mariadb_omit_tables.txt.
-    build_common('annas_archive_meta__aacid__ebscohost_records', lambda batch: [f"edsebk:{row['primary_id']}" for row in batch])
+@click.option('--resume', is_flag=True, help='Continue an interrupted build from its last checkpoint.')
+def elastic_build_aarecords_edsebk(resume):
+    elastic_build_aarecords_edsebk_internal(resume=resume)
+def elastic_build_aarecords_edsebk_internal(resume=False):
+    resume = build_common_checkpoints_start('edsebk', resume)
+    if not resume:
+        new_tables_internal('aarecords_codes_edsebk', 'aarecords_codes_edsebk_for_lookup') # WARNING! Update the upload excludes, and dump_mariadb_omit_tables.txt.
+    build_common('annas_archive_meta__aacid__ebscohost_records', lambda batch: [f"edsebk:{row['primary_id']}" for row in batch], checkpoint_source='edsebk', resume=resume)
 
 #################################################################################################
 # ./run flask cli elastic_build_aarecords_cerlalc
 @cli.cli.command('elastic_build_aarecords_cerlalc')
-def elastic_build_aarecords_cerlalc():
-    elastic_build_aarecords_cerlalc_internal()
-def elastic_build_aarecords_cerlalc_internal():
-    new_tables_internal('aarecords_codes_cerlalc', 'aarecords_codes_cerlalc_for_lookup') # WARNING! Update the upload excludes, and dump_mariadb_omit_tables.txt.
-    build_common('annas_archive_meta__aacid__cerlalc_records', lambda batch: [f"cerlalc:{row['primary_id']}" for row in batch])
+@click.option('--resume', is_flag=True, help='Continue an interrupted build from its last checkpoint.')
+def elastic_build_aarecords_cerlalc(resume):
+    elastic_build_aarecords_cerlalc_internal(resume=resume)
+def elastic_build_aarecords_cerlalc_internal(resume=False):
+    resume = build_common_checkpoints_start('cerlalc', resume)
+    if not resume:
+        new_tables_internal('aarecords_codes_cerlalc', 'aarecords_codes_cerlalc_for_lookup') # WARNING! Update the upload excludes, and dump_mariadb_omit_tables.txt.
+    build_common('annas_archive_meta__aacid__cerlalc_records', lambda batch: [f"cerlalc:{row['primary_id']}" for row in batch], checkpoint_source='cerlalc', resume=resume)
 
 #################################################################################################
 # ./run flask cli elastic_build_aarecords_czech_oo42hcks
 @cli.cli.command('elastic_build_aarecords_czech_oo42hcks')
-def elastic_build_aarecords_czech_oo42hcks():
-    elastic_build_aarecords_czech_oo42hcks_internal()
-def elastic_build_aarecords_czech_oo42hcks_internal():
-    new_tables_internal('aarecords_codes_czech_oo42hcks', 'aarecords_codes_czech_oo42hcks_for_lookup') # WARNING! Update the upload excludes, and dump_mariadb_omit_tables.txt.
-    build_common('annas_archive_meta__aacid__czech_oo42hcks_records', lambda batch: [f"czech_oo42hcks:{row['primary_id']}" for row in batch])
+@click.option('--resume', is_flag=True, help='Continue an interrupted build from its last checkpoint.')
+def elastic_build_aarecords_czech_oo42hcks(resume):
+    elastic_build_aarecords_czech_oo42hcks_internal(resume=resume)
+def elastic_build_aarecords_czech_oo42hcks_internal(resume=False):
+    resume = build_common_checkpoints_start('czech_oo42hcks', resume)
+    if not resume:
+        new_tables_internal('aarecords_codes_czech_oo42hcks', 'aarecords_codes_czech_oo42hcks_for_lookup') # WARNING! Update the upload excludes, and dump_mariadb_omit_tables.txt.
+    build_common('annas_archive_meta__aacid__czech_oo42hcks_records', lambda batch: [f"czech_oo42hcks:{row['primary_id']}" for row in batch], checkpoint_source='czech_oo42hcks', resume=resume)
 
 #################################################################################################
 # ./run flask cli elastic_build_aarecords_gbooks
 @cli.cli.command('elastic_build_aarecords_gbooks')
-def elastic_build_aarecords_gbooks():
-    elastic_build_aarecords_gbooks_internal()
-def elastic_build_aarecords_gbooks_internal():
-    new_tables_internal('aarecords_codes_gbooks', 'aarecords_codes_gbooks_for_lookup') # WARNING! Update the upload excludes, and dump_mariadb_omit_tables.txt.
-    build_common('annas_archive_meta__aacid__gbooks_records', lambda batch: [f"gbooks:{row['primary_id']}" for row in batch])
+@click.option('--resume', is_flag=True, help='Continue an interrupted build from its last checkpoint.')
+def elastic_build_aarecords_gbooks(resume):
+    elastic_build_aarecords_gbooks_internal(resume=resume)
+def elastic_build_aarecords_gbooks_internal(resume=False):
+    resume = build_common_checkpoints_start('gbooks', resume)
+    if not resume:
+        new_tables_internal('aarecords_codes_gbooks', 'aarecords_codes_gbooks_for_lookup') # WARNING! Update the upload excludes, and dump_mariadb_omit_tables.txt.
+    build_common('annas_archive_meta__aacid__gbooks_records', lambda batch: [f"gbooks:{row['primary_id']}" for row in batch], checkpoint_source='gbooks', resume=resume)
 
 #################################################################################################
 # ./run flask cli elastic_build_aarecords_goodreads
 @cli.cli.command('elastic_build_aarecords_goodreads')
-def elastic_build_aarecords_goodreads():
-    elastic_build_aarecords_goodreads_internal()
-def elastic_build_aarecords_goodreads_internal():
-    new_tables_internal('aarecords_codes_goodreads', 'aarecords_codes_goodreads_for_lookup') # WARNING! Update the upload excludes, and dump_mariadb_omit_tables.txt.
-    build_common('annas_archive_meta__aacid__goodreads_records', lambda batch: [f"goodreads:{row['primary_id']}" for row in batch])
+@click.option('--resume', is_flag=True, help='Continue an interrupted build from its last checkpoint.')
+def elastic_build_aarecords_goodreads(resume):
+    elastic_build_aarecords_goodreads_internal(resume=resume)
+def elastic_build_aarecords_goodreads_internal(resume=False):
+    resume = build_common_checkpoints_start('goodreads', resume)
+    if not resume:
+        new_tables_internal('aarecords_codes_goodreads', 'aarecords_codes_goodreads_for_lookup') # WARNING! Update the upload excludes, and dump_mariadb_omit_tables.txt.
+    build_common('annas_archive_meta__aacid__goodreads_records', lambda batch: [f"goodreads:{row['primary_id']}" for row in batch], checkpoint_source='goodreads', resume=resume)
 
 #################################################################################################
 # ./run flask cli elastic_build_aarecords_isbngrp
 @cli.cli.command('elastic_build_aarecords_isbngrp')
-def elastic_build_aarecords_isbngrp():
-    elastic_build_aarecords_isbngrp_internal()
-def elastic_build_aarecords_isbngrp_internal():
-    new_tables_internal('aarecords_codes_isbngrp', 'aarecords_codes_isbngrp_for_lookup') # WARNING! Update the upload excludes, and dump_mariadb_omit_tables.txt.
-    build_common('annas_archive_meta__aacid__isbngrp_records', lambda batch: [f"isbngrp:{row['primary_id']}" for row in batch])
+@click.option('--resume', is_flag=True, help='Continue an interrupted build from its last checkpoint.')
+def elastic_build_aarecords_isbngrp(resume):
+    elastic_build_aarecords_isbngrp_internal(resume=resume)
+def elastic_build_aarecords_isbngrp_internal(resume=False):
+    resume = build_common_checkpoints_start('isbngrp', resume)
+    if not resume:
+        new_tables_internal('aarecords_codes_isbngrp', 'aarecords_codes_isbngrp_for_lookup') # WARNING! Update the upload excludes, and dump_mariadb_omit_tables.txt.
+    build_common('annas_archive_meta__aacid__isbngrp_records', lambda batch: [f"isbngrp:{row['primary_id']}" for row in batch], checkpoint_source='isbngrp', resume=resume)
 
 #################################################################################################
 # ./run flask cli elastic_build_aarecords_libby
 @cli.cli.command('elastic_build_aarecords_libby')
-def elastic_build_aarecords_libby():
-    elastic_build_aarecords_libby_internal()
-def elastic_build_aarecords_libby_internal():
-    new_tables_internal('aarecords_codes_libby', 'aarecords_codes_libby_for_lookup') # WARNING! Update the upload excludes, and dump_mariadb_omit_tables.txt.
-    build_common('annas_archive_meta__aacid__libby_records', lambda batch: [f"libby:{row['primary_id']}" for row in batch])
+@click.option('--resume', is_flag=True, help='Continue an interrupted build from its last checkpoint.')
+def elastic_build_aarecords_libby(resume):
+    elastic_build_aarecords_libby_internal(resume=resume)
+def elastic_build_aarecords_libby_internal(resume=False):
+    resume = build_common_checkpoints_start('libby', resume)
+    if not resume:
+        new_tables_internal('aarecords_codes_libby', 'aarecords_codes_libby_for_lookup') # WARNING! Update the upload excludes, and dump_mariadb_omit_tables.txt.
+    build_common('annas_archive_meta__aacid__libby_records', lambda batch: [f"libby:{row['primary_id']}" for row in batch], checkpoint_source='libby', resume=resume)
 
 #################################################################################################
 # ./run flask cli elastic_build_aarecords_rgb
 @cli.cli.command('elastic_build_aarecords_rgb')
-def elastic_build_aarecords_rgb():
-    elastic_build_aarecords_rgb_internal()
-def elastic_build_aarecords_rgb_internal():
-    new_tables_internal('aarecords_codes_rgb', 'aarecords_codes_rgb_for_lookup') # WARNING! Update the upload excludes, and dump_mariadb_omit_tables.txt.
-    build_common('annas_archive_meta__aacid__rgb_records', lambda batch: [f"rgb:{row['primary_id']}" for row in batch])
+@click.option('--resume', is_flag=True, help='Continue an interrupted build from its last checkpoint.')
+def elastic_build_aarecords_rgb(resume):
+    elastic_build_aarecords_rgb_internal(resume=resume)
+def elastic_build_aarecords_rgb_internal(resume=False):
+    resume = build_common_checkpoints_start('rgb', resume)
+    if not resume:
+        new_tables_internal('aarecords_codes_rgb', 'aarecords_codes_rgb_for_lookup') # WARNING! Update the upload excludes, and dump_mariadb_omit_tables.txt.
+    build_common('annas_archive_meta__aacid__rgb_records', lambda batch: [f"rgb:{row['primary_id']}" for row in batch], checkpoint_source='rgb', resume=resume)
 
 #################################################################################################
 # ./run flask cli elastic_build_aarecords_trantor
 @cli.cli.command('elastic_build_aarecords_trantor')
-def elastic_build_aarecords_trantor():
-    elastic_build_aarecords_trantor_internal()
-def elastic_build_aarecords_trantor_internal():
-    new_tables_internal('aarecords_codes_trantor', 'aarecords_codes_trantor_for_lookup') # WARNING! Update the upload excludes, and dump_mariadb_omit_tables.txt.
-    build_common('annas_archive_meta__aacid__trantor_records', lambda batch: [f"trantor:{row['primary_id']}" for row in batch])
+@click.option('--resume', is_flag=True, help='Continue an interrupted build from its last checkpoint.')
+def elastic_build_aarecords_trantor(resume):
+    elastic_build_aarecords_trantor_internal(resume=resume)
+def elastic_build_aarecords_trantor_internal(resume=False):
+    resume = build_common_checkpoints_start('trantor', resume)
+    if not resume:
+        new_tables_internal('aarecords_codes_trantor', 'aarecords_codes_trantor_for_lookup') # WARNING! Update the upload excludes, and dump_mariadb_omit_tables.txt.
+    build_common('annas_archive_meta__aacid__trantor_records', lambda batch: [f"trantor:{row['primary_id']}" for row in batch], checkpoint_source='trantor', resume=resume)
 
 
 #################################################################################################
 # ./run flask cli elastic_build_aarecords_magzdb
 @cli.cli.command('elastic_build_aarecords_magzdb')
-def elastic_build_aarecords_magzdb():
-    elastic_build_aarecords_magzdb_internal()
-def elastic_build_aarecords_magzdb_internal():
-    new_tables_internal('aarecords_codes_magzdb') # WARNING! Update the upload excludes, and dump_mariadb_omit_tables.txt.
+@click.option('--resume', is_flag=True, help='Continue an interrupted build from its last checkpoint.')
+def elastic_build_aarecords_magzdb(resume):
+    elastic_build_aarecords_magzdb_internal(resume=resume)
+def elastic_build_aarecords_magzdb_internal(resume=False):
+    resume = build_common_checkpoints_start('magzdb', resume)
+    if not resume:
+        new_tables_internal('aarecords_codes_magzdb') # WARNING! Update the upload excludes, and dump_mariadb_omit_tables.txt.
     build_common('annas_archive_meta__aacid__magzdb_records', lambda batch: [f"magzdb:{row['primary_id'][len('record_'):]}" for row in batch],
-        additional_where='primary_id LIKE "record%%"')
+        additional_where='primary_id LIKE "record%%"', checkpoint_source='magzdb', resume=resume)
 
 #################################################################################################
 # ./run flask cli elastic_build_aarecords_nexusstc
 @cli.cli.command('elastic_build_aarecords_nexusstc')
-def elastic_build_aarecords_nexusstc():
-    elastic_build_aarecords_nexusstc_internal()
-def elastic_build_aarecords_nexusstc_internal():
-    new_tables_internal('aarecords_codes_nexusstc') # WARNING! Update the upload excludes, and dump_mariadb_omit_tables.txt.
-    with Session(engine) as session:
-        session.connection().connection.ping(reconnect=True)
-        cursor = session.connection().connection.cursor(pymysql.cursors.DictCursor)
-        cursor.execute('DROP TABLE IF EXISTS nexusstc_cid_only')
-        cursor.execute('CREATE TABLE nexusstc_cid_only (nexusstc_id VARCHAR(200) NOT NULL, PRIMARY KEY (nexusstc_id)) ENGINE=MyISAM DEFAULT CHARSET=ascii COLLATE=ascii_bin ROW_FORMAT=FIXED')
-    build_common('annas_archive_meta__aacid__nexusstc_records', lambda batch: [f"nexusstc:{row['primary_id']}" for row in batch])
+@click.option('--resume', is_flag=True, help='Continue an interrupted build from its last checkpoint.')
+def elastic_build_aarecords_nexusstc(resume):
+    elastic_build_aarecords_nexusstc_internal(resume=resume)
+def elastic_build_aarecords_nexusstc_internal(resume=False):
+    resume = build_common_checkpoints_start('nexusstc', resume)
+    if not resume:
+        new_tables_internal('aarecords_codes_nexusstc') # WARNING! Update the upload excludes, and dump_mariadb_omit_tables.txt.
+        with Session(engine) as session:
+            session.connection().connection.ping(reconnect=True)
+            cursor = session.connection().connection.cursor(pymysql.cursors.DictCursor)
+            cursor.execute('DROP TABLE IF EXISTS nexusstc_cid_only')
+            cursor.execute('CREATE TABLE nexusstc_cid_only (nexusstc_id VARCHAR(200) NOT NULL, PRIMARY KEY (nexusstc_id)) ENGINE=MyISAM DEFAULT CHARSET=ascii COLLATE=ascii_bin ROW_FORMAT=FIXED')
+    build_common('annas_archive_meta__aacid__nexusstc_records', lambda batch: [f"nexusstc:{row['primary_id']}" for row in batch], checkpoint_source='nexusstc', resume=resume)
 
 #################################################################################################
 # ./run flask cli elastic_build_aarecords_main
 @cli.cli.command('elastic_build_aarecords_main')
-def elastic_build_aarecords_main():
-    elastic_build_aarecords_main_internal()
-def elastic_build_aarecords_main_internal():
-    new_tables_internal('aarecords_codes_main') # WARNING! Update the upload excludes, and dump_mariadb_omit_tables.txt.
+@click.option('--resume', is_flag=True, help='Continue an interrupted build from its last checkpoint.')
+def elastic_build_aarecords_main(resume):
+    elastic_build_aarecords_main_internal(resume=resume)
+def elastic_build_aarecords_main_internal(resume=False):
+    resume = build_common_checkpoints_start('main', resume)
+    if not resume:
+        new_tables_internal('aarecords_codes_main') # WARNING! Update the upload excludes, and dump_mariadb_omit_tables.txt.
+
+        # In a blue-green build, the shadow indices have just been created.
+        if elastic_build_aarecords_index_version is None:
+            print("Deleting main ES indices")
+            for index_name, es_handle in allthethings.utils.SEARCH_INDEX_TO_ES_MAPPING.items():
+                if index_name in allthethings.utils.MAIN_SEARCH_INDEXES:
+                    es_handle.options(ignore_status=[400,404]).indices.delete(index=index_name) # Old
+                    for full_index_name in elastic_virtshard_concrete_indices(es_handle, index_name):
+                        es_handle.options(ignore_status=[400,404]).indices.delete(index=full_index_name)
+            if not SLOW_DATA_IMPORTS:
+                print("Sleeping 3 minutes (no point in making this less)")
+                time.sleep(60*3)
+            print("Creating main ES indices")
+            for index_name, es_handle in allthethings.utils.SEARCH_INDEX_TO_ES_MAPPING.items():
+                if index_name in allthethings.utils.MAIN_SEARCH_INDEXES:
+                    for full_index_name in allthethings.utils.all_virtshards_for_index(index_name):
+                        es_handle.indices.create(wait_for_active_shards=1,index=full_index_name, body=es_create_index_body)
 
-    print("Deleting main ES indices")
-    for index_name, es_handle in allthethings.utils.SEARCH_INDEX_TO_ES_MAPPING.items():
-        if index_name in allthethings.utils.MAIN_SEARCH_INDEXES:
-            es_handle.options(ignore_status=[400,404]).indices.delete(index=index_name) # Old
-            for virtshard in range(0, 100): # Out of abundance, delete up to a large number
-                es_handle.options(ignore_status=[400,404]).indices.delete(index=f'{index_name}__{virtshard}')
-    if not SLOW_DATA_IMPORTS:
-        print("Sleeping 3 minutes (no point in making this less)")
-        time.sleep(60*3)
-    print("Creating main ES indices")
-    for index_name, es_handle in allthethings.utils.SEARCH_INDEX_TO_ES_MAPPING.items():
-        if index_name in allthethings.utils.MAIN_SEARCH_INDEXES:
-            for full_index_name in allthethings.utils.all_virtshards_for_index(index_name):
-                es_handle.indices.create(wait_for_active_shards=1,index=full_index_name, body=es_create_index_body)
+        with engine.connect() as connection:
+            connection.connection.ping(reconnect=True)
+            cursor = connection.connection.cursor(pymysql.cursors.SSDictCursor)
+            cursor.execute('DROP TABLE IF EXISTS aarecords_all_md5')
+            cursor.execute('CREATE TABLE aarecords_all_md5 (md5 BINARY(16) NOT NULL, json_compressed LONGBLOB NOT NULL, PRIMARY KEY (md5)) ENGINE=MyISAM DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_bin')
+        aarecords_dois_seen_reset()
+
+    build_common('computed_all_md5s', lambda batch: [f"md5:{row['primary_id'].hex()}" for row in batch], primary_id_column='md5', checkpoint_source='main', resume=resume)
+    scihub_dois_checkpoint = build_common_checkpoint_load('main', 'scihub_dois', 'doi') if resume else None
+    if (scihub_dois_checkpoint is None) or (not scihub_dois_checkpoint['done']):
+        aarecords_dois_seen_build()
+    build_common('scihub_dois', lambda batch: [f"doi:{row['primary_id']}" for row in batch], primary_id_column='doi', checkpoint_source='main', resume=resume)
+    build_common('nexusstc_cid_only', lambda batch: [f"nexusstc_download:{row['primary_id']}" for row in batch], primary_id_column='nexusstc_id', checkpoint_source='main', resume=resume)
+
+    shutil.rmtree(AARECORDS_DOIS_SEEN_DIR, ignore_errors=True)
+
+    print("Done with main!")
 
+# The DOIs of "md5:" records, so that the scihub_dois step of elastic_build_aarecords_main can skip "doi:" records
+# for them. The writers of the computed_all_md5s step append the md5 digests of the DOIs to a part file per
+# process. aarecords_dois_seen_build then sorts and deduplicates them (per first byte, to limit memory) into
+# one file, which the workers of the scihub_dois step mmap and binary search, without any MariaDB round-trips.
+AARECORDS_DOIS_SEEN_DIR = os.path.join(AARECORDS_BUILD_TEMP_DIR or tempfile.gettempdir(), 'aarecords_md5_dois_seen')
+AARECORDS_DOIS_SEEN_PARTS_DIR = os.path.join(AARECORDS_DOIS_SEEN_DIR, 'parts')
+AARECORDS_DOIS_SEEN_PATH = os.path.join(AARECORDS_DOIS_SEEN_DIR, 'dois_seen.bin')
+AARECORDS_DOIS_SEEN_DIGEST_LENGTH = 16
+
+# Per pool worker, see aarecords_dois_seen_filter.
+elastic_build_aarecords_dois_seen = None
+
+def aarecords_dois_seen_reset():
+    shutil.rmtree(AARECORDS_DOIS_SEEN_DIR, ignore_errors=True)
+    os.makedirs(AARECORDS_DOIS_SEEN_PARTS_DIR)
+
+def aarecords_dois_seen_append(digests):
+    # Only collected during elastic_build_aarecords_main; e.g. delta builds of md5 records have no use for it.
+    if not os.path.isdir(AARECORDS_DOIS_SEEN_PARTS_DIR):
+        return
+    with open(os.path.join(AARECORDS_DOIS_SEEN_PARTS_DIR, f'{os.getpid()}.bin'), 'ab') as part_file:
+        # A process that got killed halfway through a write might have left a partial digest, in a file
+        # that a later process with the same pid appends to.
+        part_file_size = part_file.tell()
+        if part_file_size % AARECORDS_DOIS_SEEN_DIGEST_LENGTH != 0:
+            part_file.truncate(part_file_size - (part_file_size % AARECORDS_DOIS_SEEN_DIGEST_LENGTH))
+        part_file.write(b''.join(digests))
+
+def aarecords_dois_seen_build():
+    digest_length = AARECORDS_DOIS_SEEN_DIGEST_LENGTH
+    if not os.path.isdir(AARECORDS_DOIS_SEEN_PARTS_DIR):
+        if os.path.exists(AARECORDS_DOIS_SEEN_PATH):
+            print(f"Using existing {AARECORDS_DOIS_SEEN_PATH}")
+            return
+        raise Exception(f"No {AARECORDS_DOIS_SEEN_PARTS_DIR} to build the DOI set from; run elastic_build_aarecords_main without --resume")
+    part_paths = sorted(glob.glob(os.path.join(AARECORDS_DOIS_SEEN_PARTS_DIR, '*.bin')))
+    print(f"Building {AARECORDS_DOIS_SEEN_PATH} from {len(part_paths)} part files")
+    with tempfile.TemporaryDirectory(dir=AARECORDS_DOIS_SEEN_DIR) as buckets_dir:
+        with contextlib.ExitStack() as stack:
+            bucket_files = [stack.enter_context(open(os.path.join(buckets_dir, f'{bucket}.bin'), 'wb')) for bucket in range(256)]
+            for part_path in tqdm.tqdm(part_paths, bar_format='{l_bar}{bar}{r_bar} {eta}'):
+                with open(part_path, 'rb') as part_file:
+                    while True:
+                        chunk = part_file.read(digest_length * 1000000)
+                        # Ignore a partial digest at the end, see aarecords_dois_seen_append.
+                        chunk = chunk[0:len(chunk) - (len(chunk) % digest_length)]
+                        if len(chunk) == 0:
+                            break
+                        digests_by_bucket = collections.defaultdict(list)
+                        for offset in range(0, len(chunk), digest_length):
+                            digests_by_bucket[chunk[offset]].append(chunk[offset:offset+digest_length])
+                        for bucket, digests in digests_by_bucket.items():
+                            bucket_files[bucket].write(b''.join(digests))
+        total = 0
+        with open(f'{AARECORDS_DOIS_SEEN_PATH}.tmp', 'wb') as output_file:
+            for bucket in range(256):
+                with open(os.path.join(buckets_dir, f'{bucket}.bin'), 'rb') as bucket_file:
+                    bucket_data = bucket_file.read()
+                digests = sorted(set(bucket_data[offset:offset+digest_length] for offset in range(0, len(bucket_data), digest_length)))
+                output_file.write(b''.join(digests))
+                total += len(digests)
+        os.replace(f'{AARECORDS_DOIS_SEEN_PATH}.tmp', AARECORDS_DOIS_SEEN_PATH)
+    shutil.rmtree(AARECORDS_DOIS_SEEN_PARTS_DIR)
+    print(f"Built {AARECORDS_DOIS_SEEN_PATH} with {total} DOIs")
+
+# Returns the dois (bytes) that are in the DOI set. Exact up to md5 collisions, like the digests in
+# hashed_aarecord_id.
+def aarecords_dois_seen_filter(dois):
+    global elastic_build_aarecords_dois_seen
+    digest_length = AARECORDS_DOIS_SEEN_DIGEST_LENGTH
+    if elastic_build_aarecords_dois_seen is None:
+        if not os.path.exists(AARECORDS_DOIS_SEEN_PATH):
+            raise Exception(f"{AARECORDS_DOIS_SEEN_PATH} doesn't exist; it's built by elastic_build_aarecords_main")
+        with open(AARECORDS_DOIS_SEEN_PATH, 'rb') as dois_seen_file:
+            # mmap doesn't support empty files.
+            if os.fstat(dois_seen_file.fileno()).st_size == 0:
+                elastic_build_aarecords_dois_seen = b''
+            else:
+                elastic_build_aarecords_dois_seen = mmap.mmap(dois_seen_file.fileno(), 0, access=mmap.ACCESS_READ)
+    dois_seen = elastic_build_aarecords_dois_seen
+    dois_seen_count = len(dois_seen) // digest_length
+    def digest_at(index):
+        return dois_seen[index*digest_length:(index+1)*digest_length]
+
+    found_dois = set()
+    for doi in dois:
+        digest = hashlib.md5(doi).digest()
+        index = bisect.bisect_left(range(dois_seen_count), digest, key=digest_at)
+        if index < dois_seen_count and digest_at(index) == digest:
+            found_dois.add(doi)
+    return found_dois
+
+#################################################################################################
+# Rebuild only the aarecords affected by AAC rows that were indexed since the last build, and optionally
+# by a list of aarecord ids (e.g. of changed rows in the MySQL source tables, which get reimported as a
+# whole, so there is no way to tell which rows changed). The records are upserted into the existing ES
+# indices and codes tables.
+# ./run flask cli elastic_build_aarecords_delta
+#
+# New AAC rows are those with an aacid past the watermark of their collection in aarecords_delta_watermarks,
+# which is set at the end of elastic_build_aarecords_all and of every delta build. They map to their own
+# records (e.g. "oclc:" for worldcat), and to md5 records for their md5s. Then, in a second pass, md5
+# records that have any of the lookup codes of the records from the first pass (e.g. an isbn13 of a new
+# oclc record) are rebuilt as well, since they merge in metadata of those records.
+#
+# Not covered: "doi:" records, since they need the DOI set of a full main build, and
+# documents that would move to another index, which are left behind in the old one. Run
+# mysql_build_computed_all_md5s first for new md5s to be picked up, and mysql_build_aarecords_codes_numbers
+# afterwards to update the codes explorer.
+# ./run flask cli elastic_build_aarecords_delta --ids-file /temp-dir/changed_aarecord_ids.txt
+# ./run flask cli elastic_build_aarecords_delta --dry-run
+@cli.cli.command('elastic_build_aarecords_delta')
+@click.option('--ids-file', default=None, help='File with additional aarecord ids to rebuild, one per line.')
+@click.option('--dry-run', is_flag=True, help='Only print which aarecords would be rebuilt.')
+def elastic_build_aarecords_delta(ids_file, dry_run):
+    elastic_build_aarecords_delta_internal(ids_file=ids_file, dry_run=dry_run)
+
+# AAC collections that have their own aarecords, as (batch_to_aarecord_ids, additional_where, additional_select_AGGREGATES)
+# like in the build_common calls of their elastic_build_aarecords_* function.
+AAC_COLLECTION_TO_DELTA_SOURCE = {
+    'worldcat': (lambda batch: [f"oclc:{row['primary_id']}" for row in batch], '', ''),
+    'ebscohost_records': (lambda batch: [f"edsebk:{row['primary_id']}" for row in batch], '', ''),
+    'cerlalc_records': (lambda batch: [f"cerlalc:{row['primary_id']}" for row in batch], '', ''),
+    'czech_oo42hcks_records': (lambda batch: [f"czech_oo42hcks:{row['primary_id']}" for row in batch], '', ''),
+    'gbooks_records': (lambda batch: [f"gbooks:{row['primary_id']}" for row in batch], '', ''),
+    'goodreads_records': (lambda batch: [f"goodreads:{row['primary_id']}" for row in batch], '', ''),
+    'isbngrp_records': (lambda batch: [f"isbngrp:{row['primary_id']}" for row in batch], '', ''),
+    'libby_records': (lambda batch: [f"libby:{row['primary_id']}" for row in batch], '', ''),
+    'rgb_records': (lambda batch: [f"rgb:{row['primary_id']}" for row in batch], '', ''),
+    'trantor_records': (lambda batch: [f"trantor:{row['primary_id']}" for row in batch], '', ''),
+    'magzdb_records': (lambda batch: [f"magzdb:{row['primary_id'][len('record_'):]}" for row in batch], 'primary_id LIKE "record%%"', ''),
+    'nexusstc_records': (lambda batch: [f"nexusstc:{row['primary_id']}" for row in batch], '', ''),
+    'duxiu_records': (elastic_build_aarecords_duxiu_batch_to_aarecord_ids, '(primary_id LIKE "duxiu_ssid_%%" OR primary_id LIKE "cadal_ssno_%%")', ', GROUP_CONCAT(byte_offset) AS byte_offsets, GROUP_CONCAT(byte_length) AS byte_lengths'),
+    # Same as temp_ia_ids in elastic_build_aarecords_ia_internal: only IA records without files.
+    'ia2_records': (lambda batch: [f"ia:{row['primary_id']}" for row in batch], 'primary_id NOT IN (SELECT ia_id FROM aa_ia_2023_06_files) AND primary_id NOT IN (SELECT primary_id FROM annas_archive_meta__aacid__ia2_acsmpdf_files WHERE primary_id IS NOT NULL)', ''),
+}
+# AAC collections of which the primary_id is the md5 (see mysql_build_computed_all_md5s_internal).
+AAC_COLLECTIONS_WITH_MD5_PRIMARY_ID = ['duxiu_files', 'upload_files']
+# Need the DOI set of a full main build (see aarecords_dois_seen_build).
+AARECORDS_DELTA_UNSUPPORTED_PREFIXES = ['doi']
+
+def aarecords_delta_aac_snapshot():
     with engine.connect() as connection:
-        connection.connection.ping(reconnect=True)
-        cursor = connection.connection.cursor(pymysql.cursors.SSDictCursor)
-        cursor.execute('DROP TABLE IF EXISTS aarecords_all_md5')
-        cursor.execute('CREATE TABLE aarecords_all_md5 (md5 BINARY(16) NOT NULL, json_compressed LONGBLOB NOT NULL, PRIMARY KEY (md5)) ENGINE=MyISAM DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_bin')
-        cursor.execute('DROP TABLE IF EXISTS temp_md5_with_doi_seen')
-        cursor.execute('CREATE TABLE temp_md5_with_doi_seen (id BIGINT NOT NULL AUTO_INCREMENT, doi VARBINARY(1000), PRIMARY KEY (id), INDEX(doi)) ENGINE=MyISAM DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_bin')
+        cursor = allthethings.utils.get_cursor_ping_conn(connection)
+        cursor.execute('SHOW TABLES LIKE "annas_archive_meta_aac_filenames"')
+        if len(list(cursor.fetchall())) == 0:
+            return {}
+        cursor.execute('SELECT collection FROM annas_archive_meta_aac_filenames ORDER BY collection')
+        snapshot = {}
+        for collection in [row['collection'] for row in cursor.fetchall()]:
+            cursor.execute(f'SELECT MAX(aacid) AS max_aacid FROM annas_archive_meta__aacid__{collection}')
+            snapshot[collection] = list(cursor.fetchall())[0]['max_aacid']
+        return snapshot
+
+def aarecords_delta_watermarks_load():
+    with engine.connect() as connection:
+        cursor = allthethings.utils.get_cursor_ping_conn(connection)
+        cursor.execute('CREATE TABLE IF NOT EXISTS aarecords_delta_watermarks (`collection` VARCHAR(250) NOT NULL, `last_aacid` VARCHAR(250) CHARACTER SET ascii NULL, PRIMARY KEY (`collection`)) ENGINE=MyISAM DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_bin')
+        cursor.execute('SELECT * FROM aarecords_delta_watermarks')
+        return { row['collection']: row['last_aacid'] for row in cursor.fetchall() }
 
-    build_common('computed_all_md5s', lambda batch: [f"md5:{row['primary_id'].hex()}" for row in batch], primary_id_column='md5')
-    build_common('scihub_dois', lambda batch: [f"doi:{row['primary_id']}" for row in batch], primary_id_column='doi')
-    build_common('nexusstc_cid_only', lambda batch: [f"nexusstc_download:{row['primary_id']}" for row in batch], primary_id_column='nexusstc_id')
+def aarecords_delta_watermarks_save(snapshot):
+    aarecords_delta_watermarks_load() # Creates the table.
+    with engine.connect() as connection:
+        cursor = allthethings.utils.get_cursor_ping_conn(connection)
+        for collection, last_aacid in snapshot.items():
+            cursor.execute('REPLACE INTO aarecords_delta_watermarks (collection, last_aacid) VALUES (%(collection)s, %(last_aacid)s)', { "collection": collection, "last_aacid": last_aacid })
+        cursor.execute('COMMIT')
 
-    with Session(engine) as session:
-        session.connection().connection.ping(reconnect=True)
-        cursor = session.connection().connection.cursor(pymysql.cursors.DictCursor)
-        cursor.execute('DROP TABLE temp_md5_with_doi_seen')
+def aarecords_delta_aac_aarecord_ids(collection, after_aacid, up_to_aacid):
+    table_name = f'annas_archive_meta__aacid__{collection}'
+    aacid_range = { "from": after_aacid or '', "to": up_to_aacid }
+    aarecord_ids = []
+    md5s = set()
+    with engine.connect() as connection:
+        cursor = allthethings.utils.get_cursor_ping_conn(connection)
+        if collection in AAC_COLLECTION_TO_DELTA_SOURCE:
+            (batch_to_aarecord_ids, additional_where, additional_select_AGGREGATES) = AAC_COLLECTION_TO_DELTA_SOURCE[collection]
+            cursor.execute(f'SELECT DISTINCT primary_id FROM {table_name} WHERE aacid > %(from)s AND aacid <= %(to)s AND primary_id IS NOT NULL', aacid_range)
+            primary_ids = sorted(row['primary_id'] for row in cursor.fetchall())
+            for primary_ids_chunk in more_itertools.chunked(primary_ids, 1000):
+                # All rows of the changed primary ids, not just the new ones, like in build_common.
+                cursor = allthethings.utils.get_cursor_ping_conn(connection)
+                cursor.execute(f'SELECT primary_id, COUNT(*) AS count {additional_select_AGGREGATES} FROM {table_name} WHERE {additional_where} {"AND" if additional_where else ""} primary_id IN %(primary_ids)s GROUP BY primary_id ORDER BY primary_id', { "primary_ids": primary_ids_chunk })
+                batch = list(cursor.fetchall())
+                for subbatch in more_itertools.chunked(batch, CHUNK_SIZE):
+                    aarecord_ids += batch_to_aarecord_ids(subbatch)
 
-    print("Done with main!")
+        cursor = allthethings.utils.get_cursor_ping_conn(connection)
+        cursor.execute(f'SELECT DISTINCT md5 FROM {table_name} WHERE aacid > %(from)s AND aacid <= %(to)s AND md5 IS NOT NULL', aacid_range)
+        md5s |= set(row['md5'] for row in cursor.fetchall())
+        if collection in AAC_COLLECTIONS_WITH_MULTIPLE_MD5:
+            cursor.execute(f'SELECT DISTINCT {table_name}__multiple_md5.md5 FROM {table_name}__multiple_md5 JOIN {table_name} USING (aacid) WHERE {table_name}.aacid > %(from)s AND {table_name}.aacid <= %(to)s', aacid_range)
+            md5s |= set(row['md5'] for row in cursor.fetchall())
+        if collection in AAC_COLLECTIONS_WITH_MD5_PRIMARY_ID:
+            cursor.execute(f'SELECT DISTINCT primary_id FROM {table_name} WHERE aacid > %(from)s AND aacid <= %(to)s AND primary_id IS NOT NULL', aacid_range)
+            md5s |= set(row['primary_id'] for row in cursor.fetchall())
+        if collection == 'ia2_records':
+            # Metadata of the files in ia2_acsmpdf_files.
+            cursor.execute(f'SELECT DISTINCT annas_archive_meta__aacid__ia2_acsmpdf_files.md5 FROM annas_archive_meta__aacid__ia2_acsmpdf_files JOIN {table_name} USING (primary_id) WHERE {table_name}.aacid > %(from)s AND {table_name}.aacid <= %(to)s AND annas_archive_meta__aacid__ia2_acsmpdf_files.md5 IS NOT NULL', aacid_range)
+            md5s |= set(row['md5'] for row in cursor.fetchall())
+
+        # The main build only goes through computed_all_md5s.
+        md5s_computed = 0
+        for md5s_chunk in more_itertools.chunked(sorted(md5s), 10000):
+            cursor = allthethings.utils.get_cursor_ping_conn(connection)
+            cursor.execute('SELECT md5 FROM computed_all_md5s WHERE md5 IN %(md5s)s', { "md5s": [bytes.fromhex(md5) for md5 in md5s_chunk] })
+            for row in cursor.fetchall():
+                aarecord_ids.append(f"md5:{row['md5'].hex()}")
+                md5s_computed += 1
+        if md5s_computed < len(md5s):
+            print(f"[{collection}] Skipping {len(md5s) - md5s_computed} new md5s that are not in computed_all_md5s (run mysql_build_computed_all_md5s first?)")
+    return aarecord_ids
+
+def aarecords_delta_md5_aarecord_ids_for_lookup_codes(lookup_codes):
+    aarecord_ids = set()
+    with engine.connect() as connection:
+        cursor = allthethings.utils.get_cursor_ping_conn(connection)
+        cursor.execute('SHOW TABLES LIKE "aarecords_codes"')
+        if len(list(cursor.fetchall())) == 0:
+            print("No aarecords_codes table (run mysql_build_aarecords_codes_numbers after a full build), so not looking up md5 records by code")
+            return aarecord_ids
+        for lookup_codes_chunk in more_itertools.chunked(sorted(lookup_codes), 1000):
+            cursor = allthethings.utils.get_cursor_ping_conn(connection)
+            cursor.execute('SELECT DISTINCT aarecord_id FROM aarecords_codes WHERE code IN %(codes)s AND aarecord_id_prefix = "md5"', { "codes": lookup_codes_chunk })
+            aarecord_ids |= set(aarecord_id.decode() for aarecord_id in allthethings.utils.fetch_scalars(cursor))
+    return aarecord_ids
+
+def elastic_build_aarecords_delta_job(aarecord_ids):
+    lookup_codes = []
+    result = elastic_build_aarecords_job(aarecord_ids, lookup_codes=lookup_codes)
+    return (result, lookup_codes)
+
+# Runs aarecord_ids through elastic_build_aarecords_job, and returns the codes they wrote to *_for_lookup tables.
+def elastic_build_aarecords_ids(aarecord_ids):
+    lookup_codes = set()
+    aarecord_ids_chunks = list(more_itertools.chunked(sorted(aarecord_ids), CHUNK_SIZE))
+    if len(aarecord_ids_chunks) == 0:
+        return lookup_codes
+    with tqdm.tqdm(total=len(aarecord_ids), bar_format='{l_bar}{bar}{r_bar} {eta}') as pbar:
+        writer_error_event = multiprocessing.Event()
+        with concurrent.futures.ProcessPoolExecutor(max_workers=min(THREADS, len(aarecord_ids_chunks)), initializer=elastic_build_aarecords_job_init_pool, initargs=(writer_error_event, None, elastic_build_aarecords_index_version)) as executor:
+            count_by_future = { executor.submit(elastic_build_aarecords_delta_job, aarecord_ids_chunk): len(aarecord_ids_chunk) for aarecord_ids_chunk in aarecord_ids_chunks }
+            for future in concurrent.futures.as_completed(count_by_future):
+                (result, job_lookup_codes) = future.result()
+                if result:
+                    print("Error detected; exiting")
+                    os._exit(1)
+                lookup_codes |= set(job_lookup_codes)
+                pbar.update(count_by_future[future])
+        if writer_error_event.is_set():
+            print("Error detected in writer thread; exiting")
+            os._exit(1)
+    return lookup_codes
+
+def elastic_build_aarecords_delta_internal(ids_file=None, dry_run=False):
+    snapshot = aarecords_delta_aac_snapshot()
+    watermarks = aarecords_delta_watermarks_load()
+
+    aarecord_ids = set()
+    for collection, last_aacid in snapshot.items():
+        if collection not in watermarks:
+            print(f"[{collection}] No watermark yet (it gets set by elastic_build_aarecords_all), only tracking new rows from now on")
+            continue
+        if last_aacid is None or (watermarks[collection] is not None and last_aacid <= watermarks[collection]):
+            continue
+        collection_aarecord_ids = aarecords_delta_aac_aarecord_ids(collection, watermarks[collection], last_aacid)
+        print(f"[{collection}] {len(collection_aarecord_ids)} aarecords affected by rows after {watermarks[collection]}")
+        aarecord_ids |= set(collection_aarecord_ids)
+    if ids_file is not None:
+        with open(ids_file) as f:
+            file_aarecord_ids = set(line.strip() for line in f if line.strip() != '')
+        print(f"{len(file_aarecord_ids)} aarecords from {ids_file}")
+        aarecord_ids |= file_aarecord_ids
+
+    unsupported_aarecord_ids = set(aarecord_id for aarecord_id in aarecord_ids if aarecord_id.split(':', 1)[0] in AARECORDS_DELTA_UNSUPPORTED_PREFIXES)
+    if len(unsupported_aarecord_ids) > 0:
+        print(f"Skipping {len(unsupported_aarecord_ids)} aarecords with prefixes {AARECORDS_DELTA_UNSUPPORTED_PREFIXES}, which need a full build")
+        aarecord_ids -= unsupported_aarecord_ids
+    for aarecord_id_prefix, count in sorted(collections.Counter(aarecord_id.split(':', 1)[0] for aarecord_id in aarecord_ids).items()):
+        print(f"    {aarecord_id_prefix}: {count}")
+    if dry_run:
+        print(f"Dry run: would rebuild {len(aarecord_ids)} aarecords, plus the md5 records that look them up by code")
+        return
+
+    print(f"Rebuilding {len(aarecord_ids)} aarecords")
+    aarecords_delete_written_rows(aarecord_ids)
+    lookup_codes = elastic_build_aarecords_ids(aarecord_ids)
+
+    md5_aarecord_ids = aarecords_delta_md5_aarecord_ids_for_lookup_codes(lookup_codes) - aarecord_ids
+    print(f"Rebuilding {len(md5_aarecord_ids)} md5 aarecords that have any of the {len(lookup_codes)} lookup codes of the above")
+    aarecords_delete_written_rows(md5_aarecord_ids)
+    elastic_build_aarecords_ids(md5_aarecord_ids)
+
+    aarecords_delta_watermarks_save(snapshot)
+    print("Done with delta!")
 
 #################################################################################################
 # ./run flask cli elastic_build_aarecords_forcemerge
@@ -1117,10 +2539,127 @@ def elastic_build_aarecords_forcemerge():
     elastic_build_aarecords_forcemerge_internal()
 def elastic_build_aarecords_forcemerge_internal():
     for index_name, es_handle in allthethings.utils.SEARCH_INDEX_TO_ES_MAPPING.items():
-        for full_index_name in allthethings.utils.all_virtshards_for_index(index_name):
+        for virtshard in range(0, allthethings.utils.ES_VIRTUAL_SHARDS_NUM):
+            full_index_name = elastic_build_aarecords_index_name(index_name, virtshard, elastic_build_aarecords_index_version)
             print(f'Calling forcemerge on {full_index_name=}')
             es_handle.options(ignore_status=[400,404]).indices.forcemerge(index=full_index_name, wait_for_completion=True, request_timeout=300)
 
+#################################################################################################
+# ./run flask cli elastic_build_aarecords_blue_green
+#
+# Like elastic_build_aarecords_all, but builds into fresh "{index_name}__{virtshard}__{version}" ES indices
+# while search keeps being served from the current ones. At the end the "{index_name}__{virtshard}" names
+# (which readers use) are switched over as aliases in one `_aliases` call per ES cluster, and the previous
+# indices are deleted. The first run replaces the concrete "{index_name}__{virtshard}" indices in the same call.
+# Likewise, the aarecords_codes_*_for_lookup tables (which record pages read in get_aarecords_mysql) are built
+# as "{table_name}__{version}" and renamed over the current ones right before the aliases are switched.
+# The other MariaDB tables (aarecords_codes_*, aarecords_all_md5, ...) are still rebuilt in place, as with
+# elastic_build_aarecords_all; they're only read by later build steps, not by pages.
+# To resume, pass the version that was printed at the start of the interrupted build:
+# ./run flask cli elastic_build_aarecords_blue_green --resume --index-version 20240101120000
+@cli.cli.command('elastic_build_aarecords_blue_green')
+@click.option('--resume', is_flag=True, help='Continue an interrupted build from its last checkpoints.')
+@click.option('--index-version', default=None, help='Version suffix for the new indices. Defaults to the current time.')
+@click.option('--keep-old-indices', is_flag=True, help="Don't delete the previous indices (and *_for_lookup tables) after switching over.")
+def elastic_build_aarecords_blue_green(resume, index_version, keep_old_indices):
+    elastic_build_aarecords_blue_green_internal(resume=resume, index_version=index_version, keep_old_indices=keep_old_indices)
+
+def elastic_build_aarecords_blue_green_internal(resume=False, index_version=None, keep_old_indices=False):
+    global elastic_build_aarecords_index_version
+    if resume and index_version is None:
+        raise Exception("--resume requires the --index-version of the build to resume")
+    if index_version is None:
+        index_version = datetime.datetime.now(tz=datetime.timezone.utc).strftime('%Y%m%d%H%M%S')
+    print(f"Blue-green build with {index_version=}")
+
+    if not resume:
+        # Refreshes and replication are only needed once the indices are live; see elastic_build_aarecords_shadow_indices_finish.
+        build_index_body = copy.deepcopy(es_create_index_body)
+        build_index_body['settings']['index'] = { **build_index_body['settings']['index'], "number_of_replicas": 0, "refresh_interval": "-1", "translog.durability": "async" }
+        print("Creating new ES indices")
+        for index_name, es_handle in allthethings.utils.SEARCH_INDEX_TO_ES_MAPPING.items():
+            for virtshard in range(0, allthethings.utils.ES_VIRTUAL_SHARDS_NUM):
+                es_handle.indices.create(wait_for_active_shards=1, index=elastic_build_aarecords_index_name(index_name, virtshard, index_version), body=build_index_body)
+
+    elastic_build_aarecords_index_version = index_version
+    allthethings.utils.aarecords_codes_for_lookup_version = index_version
+    try:
+        elastic_build_aarecords_all_internal(resume=resume)
+    finally:
+        elastic_build_aarecords_index_version = None
+        allthethings.utils.aarecords_codes_for_lookup_version = None
+
+    elastic_build_aarecords_blue_green_swap(index_version, keep_old_indices=keep_old_indices)
+    print(f"Done with blue-green build {index_version=}!")
+
+# Force-merge the new indices while they still have no replicas (so that merged segments don't have to be
+# copied to replicas as well), and only then restore the replicas and refreshes of es_create_index_body.
+def elastic_build_aarecords_shadow_indices_finish(index_version):
+    for index_name, es_handle in allthethings.utils.SEARCH_INDEX_TO_ES_MAPPING.items():
+        full_index_names = [elastic_build_aarecords_index_name(index_name, virtshard, index_version) for virtshard in range(0, allthethings.utils.ES_VIRTUAL_SHARDS_NUM)]
+        # Make all documents part of segments first, since refreshes are disabled during the build.
+        es_handle.indices.refresh(index=full_index_names, request_timeout=300)
+        for full_index_name in full_index_names:
+            print(f'Calling forcemerge on {full_index_name=}')
+            es_handle.options(ignore_status=[400,404]).indices.forcemerge(index=full_index_name, wait_for_completion=True, request_timeout=300)
+    for index_name, es_handle in allthethings.utils.SEARCH_INDEX_TO_ES_MAPPING.items():
+        # Keep the replica count of the live indices, in case it was changed on the cluster.
+        number_of_replicas = es_create_index_body['settings']['index']['number_of_replicas']
+        live_settings = es_handle.options(ignore_status=[404]).indices.get_settings(index=elastic_build_aarecords_index_name(index_name, 0, None), name='index.number_of_replicas')
+        for index_settings in live_settings.values():
+            if isinstance(index_settings, dict) and 'settings' in index_settings:
+                number_of_replicas = int(index_settings['settings']['index']['number_of_replicas'])
+        full_index_names = [elastic_build_aarecords_index_name(index_name, virtshard, index_version) for virtshard in range(0, allthethings.utils.ES_VIRTUAL_SHARDS_NUM)]
+        print(f"Restoring settings of {index_name} {index_version=} ({number_of_replicas=})")
+        es_handle.indices.put_settings(index=full_index_names, settings={ "index": { "number_of_replicas": number_of_replicas, "refresh_interval": None, "translog.durability": None } })
+        es_handle.indices.refresh(index=full_index_names, request_timeout=300)
+
+# Rename all versioned *_for_lookup tables over the current ones, in a single (atomic) RENAME TABLE.
+def elastic_build_aarecords_blue_green_swap_lookup_tables(index_version, keep_old_tables=False):
+    with engine.connect() as connection:
+        cursor = allthethings.utils.get_cursor_ping_conn(connection)
+        renames = []
+        old_table_names = []
+        for table_name in sorted(set(codes_for_lookup['table_name'] for codes_for_lookup in AARECORD_ID_PREFIX_TO_CODES_FOR_LOOKUP.values())):
+            cursor.execute('SHOW TABLES LIKE %(table_name)s', { "table_name": table_name })
+            if len(list(cursor.fetchall())) > 0:
+                old_table_name = f'{table_name}__old_{index_version}'
+                renames.append(f'{table_name} TO {old_table_name}')
+                old_table_names.append(old_table_name)
+            renames.append(f'{allthethings.utils.aarecords_codes_for_lookup_table_name(table_name, index_version)} TO {table_name}')
+        print(f"Renaming {len(renames)} *_for_lookup tables")
+        cursor.execute(f'RENAME TABLE {", ".join(renames)}')
+        if not keep_old_tables:
+            for old_table_name in old_table_names:
+                print(f"Dropping old table {old_table_name}")
+                cursor.execute(f'DROP TABLE IF EXISTS {old_table_name}')
+
+def elastic_build_aarecords_blue_green_swap(index_version, keep_old_indices=False):
+    elastic_build_aarecords_blue_green_swap_lookup_tables(index_version, keep_old_tables=keep_old_indices)
+
+    # es and es_aux are separate clusters, so this is atomic per cluster.
+    actions_by_es_handle = collections.defaultdict(list)
+    old_indices_by_es_handle = collections.defaultdict(list)
+    for index_name, es_handle in allthethings.utils.SEARCH_INDEX_TO_ES_MAPPING.items():
+        for virtshard in range(0, allthethings.utils.ES_VIRTUAL_SHARDS_NUM):
+            alias_name = elastic_build_aarecords_index_name(index_name, virtshard, None)
+            if es_handle.indices.exists_alias(name=alias_name):
+                for old_index_name in es_handle.indices.get_alias(name=alias_name).keys():
+                    actions_by_es_handle[es_handle].append({ "remove": { "index": old_index_name, "alias": alias_name } })
+                    old_indices_by_es_handle[es_handle].append(old_index_name)
+            elif es_handle.indices.exists(index=alias_name):
+                # Concrete index from before blue-green builds; it has to go for the alias to take its name.
+                actions_by_es_handle[es_handle].append({ "remove_index": { "index": alias_name } })
+            actions_by_es_handle[es_handle].append({ "add": { "index": elastic_build_aarecords_index_name(index_name, virtshard, index_version), "alias": alias_name } })
+    for es_handle, actions in actions_by_es_handle.items():
+        print(f"Switching {len(actions)} aliases")
+        es_handle.indices.update_aliases(actions=actions)
+    if not keep_old_indices:
+        for es_handle, old_index_names in old_indices_by_es_handle.items():
+            for old_index_name in old_index_names:
+                print(f"Deleting old index {old_index_name}")
+                es_handle.options(ignore_status=[400,404]).indices.delete(index=old_index_name)
+
 #################################################################################################
 # Fill make aarecords_codes with numbers based off ROW_NUMBER and
 # DENSE_RANK MySQL functions, but precomupted because they're expensive.
@@ -74,6 +74,12 @@ def databases():
     number_of_db_exceptions = 0
     return ""
 
+# Hit rate of allthethings.utils.aac_block_cache, for the worker process that happens to serve the request.
+@dyn.get("/up/aac_block_cache/")
+@allthethings.utils.no_cache()
+def aac_block_cache():
+    return orjson.dumps(allthethings.utils.aac_block_cache_info())
+
 def api_md5_fast_download_get_json(download_url, other_fields):
     return allthethings.utils.nice_json({
         "///download_url": [
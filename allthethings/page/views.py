@@ -400,7 +400,7 @@ def get_stats_data():
         zlib3_record = cursor.fetchone()
         zlib_date = ''
         if zlib3_record is not None:
-            zlib_aac_lines = allthethings.utils.get_lines_from_aac_file(cursor, 'zlib3_records', [(zlib3_record['byte_offset'], zlib3_record['byte_length'])])
+            zlib_aac_lines = allthethings.utils.get_lines_from_aac_file(cursor, 'zlib3_records', [(zlib3_record['byte_offset'], zlib3_record['byte_length'])], zero_copy=True)
             if len(zlib_aac_lines) > 0:
                 zlib_date = orjson.loads(zlib_aac_lines[0])['metadata']['date_modified']
 
@@ -1268,9 +1268,10 @@ def get_aac_zlib3_book_dicts(session, key, values):
                 zlib3_files_indexes.append(row_index)
                 zlib3_files_offsets_and_lengths.append((row['file_byte_offset'], row['file_byte_length']))
             zlib3_rows.append({ "primary_id": row['primary_id'] })
-        for index, line_bytes in enumerate(allthethings.utils.get_lines_from_aac_file(cursor, 'zlib3_records', zlib3_records_offsets_and_lengths)):
+        zlib3_lines = allthethings.utils.get_lines_from_aac_files(cursor, { 'zlib3_records': zlib3_records_offsets_and_lengths, 'zlib3_files': zlib3_files_offsets_and_lengths }, zero_copy=True)
+        for index, line_bytes in enumerate(zlib3_lines['zlib3_records']):
             zlib3_rows[zlib3_records_indexes[index]]['record'] = orjson.loads(line_bytes)
-        for index, line_bytes in enumerate(allthethings.utils.get_lines_from_aac_file(cursor, 'zlib3_files', zlib3_files_offsets_and_lengths)):
+        for index, line_bytes in enumerate(zlib3_lines['zlib3_files']):
             zlib3_rows[zlib3_files_indexes[index]]['file'] = orjson.loads(line_bytes)
 
         raw_aac_zlib3_books_by_primary_id = collections.defaultdict(list)
@@ -1461,9 +1462,10 @@ def get_ia_record_dicts(session, key, values):
                 ia2_records_offsets_and_lengths.append((ia_record_dict['byte_offset'], ia_record_dict['byte_length']))
             ia_entries_combined.append([ia_record_dict, None, None])
 
-    for index, line_bytes in enumerate(allthethings.utils.get_lines_from_aac_file(cursor, 'ia2_records', ia2_records_offsets_and_lengths)):
+    ia2_lines = allthethings.utils.get_lines_from_aac_files(cursor, { 'ia2_records': ia2_records_offsets_and_lengths, 'ia2_acsmpdf_files': ia2_acsmpdf_files_offsets_and_lengths }, zero_copy=True)
+    for index, line_bytes in enumerate(ia2_lines['ia2_records']):
         ia_entries_combined[ia2_records_indexes[index]][0] = orjson.loads(line_bytes)
-    for index, line_bytes in enumerate(allthethings.utils.get_lines_from_aac_file(cursor, 'ia2_acsmpdf_files', ia2_acsmpdf_files_offsets_and_lengths)):
+    for index, line_bytes in enumerate(ia2_lines['ia2_acsmpdf_files']):
         ia_entries_combined[ia2_acsmpdf_files_indexes[index]][2] = orjson.loads(line_bytes)
 
     # print(f"{ia_entries_combined=}")
@@ -2857,16 +2859,21 @@ def get_oclc_dicts(session, key, values):
 
     session.connection().connection.ping(reconnect=True)
     cursor = session.connection().connection.cursor(pymysql.cursors.DictCursor)
-    cursor.execute('SELECT primary_id, byte_offset, byte_length FROM annas_archive_meta__aacid__worldcat WHERE primary_id IN %(values)s ORDER BY byte_offset', { "values": [str(val) for val in values] })
+    rows = allthethings.utils.aac_sidecar_lookup(cursor, 'worldcat', 'primary_id', values)
+    if rows is None:
+        cursor.execute('SELECT primary_id, byte_offset, byte_length FROM annas_archive_meta__aacid__worldcat WHERE primary_id IN %(values)s ORDER BY byte_offset', { "values": [str(val) for val in values] })
+        rows = list(cursor.fetchall())
+    else:
+        rows.sort(key=lambda row: row['byte_offset'])
 
     worldcat_oclc_ids = []
     worldcat_offsets_and_lengths = []
-    for row in list(cursor.fetchall()):
+    for row in rows:
         worldcat_oclc_ids.append(str(row['primary_id']))
         worldcat_offsets_and_lengths.append((row['byte_offset'], row['byte_length']))
 
     aac_records_by_oclc_id = collections.defaultdict(list)
-    for index, line_bytes in enumerate(allthethings.utils.get_lines_from_aac_file(cursor, 'worldcat', worldcat_offsets_and_lengths)):
+    for index, line_bytes in enumerate(allthethings.utils.get_lines_from_aac_file(cursor, 'worldcat', worldcat_offsets_and_lengths, zero_copy=True)):
         aac_records_by_oclc_id[str(worldcat_oclc_ids[index])].append(orjson.loads(line_bytes))
 
     oclc_dicts = []
@@ -3107,9 +3114,10 @@ def get_duxiu_dicts(session, key, values, include_deep_transitive_md5s_size_path
             duxiu_files_offsets_and_lengths.append((row['generated_file_byte_offset'], row['generated_file_byte_length']))
         top_level_records.append([{ "primary_id": row['primary_id'] }, None])
 
-    for index, line_bytes in enumerate(allthethings.utils.get_lines_from_aac_file(cursor, 'duxiu_records', duxiu_records_offsets_and_lengths)):
+    duxiu_lines = allthethings.utils.get_lines_from_aac_files(cursor, { 'duxiu_records': duxiu_records_offsets_and_lengths, 'duxiu_files': duxiu_files_offsets_and_lengths }, zero_copy=True)
+    for index, line_bytes in enumerate(duxiu_lines['duxiu_records']):
         top_level_records[duxiu_records_indexes[index]][0]["aac"] = orjson.loads(line_bytes)
-    for index, line_bytes in enumerate(allthethings.utils.get_lines_from_aac_file(cursor, 'duxiu_files', duxiu_files_offsets_and_lengths)):
+    for index, line_bytes in enumerate(duxiu_lines['duxiu_files']):
         top_level_records[duxiu_files_indexes[index]][1] = { "aac": orjson.loads(line_bytes) }
 
     for duxiu_record_dict, duxiu_file_dict in top_level_records:
@@ -3661,24 +3669,30 @@ def get_aac_upload_book_dicts(session, key, values):
     try:
         session.connection().connection.ping(reconnect=True)
         cursor = session.connection().connection.cursor(pymysql.cursors.DictCursor)
-        cursor.execute(f'SELECT annas_archive_meta__aacid__upload_records.byte_offset AS record_byte_offset, annas_archive_meta__aacid__upload_records.byte_length AS record_byte_length, annas_archive_meta__aacid__upload_files.byte_offset AS file_byte_offset, annas_archive_meta__aacid__upload_files.byte_length AS file_byte_length, annas_archive_meta__aacid__upload_records.md5 AS md5 FROM annas_archive_meta__aacid__upload_records LEFT JOIN annas_archive_meta__aacid__upload_files ON (annas_archive_meta__aacid__upload_records.md5 = annas_archive_meta__aacid__upload_files.primary_id) WHERE {aac_key} IN %(values)s', { "values": [str(value) for value in values] })
-
-        upload_records_indexes = []
         upload_records_offsets_and_lengths = []
-        upload_files_indexes = []
         upload_files_offsets_and_lengths = []
         records_by_md5 = collections.defaultdict(dict)
         files_by_md5 = collections.defaultdict(dict)
-        for row_index, row in enumerate(list(cursor.fetchall())):
-            upload_records_indexes.append(row_index)
-            upload_records_offsets_and_lengths.append((row['record_byte_offset'], row['record_byte_length']))
-            if row.get('file_byte_offset') is not None:
-                upload_files_indexes.append(row_index)
-                upload_files_offsets_and_lengths.append((row['file_byte_offset'], row['file_byte_length']))
-        for index, line_bytes in enumerate(allthethings.utils.get_lines_from_aac_file(cursor, 'upload_records', upload_records_offsets_and_lengths)):
+        # Records and files are collected by md5 and aacid below, so they don't need to be paired up here,
+        # and the join can be done with two sidecar lookups (upload_files.primary_id is the md5).
+        upload_records_rows = allthethings.utils.aac_sidecar_lookup(cursor, 'upload_records', 'md5', values)
+        upload_files_rows = None
+        if upload_records_rows is not None:
+            upload_files_rows = allthethings.utils.aac_sidecar_lookup(cursor, 'upload_files', 'primary_id', [row['md5'] for row in upload_records_rows])
+        if upload_files_rows is not None:
+            upload_records_offsets_and_lengths = [(row['byte_offset'], row['byte_length']) for row in upload_records_rows]
+            upload_files_offsets_and_lengths = [(row['byte_offset'], row['byte_length']) for row in upload_files_rows]
+        else:
+            cursor.execute(f'SELECT annas_archive_meta__aacid__upload_records.byte_offset AS record_byte_offset, annas_archive_meta__aacid__upload_records.byte_length AS record_byte_length, annas_archive_meta__aacid__upload_files.byte_offset AS file_byte_offset, annas_archive_meta__aacid__upload_files.byte_length AS file_byte_length, annas_archive_meta__aacid__upload_records.md5 AS md5 FROM annas_archive_meta__aacid__upload_records LEFT JOIN annas_archive_meta__aacid__upload_files ON (annas_archive_meta__aacid__upload_records.md5 = annas_archive_meta__aacid__upload_files.primary_id) WHERE {aac_key} IN %(values)s', { "values": [str(value) for value in values] })
+            for row in list(cursor.fetchall()):
+                upload_records_offsets_and_lengths.append((row['record_byte_offset'], row['record_byte_length']))
+                if row.get('file_byte_offset') is not None:
+                    upload_files_offsets_and_lengths.append((row['file_byte_offset'], row['file_byte_length']))
+        upload_lines = allthethings.utils.get_lines_from_aac_files(cursor, { 'upload_records': upload_records_offsets_and_lengths, 'upload_files': upload_files_offsets_and_lengths }, zero_copy=True)
+        for index, line_bytes in enumerate(upload_lines['upload_records']):
             record = orjson.loads(line_bytes)
             records_by_md5[record['metadata']['md5']][record['aacid']] = record
-        for index, line_bytes in enumerate(allthethings.utils.get_lines_from_aac_file(cursor, 'upload_files', upload_files_offsets_and_lengths)):
+        for index, line_bytes in enumerate(upload_lines['upload_files']):
             file = orjson.loads(line_bytes)
             files_by_md5[file['metadata']['md5']][file['aacid']] = file
         for md5 in list(dict.fromkeys(list(records_by_md5.keys()) + list(files_by_md5.keys()))):
@@ -3916,7 +3930,7 @@ def get_aac_magzdb_book_dicts(session, key, values):
 
     aac_records_by_requested_value = {}
     publication_ids = set()
-    for index, line_bytes in enumerate(allthethings.utils.get_lines_from_aac_file(cursor, 'magzdb_records', record_offsets_and_lengths)):
+    for index, line_bytes in enumerate(allthethings.utils.get_lines_from_aac_file(cursor, 'magzdb_records', record_offsets_and_lengths, zero_copy=True)):
         aac_record = orjson.loads(line_bytes)
         aac_records_by_requested_value[requested_values[index]] = aac_record
         publication_ids.add(aac_record['metadata']['record']['publicationId'])
@@ -3929,7 +3943,7 @@ def get_aac_magzdb_book_dicts(session, key, values):
         for row in cursor.fetchall():
             publication_offsets_and_lengths.append((row['byte_offset'], row['byte_length']))
     publication_aac_records_by_id = {}
-    for line_bytes in allthethings.utils.get_lines_from_aac_file(cursor, 'magzdb_records', publication_offsets_and_lengths):
+    for line_bytes in allthethings.utils.get_lines_from_aac_file(cursor, 'magzdb_records', publication_offsets_and_lengths, zero_copy=True):
         aac_record = orjson.loads(line_bytes)
         publication_aac_records_by_id[aac_record['metadata']['record']['id']] = aac_record
 
@@ -4062,11 +4076,11 @@ def get_aac_nexusstc_book_dicts(session, key, values):
         return []
 
     aac_records_by_requested_value = {}
-    for index, line_bytes in enumerate(allthethings.utils.get_lines_from_aac_file(cursor, 'nexusstc_records', record_offsets_and_lengths)):
+    for index, line_bytes in enumerate(allthethings.utils.get_lines_from_aac_file(cursor, 'nexusstc_records', record_offsets_and_lengths, zero_copy=True)):
         try:
             aac_record = orjson.loads(line_bytes)
         except Exception:
-            raise Exception(f"Invalid JSON in get_aac_nexusstc_book_dicts: {line_bytes=}")
+            raise Exception(f"Invalid JSON in get_aac_nexusstc_book_dicts: {bytes(line_bytes)=}")
         aac_records_by_requested_value[requested_values[index]] = aac_record
 
     aac_nexusstc_book_dicts = []
@@ -4354,7 +4368,10 @@ def get_aac_edsebk_book_dicts(session, key, values):
         session.connection().connection.ping(reconnect=True)
         cursor = session.connection().connection.cursor(pymysql.cursors.DictCursor)
         if key == 'edsebk_id':
-            cursor.execute('SELECT byte_offset, byte_length, primary_id FROM annas_archive_meta__aacid__ebscohost_records WHERE primary_id IN %(values)s GROUP BY primary_id', { "values": values })
+            rows = allthethings.utils.aac_sidecar_lookup(cursor, 'ebscohost_records', 'primary_id', values, group_by_key=True)
+            if rows is None:
+                cursor.execute('SELECT byte_offset, byte_length, primary_id FROM annas_archive_meta__aacid__ebscohost_records WHERE primary_id IN %(values)s GROUP BY primary_id', { "values": values })
+                rows = list(cursor.fetchall())
         else:
             raise Exception(f"Unexpected 'key' in get_aac_edsebk_book_dicts: '{key}'")
     except Exception as err:
@@ -4365,7 +4382,7 @@ def get_aac_edsebk_book_dicts(session, key, values):
 
     record_offsets_and_lengths = []
     primary_ids = []
-    for row_index, row in enumerate(list(cursor.fetchall())):
+    for row_index, row in enumerate(rows):
         record_offsets_and_lengths.append((row['byte_offset'], row['byte_length']))
         primary_ids.append(row['primary_id'])
 
@@ -4373,7 +4390,7 @@ def get_aac_edsebk_book_dicts(session, key, values):
         return []
 
     aac_records_by_primary_id = {}
-    for index, line_bytes in enumerate(allthethings.utils.get_lines_from_aac_file(cursor, 'ebscohost_records', record_offsets_and_lengths)):
+    for index, line_bytes in enumerate(allthethings.utils.get_lines_from_aac_file(cursor, 'ebscohost_records', record_offsets_and_lengths, zero_copy=True)):
         aac_record = orjson.loads(line_bytes)
         aac_records_by_primary_id[primary_ids[index]] = aac_record
 
@@ -4448,7 +4465,10 @@ def get_aac_cerlalc_book_dicts(session, key, values):
         session.connection().connection.ping(reconnect=True)
         cursor = session.connection().connection.cursor(pymysql.cursors.DictCursor)
         if key == 'cerlalc_id':
-            cursor.execute('SELECT byte_offset, byte_length, primary_id FROM annas_archive_meta__aacid__cerlalc_records WHERE primary_id IN %(values)s GROUP BY primary_id', { "values": values })
+            rows = allthethings.utils.aac_sidecar_lookup(cursor, 'cerlalc_records', 'primary_id', values, group_by_key=True)
+            if rows is None:
+                cursor.execute('SELECT byte_offset, byte_length, primary_id FROM annas_archive_meta__aacid__cerlalc_records WHERE primary_id IN %(values)s GROUP BY primary_id', { "values": values })
+                rows = list(cursor.fetchall())
         else:
             raise Exception(f"Unexpected 'key' in get_aac_cerlalc_book_dicts: '{key}'")
     except Exception as err:
@@ -4459,14 +4479,14 @@ def get_aac_cerlalc_book_dicts(session, key, values):
 
     record_offsets_and_lengths = []
     primary_ids = []
-    for row_index, row in enumerate(list(cursor.fetchall())):
+    for row_index, row in enumerate(rows):
         record_offsets_and_lengths.append((row['byte_offset'], row['byte_length']))
         primary_ids.append(row['primary_id'])
     if len(record_offsets_and_lengths) == 0:
         return []
 
     aac_records_by_primary_id = {}
-    for index, line_bytes in enumerate(allthethings.utils.get_lines_from_aac_file(cursor, 'cerlalc_records', record_offsets_and_lengths)):
+    for index, line_bytes in enumerate(allthethings.utils.get_lines_from_aac_file(cursor, 'cerlalc_records', record_offsets_and_lengths, zero_copy=True)):
         aac_record = orjson.loads(line_bytes)
         aac_records_by_primary_id[primary_ids[index]] = aac_record
 
@@ -4569,7 +4589,10 @@ def get_aac_czech_oo42hcks_book_dicts(session, key, values):
         session.connection().connection.ping(reconnect=True)
         cursor = session.connection().connection.cursor(pymysql.cursors.DictCursor)
         if key == 'czech_oo42hcks_id':
-            cursor.execute('SELECT byte_offset, byte_length, primary_id FROM annas_archive_meta__aacid__czech_oo42hcks_records WHERE primary_id IN %(values)s GROUP BY primary_id', { "values": values })
+            rows = allthethings.utils.aac_sidecar_lookup(cursor, 'czech_oo42hcks_records', 'primary_id', values, group_by_key=True)
+            if rows is None:
+                cursor.execute('SELECT byte_offset, byte_length, primary_id FROM annas_archive_meta__aacid__czech_oo42hcks_records WHERE primary_id IN %(values)s GROUP BY primary_id', { "values": values })
+                rows = list(cursor.fetchall())
         else:
             raise Exception(f"Unexpected 'key' in get_aac_czech_oo42hcks_book_dicts: '{key}'")
     except Exception as err:
@@ -4580,7 +4603,7 @@ def get_aac_czech_oo42hcks_book_dicts(session, key, values):
 
     record_offsets_and_lengths = []
     primary_ids = []
-    for row_index, row in enumerate(list(cursor.fetchall())):
+    for row_index, row in enumerate(rows):
         record_offsets_and_lengths.append((row['byte_offset'], row['byte_length']))
         primary_ids.append(row['primary_id'])
     if len(record_offsets_and_lengths) == 0:
@@ -4588,6 +4611,7 @@ def get_aac_czech_oo42hcks_book_dicts(session, key, values):
 
     aac_records_by_primary_id = {}
     line_bytes_by_primary_id = {}
+    # Not zero_copy, since some of the lines are kept and decoded as text below.
     for index, line_bytes in enumerate(allthethings.utils.get_lines_from_aac_file(cursor, 'czech_oo42hcks_records', record_offsets_and_lengths)):
         aac_record = orjson.loads(line_bytes)
         aac_records_by_primary_id[primary_ids[index]] = aac_record
@@ -4733,7 +4757,10 @@ def get_aac_gbooks_book_dicts(session, key, values):
         session.connection().connection.ping(reconnect=True)
         cursor = session.connection().connection.cursor(pymysql.cursors.DictCursor)
         if key == 'gbooks_id':
-            cursor.execute('SELECT byte_offset, byte_length, primary_id FROM annas_archive_meta__aacid__gbooks_records WHERE primary_id IN %(values)s GROUP BY primary_id', { "values": values })
+            rows = allthethings.utils.aac_sidecar_lookup(cursor, 'gbooks_records', 'primary_id', values, group_by_key=True)
+            if rows is None:
+                cursor.execute('SELECT byte_offset, byte_length, primary_id FROM annas_archive_meta__aacid__gbooks_records WHERE primary_id IN %(values)s GROUP BY primary_id', { "values": values })
+                rows = list(cursor.fetchall())
         else:
             raise Exception(f"Unexpected 'key' in get_aac_gbooks_book_dicts: '{key}'")
     except Exception as err:
@@ -4744,14 +4771,14 @@ def get_aac_gbooks_book_dicts(session, key, values):
 
     record_offsets_and_lengths = []
     primary_ids = []
-    for row_index, row in enumerate(list(cursor.fetchall())):
+    for row_index, row in enumerate(rows):
         record_offsets_and_lengths.append((row['byte_offset'], row['byte_length']))
         primary_ids.append(row['primary_id'])
     if len(record_offsets_and_lengths) == 0:
         return []
 
     aac_records_by_primary_id = {}
-    for index, line_bytes in enumerate(allthethings.utils.get_lines_from_aac_file(cursor, 'gbooks_records', record_offsets_and_lengths)):
+    for index, line_bytes in enumerate(allthethings.utils.get_lines_from_aac_file(cursor, 'gbooks_records', record_offsets_and_lengths, zero_copy=True)):
         aac_record = orjson.loads(line_bytes)
         aac_records_by_primary_id[primary_ids[index]] = aac_record
 
@@ -4825,7 +4852,10 @@ def get_aac_goodreads_book_dicts(session, key, values):
         session.connection().connection.ping(reconnect=True)
         cursor = session.connection().connection.cursor(pymysql.cursors.DictCursor)
         if key == 'goodreads_id':
-            cursor.execute('SELECT byte_offset, byte_length, primary_id FROM annas_archive_meta__aacid__goodreads_records WHERE primary_id IN %(values)s GROUP BY primary_id', { "values": values })
+            rows = allthethings.utils.aac_sidecar_lookup(cursor, 'goodreads_records', 'primary_id', values, group_by_key=True)
+            if rows is None:
+                cursor.execute('SELECT byte_offset, byte_length, primary_id FROM annas_archive_meta__aacid__goodreads_records WHERE primary_id IN %(values)s GROUP BY primary_id', { "values": values })
+                rows = list(cursor.fetchall())
         else:
             raise Exception(f"Unexpected 'key' in get_aac_goodreads_book_dicts: '{key}'")
     except Exception as err:
@@ -4836,14 +4866,14 @@ def get_aac_goodreads_book_dicts(session, key, values):
 
     record_offsets_and_lengths = []
     primary_ids = []
-    for row_index, row in enumerate(list(cursor.fetchall())):
+    for row_index, row in enumerate(rows):
         record_offsets_and_lengths.append((row['byte_offset'], row['byte_length']))
         primary_ids.append(row['primary_id'])
     if len(record_offsets_and_lengths) == 0:
         return []
 
     aac_records_by_primary_id = {}
-    for index, line_bytes in enumerate(allthethings.utils.get_lines_from_aac_file(cursor, 'goodreads_records', record_offsets_and_lengths)):
+    for index, line_bytes in enumerate(allthethings.utils.get_lines_from_aac_file(cursor, 'goodreads_records', record_offsets_and_lengths, zero_copy=True)):
         aac_record = orjson.loads(line_bytes)
         aac_records_by_primary_id[primary_ids[index]] = aac_record
 
@@ -4916,7 +4946,10 @@ def get_aac_isbngrp_book_dicts(session, key, values):
         session.connection().connection.ping(reconnect=True)
         cursor = session.connection().connection.cursor(pymysql.cursors.DictCursor)
         if key == 'isbngrp_id':
-            cursor.execute('SELECT byte_offset, byte_length, primary_id FROM annas_archive_meta__aacid__isbngrp_records WHERE primary_id IN %(values)s GROUP BY primary_id', { "values": values })
+            rows = allthethings.utils.aac_sidecar_lookup(cursor, 'isbngrp_records', 'primary_id', values, group_by_key=True)
+            if rows is None:
+                cursor.execute('SELECT byte_offset, byte_length, primary_id FROM annas_archive_meta__aacid__isbngrp_records WHERE primary_id IN %(values)s GROUP BY primary_id', { "values": values })
+                rows = list(cursor.fetchall())
         else:
             raise Exception(f"Unexpected 'key' in get_aac_isbngrp_book_dicts: '{key}'")
     except Exception as err:
@@ -4927,14 +4960,14 @@ def get_aac_isbngrp_book_dicts(session, key, values):
 
     record_offsets_and_lengths = []
     primary_ids = []
-    for row_index, row in enumerate(list(cursor.fetchall())):
+    for row_index, row in enumerate(rows):
         record_offsets_and_lengths.append((row['byte_offset'], row['byte_length']))
         primary_ids.append(row['primary_id'])
     if len(record_offsets_and_lengths) == 0:
         return []
 
     aac_records_by_primary_id = {}
-    for index, line_bytes in enumerate(allthethings.utils.get_lines_from_aac_file(cursor, 'isbngrp_records', record_offsets_and_lengths)):
+    for index, line_bytes in enumerate(allthethings.utils.get_lines_from_aac_file(cursor, 'isbngrp_records', record_offsets_and_lengths, zero_copy=True)):
         aac_record = orjson.loads(line_bytes)
         aac_records_by_primary_id[primary_ids[index]] = aac_record
 
@@ -4981,7 +5014,10 @@ def get_aac_libby_book_dicts(session, key, values):
         session.connection().connection.ping(reconnect=True)
         cursor = session.connection().connection.cursor(pymysql.cursors.DictCursor)
         if key == 'libby_id':
-            cursor.execute('SELECT byte_offset, byte_length, primary_id FROM annas_archive_meta__aacid__libby_records WHERE primary_id IN %(values)s GROUP BY primary_id', { "values": values })
+            rows = allthethings.utils.aac_sidecar_lookup(cursor, 'libby_records', 'primary_id', values, group_by_key=True)
+            if rows is None:
+                cursor.execute('SELECT byte_offset, byte_length, primary_id FROM annas_archive_meta__aacid__libby_records WHERE primary_id IN %(values)s GROUP BY primary_id', { "values": values })
+                rows = list(cursor.fetchall())
         else:
             raise Exception(f"Unexpected 'key' in get_aac_libby_book_dicts: '{key}'")
     except Exception as err:
@@ -4992,14 +5028,14 @@ def get_aac_libby_book_dicts(session, key, values):
 
     record_offsets_and_lengths = []
     primary_ids = []
-    for row_index, row in enumerate(list(cursor.fetchall())):
+    for row_index, row in enumerate(rows):
         record_offsets_and_lengths.append((row['byte_offset'], row['byte_length']))
         primary_ids.append(row['primary_id'])
     if len(record_offsets_and_lengths) == 0:
         return []
 
     aac_records_by_primary_id = {}
-    for index, line_bytes in enumerate(allthethings.utils.get_lines_from_aac_file(cursor, 'libby_records', record_offsets_and_lengths)):
+    for index, line_bytes in enumerate(allthethings.utils.get_lines_from_aac_file(cursor, 'libby_records', record_offsets_and_lengths, zero_copy=True)):
         aac_record = orjson.loads(line_bytes)
         aac_records_by_primary_id[primary_ids[index]] = aac_record
 
@@ -5142,7 +5178,10 @@ def get_aac_rgb_book_dicts(session, key, values):
         session.connection().connection.ping(reconnect=True)
         cursor = session.connection().connection.cursor(pymysql.cursors.DictCursor)
         if key == 'rgb_id':
-            cursor.execute('SELECT byte_offset, byte_length, primary_id FROM annas_archive_meta__aacid__rgb_records WHERE primary_id IN %(values)s GROUP BY primary_id', { "values": values })
+            rows = allthethings.utils.aac_sidecar_lookup(cursor, 'rgb_records', 'primary_id', values, group_by_key=True)
+            if rows is None:
+                cursor.execute('SELECT byte_offset, byte_length, primary_id FROM annas_archive_meta__aacid__rgb_records WHERE primary_id IN %(values)s GROUP BY primary_id', { "values": values })
+                rows = list(cursor.fetchall())
         else:
             raise Exception(f"Unexpected 'key' in get_aac_rgb_book_dicts: '{key}'")
     except Exception as err:
@@ -5153,14 +5192,14 @@ def get_aac_rgb_book_dicts(session, key, values):
 
     record_offsets_and_lengths = []
     primary_ids = []
-    for row_index, row in enumerate(list(cursor.fetchall())):
+    for row_index, row in enumerate(rows):
         record_offsets_and_lengths.append((row['byte_offset'], row['byte_length']))
         primary_ids.append(row['primary_id'])
     if len(record_offsets_and_lengths) == 0:
         return []
 
     aac_records_by_primary_id = {}
-    for index, line_bytes in enumerate(allthethings.utils.get_lines_from_aac_file(cursor, 'rgb_records', record_offsets_and_lengths)):
+    for index, line_bytes in enumerate(allthethings.utils.get_lines_from_aac_file(cursor, 'rgb_records', record_offsets_and_lengths, zero_copy=True)):
         aac_record = orjson.loads(line_bytes)
         aac_records_by_primary_id[primary_ids[index]] = aac_record
 
@@ -5196,7 +5235,10 @@ def get_aac_trantor_book_dicts(session, key, values):
         session.connection().connection.ping(reconnect=True)
         cursor = session.connection().connection.cursor(pymysql.cursors.DictCursor)
         if key == 'trantor_id':
-            cursor.execute('SELECT byte_offset, byte_length, primary_id FROM annas_archive_meta__aacid__trantor_records WHERE primary_id IN %(values)s GROUP BY primary_id', { "values": values })
+            rows = allthethings.utils.aac_sidecar_lookup(cursor, 'trantor_records', 'primary_id', values, group_by_key=True)
+            if rows is None:
+                cursor.execute('SELECT byte_offset, byte_length, primary_id FROM annas_archive_meta__aacid__trantor_records WHERE primary_id IN %(values)s GROUP BY primary_id', { "values": values })
+                rows = list(cursor.fetchall())
         else:
             raise Exception(f"Unexpected 'key' in get_aac_trantor_book_dicts: '{key}'")
     except Exception as err:
@@ -5207,14 +5249,14 @@ def get_aac_trantor_book_dicts(session, key, values):
 
     record_offsets_and_lengths = []
     primary_ids = []
-    for row_index, row in enumerate(list(cursor.fetchall())):
+    for row_index, row in enumerate(rows):
         record_offsets_and_lengths.append((row['byte_offset'], row['byte_length']))
         primary_ids.append(row['primary_id'])
     if len(record_offsets_and_lengths) == 0:
         return []
 
     aac_records_by_primary_id = {}
-    for index, line_bytes in enumerate(allthethings.utils.get_lines_from_aac_file(cursor, 'trantor_records', record_offsets_and_lengths)):
+    for index, line_bytes in enumerate(allthethings.utils.get_lines_from_aac_file(cursor, 'trantor_records', record_offsets_and_lengths, zero_copy=True)):
         aac_record = orjson.loads(line_bytes)
         aac_records_by_primary_id[primary_ids[index]] = aac_record
 
@@ -5541,7 +5583,7 @@ def get_transitive_lookup_dicts(session, lookup_table_name, codes):
     with engine.connect() as connection:
         connection.connection.ping(reconnect=True)
         cursor = connection.connection.cursor(pymysql.cursors.DictCursor)
-        cursor.execute(f'SELECT code, aarecord_id FROM {lookup_table_name} WHERE code IN %(codes)s', { "codes": [':'.join(code).encode() for code in codes] })
+        cursor.execute(f'SELECT code, aarecord_id FROM {allthethings.utils.aarecords_codes_for_lookup_table_name(lookup_table_name)} WHERE code IN %(codes)s', { "codes": [':'.join(code).encode() for code in codes] })
         rows = list(cursor.fetchall())
         codes_by_aarecord_ids = collections.defaultdict(list)
         for row in rows:
@@ -5554,7 +5596,7 @@ def get_transitive_lookup_dicts(session, lookup_table_name, codes):
                     for i in range(4, 13):
                         isbn13_prefixes_to_codes[code[1][0:i]].append(code)
             if len(isbn13_prefixes_to_codes) > 0:
-                cursor.execute(f'SELECT code, aarecord_id FROM aarecords_codes_isbngrp_for_lookup WHERE code IN %(codes)s', { "codes": [f"isbn13_prefix:{isbn13_prefix}".encode() for isbn13_prefix in isbn13_prefixes_to_codes] })
+                cursor.execute(f'SELECT code, aarecord_id FROM {allthethings.utils.aarecords_codes_for_lookup_table_name("aarecords_codes_isbngrp_for_lookup")} WHERE code IN %(codes)s', { "codes": [f"isbn13_prefix:{isbn13_prefix}".encode() for isbn13_prefix in isbn13_prefixes_to_codes] })
                 for row in cursor.fetchall():
                     isbn13_prefix = row['code'].decode().split(':', 1)[-1]
                     for code in isbn13_prefixes_to_codes[isbn13_prefix]:
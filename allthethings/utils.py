@@ -5,10 +5,12 @@ import ipaddress
 import flask
 import functools
 import datetime
+import bisect
 import cachetools
 import babel.numbers
 import babel
 import os
+import fcntl
 import base64
 import base58
 import hashlib
@@ -23,11 +25,14 @@ import indexed_zstd
 import threading
 import traceback
 import time
+import mmap
+import concurrent.futures
+import struct
 
 from flask_babel import gettext, get_babel, force_locale
 
 from allthethings.extensions import es, es_aux, engine
-from config.settings import SECRET_KEY, DOWNLOADS_SECRET_KEY, MEMBERS_TELEGRAM_URL, PAYMENT2_URL, PAYMENT2_API_KEY, PAYMENT2_PROXIES, FAST_PARTNER_SERVER1, HOODPAY_URL, HOODPAY_AUTH, PAYMENT3_DOMAIN, PAYMENT3_KEY, AACID_SMALL_DATA_IMPORTS
+from config.settings import SECRET_KEY, DOWNLOADS_SECRET_KEY, MEMBERS_TELEGRAM_URL, PAYMENT2_URL, PAYMENT2_API_KEY, PAYMENT2_PROXIES, FAST_PARTNER_SERVER1, HOODPAY_URL, HOODPAY_AUTH, PAYMENT3_DOMAIN, PAYMENT3_KEY, AACID_SMALL_DATA_IMPORTS, AAC_BLOCK_CACHE_MAX_BYTES, AAC_SHARED_BLOCK_CACHE_DIR, AAC_SHARED_BLOCK_CACHE_MAX_BYTES
 
 FEATURE_FLAGS = {}
 
@@ -45,6 +50,17 @@ AARECORDS_CODES_CODE_LENGTH = 680
 AARECORDS_CODES_AARECORD_ID_LENGTH = 300
 AARECORDS_CODES_AARECORD_ID_PREFIX_LENGTH = 20
 
+# Blue-green builds (`flask cli elastic_build_aarecords_blue_green`) write the aarecords_codes_*_for_lookup tables
+# under versioned names, and the build itself reads them from there, while pages keep reading the current ones
+# until they are renamed at the swap. Only set in the build processes.
+aarecords_codes_for_lookup_version = None
+
+def aarecords_codes_for_lookup_table_name(table_name, version=None):
+    version = version or aarecords_codes_for_lookup_version
+    if version is None:
+        return table_name
+    return f'{table_name}__{version}'
+
 # Per https://software.annas-archive.li/AnnaArchivist/annas-archive/-/issues/37
 SEARCH_FILTERED_BAD_AARECORD_IDS = [
     "md5:d41d8cd98f00b204e9800998ecf8427e", # md5("")
@@ -1974,46 +1990,614 @@ MARC_DEPRECATED_COUNTRY_CODES = {
 def aac_path_prefix():
     return "/app/aacid_small/" if AACID_SMALL_DATA_IMPORTS else "/file-data/"
 
+# Which of the .jsonl.seekable.zst or the decompressed .jsonl (if present) is faster to read per collection
+# and access pattern, as measured by `flask cli aac_benchmark_read_paths`. Stored next to the AAC files:
+#   { collection: { "sequential": "compressed"|"decompressed", "random": "compressed"|"decompressed" } }
+AAC_READ_PATHS_FILENAME = 'aac_read_paths.json'
+
+def aac_read_paths_config(path_prefix):
+    try:
+        with open(f'{path_prefix}{AAC_READ_PATHS_FILENAME}', 'rb') as config_file:
+            return orjson.loads(config_file.read())
+    except FileNotFoundError:
+        return {}
+
+# Open an AAC file for `access` ("sequential" for indexing, "random" for get_lines_from_aac_file). Uses the
+# decompressed .jsonl if it exists, unless aac_read_paths.json says the compressed file is faster.
+def aac_open_file(full_filepath, access):
+    full_filepath_decompressed = full_filepath.replace('.seekable.zst', '')
+    if os.path.exists(full_filepath_decompressed):
+        path_prefix, filename = full_filepath.rsplit('/', 1)
+        collection = filename.split('__')[2]
+        if aac_read_paths_config(f'{path_prefix}/').get(collection, {}).get(access) != 'compressed':
+            return open(full_filepath_decompressed, 'rb')
+    return indexed_zstd.IndexedZstdFile(full_filepath)
+
 def aac_spot_check_line_bytes(line_bytes, other_info):
     if line_bytes[0:1] != b'{':
         raise Exception(f"Bad JSON (does not start with {{): {line_bytes[0:500]=} {other_info=}")
     if line_bytes[-2:] != b'}\n':
         raise Exception(f"Bad JSON (does not end with }}\\n): {line_bytes[0:500]=} {other_info=}")
 
-# TODO: for a minor speed improvement we can cache the last read block,
-# and then first read the byte offsets within that block.
-aac_file_thread_local = threading.local()
-def get_lines_from_aac_file(cursor, collection, offsets_and_lengths):
-    file_cache = getattr(aac_file_thread_local, 'file_cache', None)
-    if file_cache is None:
-        file_cache = aac_file_thread_local.file_cache = {}
-
-    if collection not in file_cache:
-        cursor.execute('SELECT filename FROM annas_archive_meta_aac_filenames WHERE collection = %(collection)s', { 'collection': collection })
-        filename = cursor.fetchone()['filename']
-        full_filepath = f'{aac_path_prefix()}{filename}'
-        full_filepath_decompressed = full_filepath.replace('.seekable.zst', '')
-        if os.path.exists(full_filepath_decompressed):
-            file_cache[collection] = open(full_filepath_decompressed, 'rb')
+AAC_JSON_STRUCTURE_RE = re.compile(rb'["\[\]{},]')
+
+# Returns the position right after the JSON string starting at `pos` (which must be a quote).
+def aac_json_skip_string(line_bytes, pos):
+    while True:
+        pos = line_bytes.find(b'"', pos + 1)
+        if pos == -1:
+            raise ValueError("Unterminated JSON string")
+        backslashes = 0
+        while line_bytes[pos - 1 - backslashes] == ord('\\'):
+            backslashes += 1
+        if backslashes % 2 == 0:
+            return pos + 1
+
+# Returns the position right after the JSON value starting at `pos`, jumping between quotes and brackets
+# instead of parsing everything in between.
+def aac_json_skip_value(line_bytes, pos):
+    first_char = line_bytes[pos:pos+1]
+    if first_char == b'"':
+        return aac_json_skip_string(line_bytes, pos)
+    depth = 0
+    while True:
+        match = AAC_JSON_STRUCTURE_RE.search(line_bytes, pos)
+        if match is None:
+            raise ValueError("Unterminated JSON value")
+        pos = match.start()
+        char = line_bytes[pos:pos+1]
+        if char == b'"':
+            pos = aac_json_skip_string(line_bytes, pos)
+            continue
+        if char in (b'{', b'['):
+            depth += 1
+        elif depth == 0:
+            # End of a number/true/false/null, or the end of the enclosing object/array.
+            return pos
+        elif char in (b'}', b']'):
+            depth -= 1
+            if depth == 0:
+                return pos + 1
+        pos += 1
+
+# Get a single value from an AAC line (compact JSON, as written by orjson) by its path of object keys, e.g.
+# ('metadata', 'record', 'filename_decoded'), skipping over everything else. Only the value itself is parsed.
+# Returns None if the path doesn't exist. Raises ValueError for lines that are not compact JSON objects.
+#
+# Note that this only pays off when it avoids a full parse for most lines (like when indexing, where most lines
+# don't even contain the key). When reading records for pages and aarecords, just orjson.loads the whole line:
+# on aacid_small, full orjson.loads takes 3-120us per line, while even getting ('metadata', 'date_modified') out
+# of a zlib3 record with this takes ~55us (vs ~6us), and a lazily decoding dict-like view of the line was up
+# to 10x slower than decoding everything, since the skipping happens in Python.
+def aac_json_path_extract(line_bytes, path):
+    pos = 0
+    for key in path:
+        if line_bytes[pos:pos+1] != b'{':
+            return None
+        pos += 1
+        key_bytes = orjson.dumps(key)
+        while True:
+            if line_bytes[pos:pos+1] == b'}':
+                return None
+            if line_bytes[pos:pos+1] != b'"':
+                raise ValueError(f"Expected a JSON key at {pos=}")
+            key_end = aac_json_skip_string(line_bytes, pos)
+            if line_bytes[key_end:key_end+1] != b':':
+                raise ValueError(f"Expected ':' at {key_end=}")
+            key_matches = (line_bytes[pos:key_end] == key_bytes)
+            pos = key_end + 1
+            if key_matches:
+                break
+            pos = aac_json_skip_value(line_bytes, pos)
+            if line_bytes[pos:pos+1] == b',':
+                pos += 1
+    return orjson.loads(line_bytes[pos:aac_json_skip_value(line_bytes, pos)])
+
+# Decompressed blocks of .seekable.zst AAC files, shared by all threads of the process, so that popular
+# records don't get decompressed over and over. Keyed by (collection, filename, block index), so a new
+# file for a collection never gets served blocks of the old one. Bounded by the total size of the blocks,
+# AAC_BLOCK_CACHE_MAX_BYTES per process (0 disables it), so keep the number of processes in mind.
+AAC_BLOCK_CACHE_BLOCK_SIZE = 1024*1024
+aac_block_cache = cachetools.LRUCache(maxsize=AAC_BLOCK_CACHE_MAX_BYTES, getsizeof=len)
+aac_block_cache_lock = threading.Lock()
+aac_block_cache_stats = collections.Counter()
+
+# E.g. for elastic build processes, which mostly read each block once, and of which there are many.
+def aac_block_cache_set_max_bytes(max_bytes):
+    global aac_block_cache
+    with aac_block_cache_lock:
+        aac_block_cache = cachetools.LRUCache(maxsize=max_bytes, getsizeof=len)
+
+def aac_block_cache_info():
+    with aac_block_cache_lock:
+        hits = aac_block_cache_stats['hits']
+        misses = aac_block_cache_stats['misses']
+        shared_hits = aac_block_cache_stats['shared_hits']
+        shared_misses = aac_block_cache_stats['shared_misses']
+        return {
+            "hits": hits, "misses": misses, "hit_rate": (hits / (hits + misses)) if (hits + misses) > 0 else 0.0, "blocks": len(aac_block_cache), "bytes": aac_block_cache.currsize,
+            "shared_enabled": len(AAC_SHARED_BLOCK_CACHE_DIR) > 0, "shared_hits": shared_hits, "shared_misses": shared_misses, "shared_hit_rate": (shared_hits / (shared_hits + shared_misses)) if (shared_hits + shared_misses) > 0 else 0.0,
+        }
+
+# Optional second level behind aac_block_cache, shared by all processes on the host (gunicorn workers, and the
+# processes of the elastic builds), so that each block is decompressed once per host instead of once per process.
+# Enabled by setting AAC_SHARED_BLOCK_CACHE_DIR, ideally to a tmpfs like /dev/shm/aac_block_cache.
+# Blocks are stored as {AAC_SHARED_BLOCK_CACHE_DIR}/{filename}/{block_index}.block, written to a temporary file
+# and renamed, so readers never see partial blocks. Two processes missing the same block at the same time both
+# decompress it, which is harmless. Blocks of old files are never read again and get pruned like any other.
+# The bytes written since the last prune are counted across all processes (in a file in the directory, under
+# flock), and whoever crosses a tenth of AAC_SHARED_BLOCK_CACHE_MAX_BYTES prunes, so the directory stays below
+# about 1.1x the maximum (plus blocks that are being written during a prune), however many processes there are.
+AAC_SHARED_BLOCK_CACHE_COUNTER_NAME = '.bytes_written'
+AAC_SHARED_BLOCK_CACHE_PRUNE_LOCK_NAME = '.prune.lock'
+
+def aac_shared_block_cache_path(filename, block_index):
+    return os.path.join(AAC_SHARED_BLOCK_CACHE_DIR, filename, f'{block_index}.block')
+
+def aac_shared_block_cache_read(filename, block_index):
+    try:
+        with open(aac_shared_block_cache_path(filename, block_index), 'rb') as block_file:
+            return block_file.read()
+    except FileNotFoundError:
+        return None
+
+def aac_shared_block_cache_write(filename, block_index, block):
+    block_path = aac_shared_block_cache_path(filename, block_index)
+    os.makedirs(os.path.dirname(block_path), exist_ok=True)
+    tmp_path = f'{block_path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(tmp_path, 'wb') as block_file:
+        block_file.write(block)
+    os.replace(tmp_path, block_path)
+    if aac_shared_block_cache_add_bytes_written(len(block)):
+        aac_shared_block_cache_prune()
+
+# Add to the bytes written by all processes since the last prune. Returns True (and resets the count) when it's
+# time to prune.
+def aac_shared_block_cache_add_bytes_written(byte_count):
+    counter_fd = os.open(os.path.join(AAC_SHARED_BLOCK_CACHE_DIR, AAC_SHARED_BLOCK_CACHE_COUNTER_NAME), os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(counter_fd, fcntl.LOCK_EX)
+        counter_bytes = os.pread(counter_fd, 8, 0)
+        bytes_written = (int.from_bytes(counter_bytes, 'little') if len(counter_bytes) == 8 else 0) + byte_count
+        should_prune = bytes_written >= AAC_SHARED_BLOCK_CACHE_MAX_BYTES // 10
+        os.pwrite(counter_fd, (0 if should_prune else bytes_written).to_bytes(8, 'little'), 0)
+        return should_prune
+    finally:
+        os.close(counter_fd) # Also releases the flock.
+
+# Remove the oldest written blocks until the directory is below AAC_SHARED_BLOCK_CACHE_MAX_BYTES. Safe to run
+# concurrently with readers and writers. Only one process prunes at a time; if another one already is, this
+# returns right away, since that one will see the blocks written so far too.
+def aac_shared_block_cache_prune(max_bytes=AAC_SHARED_BLOCK_CACHE_MAX_BYTES):
+    os.makedirs(AAC_SHARED_BLOCK_CACHE_DIR, exist_ok=True)
+    prune_lock_fd = os.open(os.path.join(AAC_SHARED_BLOCK_CACHE_DIR, AAC_SHARED_BLOCK_CACHE_PRUNE_LOCK_NAME), os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        try:
+            fcntl.flock(prune_lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return
+        aac_shared_block_cache_prune_locked(max_bytes)
+    finally:
+        os.close(prune_lock_fd)
+
+def aac_shared_block_cache_prune_locked(max_bytes):
+    blocks = []
+    for dirpath, _dirnames, filenames in os.walk(AAC_SHARED_BLOCK_CACHE_DIR):
+        for name in filenames:
+            if name.startswith('.'):
+                # The counter and lock files.
+                continue
+            block_path = os.path.join(dirpath, name)
+            try:
+                stat = os.stat(block_path)
+            except FileNotFoundError:
+                continue
+            if name.endswith('.tmp'):
+                # Leftovers of crashed writers; give live writers some time to finish.
+                if stat.st_mtime < time.time() - 3600:
+                    try:
+                        os.remove(block_path)
+                    except FileNotFoundError:
+                        pass
+                continue
+            blocks.append((stat.st_mtime, stat.st_size, block_path))
+    total_bytes = sum(block[1] for block in blocks)
+    for _mtime, size, block_path in sorted(blocks):
+        if total_bytes <= max_bytes:
+            break
+        try:
+            os.remove(block_path)
+        except FileNotFoundError:
+            pass
+        total_bytes -= size
+
+def aac_read_through_block_cache(file, collection, filename, byte_offset, byte_length):
+    first_block_index = byte_offset // AAC_BLOCK_CACHE_BLOCK_SIZE
+    last_block_index = (byte_offset + byte_length - 1) // AAC_BLOCK_CACHE_BLOCK_SIZE
+    blocks = []
+    for block_index in range(first_block_index, last_block_index + 1):
+        cache_key = (collection, filename, block_index)
+        with aac_block_cache_lock:
+            block = aac_block_cache.get(cache_key)
+            aac_block_cache_stats['misses' if block is None else 'hits'] += 1
+        if block is None:
+            if len(AAC_SHARED_BLOCK_CACHE_DIR) > 0:
+                block = aac_shared_block_cache_read(filename, block_index)
+                with aac_block_cache_lock:
+                    aac_block_cache_stats['shared_misses' if block is None else 'shared_hits'] += 1
+            if block is None:
+                file.seek(block_index * AAC_BLOCK_CACHE_BLOCK_SIZE)
+                block = file.read(AAC_BLOCK_CACHE_BLOCK_SIZE)
+                if len(AAC_SHARED_BLOCK_CACHE_DIR) > 0:
+                    aac_shared_block_cache_write(filename, block_index, block)
+            with aac_block_cache_lock:
+                if len(block) <= aac_block_cache.maxsize:
+                    aac_block_cache[cache_key] = block
+        blocks.append(block)
+    start = byte_offset - first_block_index * AAC_BLOCK_CACHE_BLOCK_SIZE
+    if len(blocks) == 1:
+        return blocks[0][start:start+byte_length]
+    return b''.join(blocks)[start:start+byte_length]
+
+# The rows of annas_archive_meta_aac_filenames, shared by all threads of the process. Re-read at most every
+# AAC_FILENAMES_CHECK_INTERVAL seconds (one query for all collections); when anything changed (e.g. after
+# `flask cli mysql_build_aac_tables` picked up a newer file, or a file was replaced), the generation is
+# bumped and open files and sidecars are dropped, so workers switch to the new files without a restart.
+AAC_FILENAMES_CHECK_INTERVAL = 60
+aac_filenames_state = { "generation": 0, "rows": None, "file_ids": None, "checked_at": 0.0 }
+aac_filenames_lock = threading.Lock()
+
+def aac_refresh_filename_rows(cursor, force=False):
+    with aac_filenames_lock:
+        if (not force) and aac_filenames_state['rows'] is not None and time.monotonic() - aac_filenames_state['checked_at'] < AAC_FILENAMES_CHECK_INTERVAL:
+            return
+        # Claim this check, so that other threads don't run the same query meanwhile.
+        aac_filenames_state['checked_at'] = time.monotonic()
+    cursor.execute('SELECT * FROM annas_archive_meta_aac_filenames')
+    rows = { row['collection']: dict(row) for row in cursor.fetchall() }
+    # Files can also be replaced under the same name (see `flask cli aac_reframe`).
+    file_ids = {}
+    for row in rows.values():
+        try:
+            stat = os.stat(f"{aac_path_prefix()}{row['filename']}")
+            file_ids[row['filename']] = (stat.st_ino, stat.st_mtime_ns)
+        except FileNotFoundError:
+            pass
+    with aac_filenames_lock:
+        if rows == aac_filenames_state['rows'] and file_ids == aac_filenames_state['file_ids']:
+            return
+        aac_filenames_state['rows'] = rows
+        aac_filenames_state['file_ids'] = file_ids
+        aac_filenames_state['generation'] += 1
+    with aac_open_files_lock:
+        # Idle handles are closed; handles in use are closed when they're checked back in (see aac_checkin_file).
+        # Mmaps are just dropped, since zero_copy lines might still point into them.
+        for entry in aac_open_files.values():
+            if isinstance(entry, list):
+                for file in entry:
+                    file.close()
+        aac_open_files.clear()
+        aac_open_files_state['generation'] += 1
+    with aac_sidecar_cache_lock:
+        aac_sidecar_cache.clear()
+
+def get_aac_filename_row(cursor, collection):
+    aac_refresh_filename_rows(cursor)
+    filename_row = aac_filenames_state['rows'].get(collection)
+    if filename_row is None:
+        # Collection might have been added since the last check; don't wait for AAC_FILENAMES_CHECK_INTERVAL.
+        aac_refresh_filename_rows(cursor, force=True)
+        filename_row = aac_filenames_state['rows'][collection]
+    return filename_row
+
+# Open AAC files, shared by all threads of the process: { filename: mmap or [idle handles] }. Decompressed files
+# are memory-mapped once (slicing an mmap is thread-safe, and reads are served from the page cache without syscalls).
+# Other files (like IndexedZstdFile, which holds the seek table that was loaded when opening it) are checked
+# out by one thread at a time. Dropped when forking, since forked handles share their file position.
+# Checked out handles are tagged with the generation of aac_open_files: { id(file): generation }, so that
+# handles that were in use while the files got refreshed are closed instead of being put back.
+aac_open_files = {}
+aac_open_files_pid = os.getpid()
+aac_open_files_state = { "generation": 0, "checked_out_generations": {} }
+aac_open_files_lock = threading.Lock()
+
+def aac_checkout_file(filename):
+    global aac_open_files_pid
+    with aac_open_files_lock:
+        if aac_open_files_pid != os.getpid():
+            aac_open_files.clear()
+            aac_open_files_state['checked_out_generations'].clear()
+            aac_open_files_state['generation'] += 1
+            aac_open_files_pid = os.getpid()
+        generation = aac_open_files_state['generation']
+        entry = aac_open_files.get(filename)
+        if isinstance(entry, mmap.mmap):
+            return entry
+        if entry:
+            file = entry.pop()
+            aac_open_files_state['checked_out_generations'][id(file)] = generation
+            return file
+    file = aac_open_file(f'{aac_path_prefix()}{filename}', 'random')
+    if (not isinstance(file, indexed_zstd.IndexedZstdFile)) and os.fstat(file.fileno()).st_size > 0:
+        with file:
+            file = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        with aac_open_files_lock:
+            # Another thread might have been faster.
+            if not isinstance(aac_open_files.get(filename), mmap.mmap):
+                aac_open_files[filename] = file
+            return aac_open_files[filename]
+    with aac_open_files_lock:
+        # The generation from before opening, so that a file opened during a refresh counts as outdated.
+        aac_open_files_state['checked_out_generations'][id(file)] = generation
+    return file
+
+def aac_checkin_file(filename, file):
+    if isinstance(file, mmap.mmap):
+        return
+    with aac_open_files_lock:
+        generation = aac_open_files_state['checked_out_generations'].pop(id(file), None)
+        if aac_open_files_pid == os.getpid() and generation == aac_open_files_state['generation'] and isinstance(aac_open_files.get(filename, []), list):
+            aac_open_files.setdefault(filename, []).append(file)
+            return
+    file.close()
+
+# Open the files of all collections ahead of time (`handles_per_file` handles for files that can't be shared
+# between threads), so that the first requests don't have to. Run when a worker starts. More handles are
+# opened on demand, when all of them are checked out.
+def aac_warm_up(cursor, handles_per_file=1):
+    aac_refresh_filename_rows(cursor, force=True)
+    for filename_row in list(aac_filenames_state['rows'].values()):
+        if not os.path.exists(f"{aac_path_prefix()}{filename_row['filename']}"):
+            continue
+        files = [aac_checkout_file(filename_row['filename']) for _ in range(handles_per_file)]
+        for file in files:
+            aac_checkin_file(filename_row['filename'], file)
+
+# Requested lines that are at most this many bytes apart are read with a single read (up to a total of
+# AAC_COALESCE_MAX_SPAN bytes), and then split up again. Pass max_gap=None to read every line separately.
+AAC_COALESCE_MAX_GAP = 16*1024
+AAC_COALESCE_MAX_SPAN = 4*1024*1024
+
+# Group sorted (byte_offset, byte_length, index) tuples into [(span_start, span_end, [(byte_offset, byte_length, index), ...]), ...].
+def aac_coalesce_ranges(sorted_offsets_lengths_indexes, max_gap=AAC_COALESCE_MAX_GAP, max_span=AAC_COALESCE_MAX_SPAN):
+    spans = []
+    for byte_offset, byte_length, index in sorted_offsets_lengths_indexes:
+        if len(spans) > 0 and max_gap is not None and byte_offset - spans[-1][1] <= max_gap and byte_offset + byte_length - spans[-1][0] <= max_span:
+            spans[-1][1] = max(spans[-1][1], byte_offset + byte_length)
+            spans[-1][2].append((byte_offset, byte_length, index))
+        else:
+            spans.append([byte_offset, byte_offset + byte_length, [(byte_offset, byte_length, index)]])
+    return spans
+
+# With `zero_copy`, lines from memory-mapped (decompressed) files are returned as memoryview slices of the
+# mmap instead of bytes. Those work for orjson.loads, but not for everything bytes can do (e.g. `in` or
+# .decode()), so only pass it when the lines only get parsed. Lines from other files are always bytes.
+def get_lines_from_aac_file(cursor, collection, offsets_and_lengths, zero_copy=False, max_gap=AAC_COALESCE_MAX_GAP):
+    filename = get_aac_filename_row(cursor, collection)['filename']
+    return aac_read_lines_from_filename(collection, filename, offsets_and_lengths, zero_copy=zero_copy, max_gap=max_gap)
+
+def aac_read_lines_from_filename(collection, filename, offsets_and_lengths, zero_copy=False, max_gap=AAC_COALESCE_MAX_GAP):
+    file = aac_checkout_file(filename)
+    try:
+        return aac_read_lines(file, collection, filename, offsets_and_lengths, zero_copy=zero_copy, max_gap=max_gap)
+    finally:
+        aac_checkin_file(filename, file)
+
+# Like get_lines_from_aac_file, but for several collections at once: { collection: offsets_and_lengths } =>
+# { collection: lines }. The collections are read in parallel on a small thread pool, so the disk-bound part
+# takes about as long as the slowest collection instead of the sum. Results are the same as calling
+# get_lines_from_aac_file for each collection. The fetchers read at most two collections per batch, so two
+# threads are enough. Turned off for index builds (see elastic_build_aarecords_job_init_pool), which already
+# run a process per core.
+AAC_FETCH_THREADS = 2
+aac_fetch_in_parallel = True
+aac_fetch_executor = None
+aac_fetch_executor_pid = None
+aac_fetch_executor_lock = threading.Lock()
+
+def get_lines_from_aac_files(cursor, offsets_and_lengths_by_collection, zero_copy=False, max_gap=AAC_COALESCE_MAX_GAP):
+    global aac_fetch_executor, aac_fetch_executor_pid
+    # The cursor is only used from this thread.
+    filenames_by_collection = { collection: get_aac_filename_row(cursor, collection)['filename'] for collection, offsets_and_lengths in offsets_and_lengths_by_collection.items() if len(offsets_and_lengths) > 0 }
+    lines_by_collection = { collection: [] for collection in offsets_and_lengths_by_collection }
+    if len(filenames_by_collection) <= 1 or (not aac_fetch_in_parallel):
+        for collection, filename in filenames_by_collection.items():
+            lines_by_collection[collection] = aac_read_lines_from_filename(collection, filename, offsets_and_lengths_by_collection[collection], zero_copy=zero_copy, max_gap=max_gap)
+        return lines_by_collection
+
+    with aac_fetch_executor_lock:
+        # Threads don't survive a fork (e.g. of ProcessPoolExecutor workers), so create the pool per process.
+        if aac_fetch_executor_pid != os.getpid():
+            aac_fetch_executor = concurrent.futures.ThreadPoolExecutor(max_workers=AAC_FETCH_THREADS, thread_name_prefix='aac_fetch')
+            aac_fetch_executor_pid = os.getpid()
+    futures_by_collection = {}
+    for collection, filename in filenames_by_collection.items():
+        futures_by_collection[collection] = aac_fetch_executor.submit(aac_read_lines_from_filename, collection, filename, offsets_and_lengths_by_collection[collection], zero_copy=zero_copy, max_gap=max_gap)
+    for collection, future in futures_by_collection.items():
+        lines_by_collection[collection] = future.result()
+    return lines_by_collection
+
+# Whether to tell the kernel up front which parts of the file a batch is going to read, so that it can fetch
+# them all at once (helps a lot on spinning disks and network block devices when the page cache is cold).
+# Only set for index builds (see elastic_build_aarecords_job_init_pool), since the random reads of the
+# website don't benefit.
+aac_readahead = False
+
+# The frames of a .seekable.zst file from its seek table, as (decompressed_starts, compressed_starts, compressed_size),
+# both sorted. Keyed by the file's identity on disk, since getting block_offsets() isn't free for large files.
+aac_zstd_frames_cache = cachetools.LRUCache(maxsize=256)
+aac_zstd_frames_cache_lock = threading.Lock()
+
+def aac_zstd_frames(file):
+    stat = os.fstat(file.fileno())
+    cache_key = (stat.st_dev, stat.st_ino, stat.st_mtime_ns)
+    with aac_zstd_frames_cache_lock:
+        frames = aac_zstd_frames_cache.get(cache_key)
+    if frames is None:
+        compressed_and_decompressed_starts = sorted(file.block_offsets().items(), key=lambda item: item[1])
+        frames = ([item[1] for item in compressed_and_decompressed_starts], [item[0] for item in compressed_and_decompressed_starts], stat.st_size)
+        with aac_zstd_frames_cache_lock:
+            aac_zstd_frames_cache[cache_key] = frames
+    return frames
+
+# Compressed byte ranges [(start, end), ...] of the frames that hold the decompressed spans, merged where adjacent.
+def aac_zstd_compressed_ranges(frames, spans):
+    decompressed_starts, compressed_starts, compressed_size = frames
+    ranges = []
+    for span_start, span_end, _span_offsets_lengths_indexes in spans:
+        first_frame = max(0, bisect.bisect_right(decompressed_starts, span_start) - 1)
+        end_frame = bisect.bisect_left(decompressed_starts, span_end)
+        range_start = compressed_starts[first_frame]
+        range_end = compressed_starts[end_frame] if end_frame < len(compressed_starts) else compressed_size
+        if len(ranges) > 0 and range_start <= ranges[-1][1]:
+            ranges[-1] = (ranges[-1][0], max(ranges[-1][1], range_end))
+        else:
+            ranges.append((range_start, range_end))
+    return ranges
+
+def aac_readahead_hint(file, spans):
+    try:
+        if isinstance(file, mmap.mmap):
+            for span_start, span_end, _span_offsets_lengths_indexes in spans:
+                page_start = span_start - (span_start % mmap.PAGESIZE)
+                file.madvise(mmap.MADV_WILLNEED, page_start, span_end - page_start)
+        elif isinstance(file, indexed_zstd.IndexedZstdFile):
+            # Map the spans (widened to the aac_block_cache blocks that will actually be read) to the frames they're
+            # in with the seek table, and ask for those compressed bytes.
+            if not file.block_offsets_complete():
+                os.posix_fadvise(file.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+                return
+            block_spans = [(span_start - (span_start % AAC_BLOCK_CACHE_BLOCK_SIZE), span_end + (-span_end % AAC_BLOCK_CACHE_BLOCK_SIZE), None) for span_start, span_end, _span_offsets_lengths_indexes in spans]
+            for range_start, range_end in aac_zstd_compressed_ranges(aac_zstd_frames(file), block_spans):
+                os.posix_fadvise(file.fileno(), range_start, range_end - range_start, os.POSIX_FADV_WILLNEED)
         else:
-            file_cache[collection] = indexed_zstd.IndexedZstdFile(full_filepath)
-    file = file_cache[collection]
+            for span_start, span_end, _span_offsets_lengths_indexes in spans:
+                os.posix_fadvise(file.fileno(), span_start, span_end - span_start, os.POSIX_FADV_WILLNEED)
+    except (AttributeError, OSError):
+        # Not supported on this platform; these are only hints anyway.
+        pass
+
+# `file` is an mmap, an IndexedZstdFile (read through aac_block_cache), or a regular file.
+def aac_read_lines(file, collection, filename, offsets_and_lengths, zero_copy=False, max_gap=AAC_COALESCE_MAX_GAP, readahead=None):
+    sorted_offsets_lengths_indexes = sorted([(row[0], row[1], index) for index, row in enumerate(offsets_and_lengths)])
+    if (aac_readahead if readahead is None else readahead) and len(sorted_offsets_lengths_indexes) > 0:
+        aac_readahead_hint(file, aac_coalesce_ranges(sorted_offsets_lengths_indexes, max_gap=max_gap))
+    if isinstance(file, mmap.mmap):
+        # Nothing to coalesce, since slicing an mmap doesn't do any reads.
+        file_view = memoryview(file) if zero_copy else file
+        spans = [(0, len(file), sorted_offsets_lengths_indexes)]
+    else:
+        spans = aac_coalesce_ranges(sorted_offsets_lengths_indexes, max_gap=max_gap)
 
     lines = [None]*len(offsets_and_lengths)
-    for byte_offset, byte_length, index in sorted([(row[0], row[1], index) for index, row in enumerate(offsets_and_lengths)]):
-        file.seek(byte_offset)
-        line_bytes = file.read(byte_length)
-        if len(line_bytes) != byte_length:
-            raise Exception(f"Invalid {len(line_bytes)=} != {byte_length=}")
-        aac_spot_check_line_bytes(line_bytes, (byte_offset, byte_length, index))
-        # Uncomment to fully verify JSON after read.
-        # try:
-        #     orjson.loads(line_bytes)
-        # except:
-        #     raise Exception(f"Bad JSON: {collection=} {byte_offset=} {byte_length=} {index=} {line_bytes=}")
-        lines[index] = line_bytes
+    for span_start, span_end, span_offsets_lengths_indexes in spans:
+        if isinstance(file, indexed_zstd.IndexedZstdFile):
+            # Decompressed files are cached well enough by the OS.
+            span_bytes = aac_read_through_block_cache(file, collection, filename, span_start, span_end - span_start)
+        elif not isinstance(file, mmap.mmap):
+            file.seek(span_start)
+            span_bytes = file.read(span_end - span_start)
+        if not isinstance(file, mmap.mmap):
+            file_view = memoryview(span_bytes) if len(span_offsets_lengths_indexes) > 1 else span_bytes
+
+        for byte_offset, byte_length, index in span_offsets_lengths_indexes:
+            line_bytes = file_view[byte_offset-span_start:byte_offset-span_start+byte_length]
+            if len(line_bytes) != byte_length:
+                raise Exception(f"Invalid {len(line_bytes)=} != {byte_length=}")
+            aac_spot_check_line_bytes(line_bytes, (byte_offset, byte_length, index))
+            # Uncomment to fully verify JSON after read.
+            # try:
+            #     orjson.loads(line_bytes)
+            # except:
+            #     raise Exception(f"Bad JSON: {collection=} {byte_offset=} {byte_length=} {index=} {line_bytes=}")
+            # Slices of coalesced reads are only memoryviews to avoid copying them twice.
+            if isinstance(line_bytes, memoryview) and not (zero_copy and isinstance(file, mmap.mmap)):
+                line_bytes = line_bytes.tobytes()
+            lines[index] = line_bytes
     return lines
 
+# Sidecar index: a file next to the AAC file with one fixed-width record per row of the
+# annas_archive_meta__aacid__* table, sorted by key_column, so that it can be memory-mapped and
+# binary searched instead of querying MySQL for the byte_offset/byte_length. Keys are padded with
+# NUL bytes to key_width. Written by mysql_build_aac_tables --sidecar-index.
+AAC_SIDECAR_MAGIC = b'AACSIDE1'
+AAC_SIDECAR_HEADER = struct.Struct('<8sQQQ') # magic, key_width, record_count, indexed_bytes
+AAC_SIDECAR_VALUE = struct.Struct('<QQ') # byte_offset, byte_length
+AAC_SIDECAR_KEY_COLUMNS = ['primary_id', 'md5']
+# Only these are looked up by md5 through the sidecar; the other md5 lookups join on columns
+# that aren't in the sidecar (e.g. zlib3_files.primary_id, duxiu_files.md5), so they stay in MySQL.
+AAC_SIDECAR_MD5_COLLECTIONS = ['upload_records']
+
+def aac_sidecar_key_columns(collection):
+    return [key_column for key_column in AAC_SIDECAR_KEY_COLUMNS if key_column != 'md5' or collection in AAC_SIDECAR_MD5_COLLECTIONS]
+
+def aac_sidecar_path(filename, key_column):
+    return f"{aac_path_prefix()}{filename.replace('.jsonl.seekable.zst', '')}.{key_column}.idx"
+
+# Returns a dict with the mmap and header fields, or None if there is no sidecar file.
+def aac_sidecar_open(filepath):
+    try:
+        with open(filepath, 'rb') as file:
+            sidecar_mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    except (FileNotFoundError, ValueError): # ValueError for empty files.
+        return None
+    magic, key_width, record_count, indexed_bytes = AAC_SIDECAR_HEADER.unpack_from(sidecar_mmap, 0)
+    if magic != AAC_SIDECAR_MAGIC:
+        raise Exception(f"Invalid sidecar index {filepath=} {magic=}")
+    record_width = key_width + AAC_SIDECAR_VALUE.size
+    if len(sidecar_mmap) != AAC_SIDECAR_HEADER.size + record_count*record_width:
+        raise Exception(f"Invalid sidecar index size {filepath=} {len(sidecar_mmap)=} {record_count=} {record_width=}")
+    return { "mmap": sidecar_mmap, "key_width": key_width, "record_width": record_width, "record_count": record_count, "indexed_bytes": indexed_bytes }
+
+def aac_sidecar_key(sidecar, index):
+    start = AAC_SIDECAR_HEADER.size + index*sidecar['record_width']
+    return sidecar['mmap'][start:start+sidecar['key_width']]
+
+# Returns [(byte_offset, byte_length), ...] of all records with `value` as key, in byte_offset order.
+def aac_sidecar_search(sidecar, value):
+    key = value.encode()
+    if len(key) > sidecar['key_width']:
+        return []
+    key = key.ljust(sidecar['key_width'], b'\0')
+    low = 0
+    high = sidecar['record_count']
+    while low < high:
+        middle = (low + high) // 2
+        if aac_sidecar_key(sidecar, middle) < key:
+            low = middle + 1
+        else:
+            high = middle
+    results = []
+    while low < sidecar['record_count'] and aac_sidecar_key(sidecar, low) == key:
+        results.append(AAC_SIDECAR_VALUE.unpack_from(sidecar['mmap'], AAC_SIDECAR_HEADER.size + low*sidecar['record_width'] + sidecar['key_width']))
+        low += 1
+    return results
+
+aac_sidecar_cache = {}
+aac_sidecar_cache_lock = threading.Lock()
+# Look up `values` in the sidecar index of the collection. Returns rows like those of
+# `SELECT {key_column}, byte_offset, byte_length FROM annas_archive_meta__aacid__{collection} WHERE {key_column} IN %(values)s`
+# (only the first row per value with `group_by_key`, like GROUP BY), or None if there is no usable sidecar,
+# in which case the caller should query MySQL.
+def aac_sidecar_lookup(cursor, collection, key_column, values, group_by_key=False):
+    filename_row = get_aac_filename_row(cursor, collection)
+    filepath = aac_sidecar_path(filename_row['filename'], key_column)
+    with aac_sidecar_cache_lock:
+        if filepath not in aac_sidecar_cache:
+            aac_sidecar_cache[filepath] = aac_sidecar_open(filepath)
+        sidecar = aac_sidecar_cache[filepath]
+    # Only trust a sidecar that was written for the table contents that were recorded along with this file.
+    if sidecar is None or sidecar['indexed_bytes'] != filename_row.get('indexed_bytes'):
+        return None
+
+    rows = []
+    for value in dict.fromkeys([str(value) for value in values]):
+        for byte_offset, byte_length in aac_sidecar_search(sidecar, value):
+            rows.append({ key_column: value, "byte_offset": byte_offset, "byte_length": byte_length })
+            if group_by_key:
+                break
+    return rows
+
 def aa_currently_seeding(metadata):
     return ((datetime.datetime.now(datetime.timezone.utc) - datetime.datetime.strptime(metadata['seeding_at'], "%Y-%m-%dT%H:%M:%S%z")) < datetime.timedelta(days=7)) if ('seeding_at' in metadata) else False
 
@@ -18,3 +18,14 @@ reload = bool(strtobool(os.getenv("WEB_RELOAD", "false")))
 
 if reload:
     reload_extra_files = glob('/app/allthethings/translations/**/*.mo', recursive=True)
+
+def post_worker_init(worker):
+    # Open the AAC files before the first requests come in. Just one handle per file, since opening an
+    # IndexedZstdFile loads its seek table; more are opened as threads need them.
+    import allthethings.utils
+    from allthethings.extensions import engine
+    try:
+        with engine.connect() as connection:
+            allthethings.utils.aac_warm_up(allthethings.utils.get_cursor_ping_conn(connection))
+    except Exception as err:
+        print(f"Warning: AAC warm-up failed, files will be opened on first use: {err}")
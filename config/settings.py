@@ -51,6 +51,12 @@ else:
 
 SLOW_DATA_IMPORTS = str(os.getenv("SLOW_DATA_IMPORTS", "")).lower() in ["1","true"]
 AACID_SMALL_DATA_IMPORTS = str(os.getenv("AACID_SMALL_DATA_IMPORTS", "")).lower() in ["1","true"]
+AAC_BLOCK_CACHE_MAX_BYTES = int(os.getenv("AAC_BLOCK_CACHE_MAX_BYTES", str(128*1024*1024)))
+AAC_BLOCK_CACHE_MAX_BYTES_FOR_BUILDS = int(os.getenv("AAC_BLOCK_CACHE_MAX_BYTES_FOR_BUILDS", str(4*1024*1024)))
+AAC_SHARED_BLOCK_CACHE_DIR = os.getenv("AAC_SHARED_BLOCK_CACHE_DIR", "")
+AAC_SHARED_BLOCK_CACHE_MAX_BYTES = int(os.getenv("AAC_SHARED_BLOCK_CACHE_MAX_BYTES", str(4*1024*1024*1024)))
+AAC_READAHEAD_FOR_BUILDS = str(os.getenv("AAC_READAHEAD_FOR_BUILDS", "true")).lower() in ["1","true"]
+AARECORDS_BUILD_TEMP_DIR = os.getenv("AARECORDS_BUILD_TEMP_DIR", "")
 
 FLASK_DEBUG = str(os.getenv("FLASK_DEBUG", "")).lower() in ["1","true"]
 DEBUG_TB_INTERCEPT_REDIRECTS = False
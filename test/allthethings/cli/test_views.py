@@ -0,0 +1,136 @@
+import pathlib
+import re
+
+import indexed_zstd
+import orjson
+
+AACID_SMALL_PATH = pathlib.Path(__file__).parents[3] / 'aacid_small'
+
+# The original per-line parser of mysql_build_aac_tables, kept as the reference for aac_build_insert_data_for_lines.
+def aac_build_insert_data_reference(collection, line, byte_offset):
+    from allthethings.cli.views import AAC_COLLECTIONS_WITH_MULTIPLE_MD5, AAC_NEXUSSTC_BAD_RECORD
+    from allthethings.utils import validate_canonical_md5s
+
+    # Parse "canonical AAC" more efficiently than parsing all the JSON
+    matches = re.match(rb'\{"aacid":"([^"]+)",("data_folder":"([^"]+)",)?"metadata":\{"[^"]+":([^,]+),("md5":"([^"]+)")?', line)
+    if matches is None:
+        raise Exception(f"Line is not in canonical AAC format: '{line}'")
+    aacid = matches[1]
+    # data_folder = matches[3]
+    primary_id = matches[4].replace(b'"', b'')
+
+    if collection == 'worldcat':
+        if (b'not_found_title_json' in line) or (b'redirect_title_json' in line):
+            return None
+    elif collection == 'nexusstc_records':
+        if b'"type":["wiki"]' in line:
+            return None
+        if line.startswith(AAC_NEXUSSTC_BAD_RECORD):
+            # Bad record
+            return None
+    elif collection == 'ebscohost_records':
+        ebscohost_matches = re.search(rb'"plink":"https://search\.ebscohost\.com/login\.aspx\?direct=true\\u0026db=edsebk\\u0026AN=([0-9]+)\\u0026site=ehost-live"', line)
+        if ebscohost_matches is None:
+            raise Exception(f"Incorrect ebscohost line: '{line}'")
+        primary_id = ebscohost_matches[1]
+    elif collection == 'goodreads_records':
+        if line.endswith(b',"record":""}}\n'):
+            # Bad record
+            return None
+
+    md5 = matches[6]
+    if ('duxiu_files' in collection and b'"original_md5"' in line):
+        # For duxiu_files, md5 is the primary id, so we stick original_md5 in the md5 column so we can query that as well.
+        original_md5_matches = re.search(rb'"original_md5":"([^"]+)"', line)
+        if original_md5_matches is None:
+            raise Exception(f"'original_md5' found, but not in an expected format! '{line}'")
+        md5 = original_md5_matches[1]
+    elif md5 is None:
+        if b'"md5_reported"' in line:
+            md5_reported_matches = re.search(rb'"md5_reported":"([^"]+)"', line)
+            if md5_reported_matches is None:
+                raise Exception(f"'md5_reported' found, but not in an expected format! '{line}'")
+            md5 = md5_reported_matches[1]
+    if (md5 is not None) and (not bool(re.match(rb"^[a-f\d]{32}$", md5))):
+        # Remove if it's not md5.
+        md5 = None
+
+    multiple_md5s = []
+    if collection in AAC_COLLECTIONS_WITH_MULTIPLE_MD5:
+        multiple_md5s = [md5 for md5 in dict.fromkeys([md5.decode().lower() for md5 in re.findall(rb'"md5":"([^"]+)"', line)]) if validate_canonical_md5s([md5])]
+
+    return_data = {
+        'aacid': aacid.decode(),
+        'primary_id': primary_id.decode(),
+        'md5': md5.decode().lower() if md5 is not None else None,
+        'multiple_md5s': multiple_md5s,
+        'byte_offset': byte_offset,
+        'byte_length': len(line),
+    }
+
+    if collection == 'duxiu_records':
+        return_data['filename_decoded_basename'] = None
+        if b'"filename_decoded"' in line:
+            json = orjson.loads(line)
+            filename_decoded = json['metadata']['record']['filename_decoded']
+            return_data['filename_decoded_basename'] = filename_decoded.rsplit('.', 1)[0]
+    return return_data
+
+def test_aac_build_insert_data_for_lines_matches_aac_build_insert_data_reference(monkeypatch):
+    """The chunk scanner should produce exactly the rows of the per-line regex parser, for every aacid_small collection."""
+    # Doesn't need the app (or a database), just the settings that are required to import it.
+    monkeypatch.setenv('SECRET_KEY', "a_very_insecure_key_for_test_padded")
+    monkeypatch.setenv('DOWNLOADS_SECRET_KEY', "a_very_insecure_key_for_test_padded")
+    from allthethings.cli.views import aac_build_insert_data_for_lines
+
+    filepaths = sorted(AACID_SMALL_PATH.glob('annas_archive_meta__aacid__*.jsonl.seekable.zst'))
+    assert len(filepaths) > 0
+    for filepath in filepaths:
+        collection = filepath.name.split('__')[2]
+        lines = indexed_zstd.IndexedZstdFile(str(filepath)).readlines()
+
+        expected_insert_data = []
+        expected_insert_data_multiple_md5s = []
+        byte_offset = 0
+        for line in lines:
+            row = aac_build_insert_data_reference(collection, line, byte_offset)
+            byte_offset += len(line)
+            if row is None:
+                continue
+            for md5 in row.pop('multiple_md5s'):
+                expected_insert_data_multiple_md5s.append({ "md5": md5, "aacid": row['aacid'] })
+            expected_insert_data.append(row)
+
+        insert_data, insert_data_multiple_md5s, bytes_in_chunk, last_line = aac_build_insert_data_for_lines(collection, filepath.name, lines, 0)
+        assert insert_data == expected_insert_data, collection
+        assert insert_data_multiple_md5s == expected_insert_data_multiple_md5s, collection
+        assert bytes_in_chunk == byte_offset, collection
+        assert last_line == (byte_offset - len(lines[-1]), lines[-1].split(b'"', 4)[3].decode()), collection
+
+def test_aac_json_path_extract_matches_orjson(monkeypatch):
+    """Extracting a path should give the same value as a full orjson.loads, for every key path in the aacid_small lines."""
+    monkeypatch.setenv('SECRET_KEY', "a_very_insecure_key_for_test_padded")
+    monkeypatch.setenv('DOWNLOADS_SECRET_KEY', "a_very_insecure_key_for_test_padded")
+    from allthethings.utils import aac_json_path_extract
+
+    # Escapes, nested objects/arrays, and missing keys, on top of the fixtures.
+    lines = [
+        b'{"aacid":"a\\"b\\\\","metadata":{"x\\"y":[{"z":"]}"}],"record":{"list":[[1,2],[3]],"s":"\\u00e9\\\\"},"n":-1.5e3,"t":true,"u":null}}\n',
+    ]
+    for filepath in sorted(AACID_SMALL_PATH.glob('annas_archive_meta__aacid__*.jsonl.seekable.zst')):
+        lines += indexed_zstd.IndexedZstdFile(str(filepath)).readlines()[0:20]
+
+    def all_paths(value, path):
+        yield path
+        if isinstance(value, dict):
+            for key, child_value in value.items():
+                yield from all_paths(child_value, path + (key,))
+
+    for line in lines:
+        record = orjson.loads(line)
+        for path in all_paths(record, ()):
+            expected_value = record
+            for key in path:
+                expected_value = expected_value[key]
+            assert aac_json_path_extract(line, path) == expected_value, (line, path)
+            assert aac_json_path_extract(line, path + ('missing_key',)) is None, (line, path)
@@ -5,3 +5,50 @@ def test_home_page(client):
     response = client.get(url_for("page.home_page"))
 
     assert response.status_code == 200
+
+def test_get_aac_czech_oo42hcks_book_dicts_from_aacid_small(monkeypatch):
+    """Fetching records from the decompressed (mmap, zero_copy) and compressed files should give the same book dicts."""
+    # Doesn't need the app (or a database), just the settings that are required to import it.
+    monkeypatch.setenv('SECRET_KEY', "a_very_insecure_key_for_test_padded")
+    monkeypatch.setenv('DOWNLOADS_SECRET_KEY', "a_very_insecure_key_for_test_padded")
+    import pathlib
+    import types
+
+    import indexed_zstd
+
+    import allthethings.utils
+    from allthethings.cli.views import aac_build_insert_data_for_lines
+    from allthethings.page.views import get_aac_czech_oo42hcks_book_dicts
+
+    aacid_small_path = pathlib.Path(__file__).parents[3] / 'aacid_small'
+    filepath = next(aacid_small_path.glob('annas_archive_meta__aacid__czech_oo42hcks_records__*.jsonl.seekable.zst'))
+    insert_data = aac_build_insert_data_for_lines('czech_oo42hcks_records', filepath.name, indexed_zstd.IndexedZstdFile(str(filepath)).readlines(), 0)[0]
+    primary_ids = [row['primary_id'] for row in insert_data]
+
+    class FakeCursor:
+        def execute(self, query, params=None):
+            if 'annas_archive_meta_aac_filenames' in query:
+                self.rows = [{ "collection": 'czech_oo42hcks_records', "filename": filepath.name, "indexed_bytes": None, "last_aacid": None, "last_byte_offset": None }]
+            else:
+                self.rows = [{ "byte_offset": row['byte_offset'], "byte_length": row['byte_length'], "primary_id": row['primary_id'] } for row in insert_data if row['primary_id'] in params['values']]
+        def fetchall(self):
+            return self.rows
+    class FakeConnection:
+        def ping(self, reconnect=True):
+            pass
+        def cursor(self, cursor_class=None):
+            return FakeCursor()
+    class FakeSession:
+        def connection(self):
+            return types.SimpleNamespace(connection=FakeConnection())
+
+    monkeypatch.setattr(allthethings.utils, 'aac_path_prefix', lambda: f'{aacid_small_path}/')
+    book_dicts_by_read_path = {}
+    for read_path in ['decompressed', 'compressed']:
+        monkeypatch.setattr(allthethings.utils, 'aac_read_paths_config', lambda path_prefix: { 'czech_oo42hcks_records': { 'random': read_path } })
+        allthethings.utils.aac_open_files.clear()
+        allthethings.utils.aac_refresh_filename_rows(FakeCursor(), force=True)
+        book_dicts_by_read_path[read_path] = get_aac_czech_oo42hcks_book_dicts(FakeSession(), 'czech_oo42hcks_id', primary_ids)
+
+    assert sorted(book_dict['czech_oo42hcks_id'] for book_dict in book_dicts_by_read_path['compressed']) == sorted(primary_ids)
+    assert book_dicts_by_read_path['decompressed'] == book_dicts_by_read_path['compressed']
@@ -5,5 +5,8 @@
 CREATE TABLE `annas_archive_meta_aac_filenames` (
   `collection` varchar(250) NOT NULL,
   `filename` varchar(250) NOT NULL,
+  `indexed_bytes` bigint(20) DEFAULT NULL,
+  `last_aacid` varchar(250) CHARACTER SET ascii COLLATE ascii_general_ci DEFAULT NULL,
+  `last_byte_offset` bigint(20) DEFAULT NULL,
   PRIMARY KEY (`collection`)
 ) ENGINE=MyISAM DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_bin;
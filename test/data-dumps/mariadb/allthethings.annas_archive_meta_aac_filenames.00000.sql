@@ -2,24 +2,24 @@
 /*!40014 SET FOREIGN_KEY_CHECKS=0*/;
 /*!40101 SET SQL_MODE='NO_AUTO_VALUE_ON_ZERO,ERROR_FOR_DIVISION_BY_ZERO,NO_AUTO_CREATE_USER,NO_ENGINE_SUBSTITUTION'*/;
 /*!40103 SET TIME_ZONE='+00:00' */;
-INSERT INTO `annas_archive_meta_aac_filenames` VALUES("cerlalc_records","annas_archive_meta__aacid__cerlalc_records__20240918T044206Z--20240918T044206Z.jsonl.seekable.zst")
-,("czech_oo42hcks_records","annas_archive_meta__aacid__czech_oo42hcks_records__20240917T175820Z--20240917T175820Z.jsonl.seekable.zst")
-,("duxiu_files","annas_archive_meta__aacid__duxiu_files__20240312T053315Z--20240312T133715Z.jsonl.seekable.zst")
-,("duxiu_records","annas_archive_meta__aacid__duxiu_records__20240130T000000Z--20240305T000000Z.jsonl.seekable.zst")
-,("ebscohost_records","annas_archive_meta__aacid__ebscohost_records__20240823T161729Z--Wk44RExtNXgJ3346eBgRk9.jsonl.seekable.zst")
-,("gbooks_records","annas_archive_meta__aacid__gbooks_records__20240920T051416Z--20240920T051416Z.jsonl.seekable.zst")
-,("goodreads_records","annas_archive_meta__aacid__goodreads_records__20240913T115838Z--20240913T115838Z.jsonl.seekable.zst")
-,("ia2_acsmpdf_files","annas_archive_meta__aacid__ia2_acsmpdf_files__20231008T203648Z--20240126T083250Z.jsonl.seekable.zst")
-,("ia2_records","annas_archive_meta__aacid__ia2_records__20240126T065114Z--20240126T070601Z.jsonl.seekable.zst")
-,("isbngrp_records","annas_archive_meta__aacid__isbngrp_records__20240920T194930Z--20240920T194930Z.jsonl.seekable.zst")
-,("libby_records","annas_archive_meta__aacid__libby_records__20240911T184811Z--20240911T184811Z.jsonl.seekable.zst")
-,("magzdb_records","annas_archive_meta__aacid__magzdb_records__20240906T130340Z--20240906T130340Z.jsonl.seekable.zst")
-,("nexusstc_records","annas_archive_meta__aacid__nexusstc_records__20240130T000000Z--20240305T000000Z.jsonl.seekable.zst")
-,("rgb_records","annas_archive_meta__aacid__rgb_records__20240919T161201Z--20240919T161201Z.jsonl.seekable.zst")
-,("trantor_records","annas_archive_meta__aacid__trantor_records__20240911T134314Z--20240911T134314Z.jsonl.seekable.zst")
-,("upload_files","annas_archive_meta__aacid__upload_files__20240510T042523Z--20240527T233501Z.jsonl.seekable.zst")
-,("upload_records","annas_archive_meta__aacid__upload_records__20240627T210538Z--20240627T230953Z.jsonl.seekable.zst")
-,("worldcat","annas_archive_meta__aacid__worldcat__20231001T025039Z--20231001T235839Z.jsonl.seekable.zst")
-,("zlib3_files","annas_archive_meta__aacid__zlib3_files__20230808T051503Z--20240402T183036Z.jsonl.seekable.zst")
-,("zlib3_records","annas_archive_meta__aacid__zlib3_records__20230808T014342Z--20240808T064842Z.jsonl.seekable.zst")
+INSERT INTO `annas_archive_meta_aac_filenames` VALUES("cerlalc_records","annas_archive_meta__aacid__cerlalc_records__20240918T044206Z--20240918T044206Z.jsonl.seekable.zst",146380,"aacid__cerlalc_records__20240918T044206Z__9e8g2TN6CskZoH6BhXxSLm",143187)
+,("czech_oo42hcks_records","annas_archive_meta__aacid__czech_oo42hcks_records__20240917T175820Z--20240917T175820Z.jsonl.seekable.zst",8485,"aacid__czech_oo42hcks_records__20240917T175820Z__jQigv6dggvm694JoqnnuUa",6474)
+,("duxiu_files","annas_archive_meta__aacid__duxiu_files__20240312T053315Z--20240312T133715Z.jsonl.seekable.zst",863,"aacid__duxiu_files__20240312T104651Z__kg47jf3QMsUx6UknrAsM5K",574)
+,("duxiu_records","annas_archive_meta__aacid__duxiu_records__20240130T000000Z--20240305T000000Z.jsonl.seekable.zst",13085178,"aacid__duxiu_records__20240205T000000Z__6zNPtVef7GFMUCKoLnjPjv",13084800)
+,("ebscohost_records","annas_archive_meta__aacid__ebscohost_records__20240823T161729Z--Wk44RExtNXgJ3346eBgRk9.jsonl.seekable.zst",5868,"aacid__ebscohost_records__20240823T161746Z__dNKnzFACHDdK3LMXwKKT7g",3287)
+,("gbooks_records","annas_archive_meta__aacid__gbooks_records__20240920T051416Z--20240920T051416Z.jsonl.seekable.zst",774,"aacid__gbooks_records__20240920T051416Z__hZWWDbYMq2FEpiTDTfeLVo",447)
+,("goodreads_records","annas_archive_meta__aacid__goodreads_records__20240913T115838Z--20240913T115838Z.jsonl.seekable.zst",27176,"aacid__goodreads_records__20240913T115838Z__247037__LVAZR2wXYx3bJKK2nHQmJY",27052)
+,("ia2_acsmpdf_files","annas_archive_meta__aacid__ia2_acsmpdf_files__20231008T203648Z--20240126T083250Z.jsonl.seekable.zst",575,"aacid__ia2_acsmpdf_files__20240823T234615Z__Kxw3rjhx89g75T5rYtMPE6",285)
+,("ia2_records","annas_archive_meta__aacid__ia2_records__20240126T065114Z--20240126T070601Z.jsonl.seekable.zst",27752,"aacid__ia2_records__20240126T070531Z__cT7Di2ntyu3QYKZCi8xKEH",23091)
+,("isbngrp_records","annas_archive_meta__aacid__isbngrp_records__20240920T194930Z--20240920T194930Z.jsonl.seekable.zst",1329,"aacid__isbngrp_records__20240920T194930Z__PgSm6KeKE2mpmrsuTPVwNj",563)
+,("libby_records","annas_archive_meta__aacid__libby_records__20240911T184811Z--20240911T184811Z.jsonl.seekable.zst",29044,"aacid__libby_records__20240911T184811Z__10371794__nPvACiqWYy5Cf7WcDULvfM",23670)
+,("magzdb_records","annas_archive_meta__aacid__magzdb_records__20240906T130340Z--20240906T130340Z.jsonl.seekable.zst",18405,"aacid__magzdb_records__20240906T130340Z__publication_63__XBYdT2VnhKuFfo7mTDZhL7",15133)
+,("nexusstc_records","annas_archive_meta__aacid__nexusstc_records__20240130T000000Z--20240305T000000Z.jsonl.seekable.zst",35325,"aacid__nexusstc_records__20240516T152812Z__7ck1kAjKFPGL7hCYPT4ZPK",34277)
+,("rgb_records","annas_archive_meta__aacid__rgb_records__20240919T161201Z--20240919T161201Z.jsonl.seekable.zst",15891,"aacid__rgb_records__20240919T161201Z__gPYuFNvhu8SkLvYvJuMFjz",11383)
+,("trantor_records","annas_archive_meta__aacid__trantor_records__20240911T134314Z--20240911T134314Z.jsonl.seekable.zst",6237,"aacid__trantor_records__20240911T134314Z__BAAHrjBHu943Ehof4Y3Wef",5369)
+,("upload_files","annas_archive_meta__aacid__upload_files__20240510T042523Z--20240527T233501Z.jsonl.seekable.zst",9934,"aacid__upload_files_misc__20240510T071833Z__dPRWcRoeyyNcRmVVAzmVfw",9633)
+,("upload_records","annas_archive_meta__aacid__upload_records__20240627T210538Z--20240627T230953Z.jsonl.seekable.zst",258706,"aacid__upload_records_misc__20240627T233937Z__495639__3kP8itPUSuCvKiCfK4fLki",256277)
+,("worldcat","annas_archive_meta__aacid__worldcat__20231001T025039Z--20231001T235839Z.jsonl.seekable.zst",2465186,"aacid__worldcat__20231001T161012Z__909713202__fvRvgPk5mseB2fuEkSDZVs",2463219)
+,("zlib3_files","annas_archive_meta__aacid__zlib3_files__20230808T051503Z--20240402T183036Z.jsonl.seekable.zst",777,"aacid__zlib3_files__20230906T023739Z__25897131__JxN4C38XX633nmpuER3shH",506)
+,("zlib3_records","annas_archive_meta__aacid__zlib3_records__20230808T014342Z--20240808T064842Z.jsonl.seekable.zst",199378,"aacid__zlib3_records__20240809T215546Z__27250306__oFf82h43Ta6EuVERvbVjp9",197402)
 ;